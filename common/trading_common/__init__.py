@@ -0,0 +1 @@
+# trading_common — общий код сервисов, устанавливается в каждый сервис через requirements.txt (строка ../common)
@@ -0,0 +1,32 @@
+# binance_weight.py
+# 🔸 Token bucket по весу запросов Binance REST (лимит на IP в минуту)
+#    Синхронизируется с X-MBX-USED-WEIGHT-1M: вес, потраченный другими процессами того же IP, тоже учитывается
+
+import asyncio
+import time
+
+
+class WeightBucket:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.tokens = capacity
+        self.rate = capacity / 60
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, weight):
+        while True:
+            self.refill()
+            if self.tokens >= weight:
+                self.tokens -= weight
+                return
+            await asyncio.sleep((weight - self.tokens) / self.rate)
+
+    # Сервер сообщает фактически использованный вес за текущую минуту
+    def sync(self, used_weight):
+        self.refill()
+        self.tokens = min(self.tokens, self.capacity - used_weight)
@@ -0,0 +1,240 @@
+# indicator_core.py
+# 🔸 Инкрементальные состояния индикаторов — общие для indicators_v2 (закрытые бары) и live_indicators (пробный бар)
+#    update — закрытый бар продвигает состояние, preview — пробный бар без изменения состояния
+
+import math
+import numpy as np
+from collections import deque
+
+# 🔸 Коэффициент сглаживания как в pandas.ewm (через center of mass — для побитового совпадения)
+def ewm_alpha(span=None, alpha=None):
+    com = (span - 1) / 2 if span is not None else 1 / alpha - 1
+    return 1 / (1 + com)
+
+# 🔸 Один шаг ewm(adjust=False): та же формула, что в pandas
+def ewm_step(prev, value, alpha):
+    if prev is None or prev != prev:
+        return value
+    if prev != value:
+        prev = ((1 - alpha) * prev + alpha * value) / ((1 - alpha) + alpha)
+    return prev
+
+# 🔸 EMA: closes.ewm(span=length, adjust=False)
+class EmaState:
+    def __init__(self, length):
+        self.alpha = ewm_alpha(span=length)
+        self.ema = None
+
+    def update(self, high, low, close, volume):
+        self.ema = ewm_step(self.ema, close, self.alpha)
+        return self.ema
+
+    def preview(self, high, low, close, volume):
+        return ewm_step(self.ema, close, self.alpha)
+
+# 🔸 RSI (Wilder): ewm(alpha=1/length) по приростам и падениям close
+class RsiState:
+    def __init__(self, length):
+        self.alpha = ewm_alpha(alpha=1 / length)
+        self.prev_close = None
+        self.avg_gain = None
+        self.avg_loss = None
+
+    def step(self, close):
+        delta = close - self.prev_close
+        avg_gain = ewm_step(self.avg_gain, max(delta, 0.0), self.alpha)
+        avg_loss = ewm_step(self.avg_loss, -min(delta, 0.0), self.alpha)
+        return avg_gain, avg_loss
+
+    @staticmethod
+    def value(avg_gain, avg_loss):
+        if avg_loss == 0:
+            return 100.0 if avg_gain > 0 else None
+        rs = avg_gain / avg_loss
+        return 100 - (100 / (1 + rs))
+
+    def update(self, high, low, close, volume):
+        if self.prev_close is None:
+            self.prev_close = close
+            return None
+        self.avg_gain, self.avg_loss = self.step(close)
+        self.prev_close = close
+        return self.value(self.avg_gain, self.avg_loss)
+
+    def preview(self, high, low, close, volume):
+        if self.prev_close is None:
+            return None
+        return self.value(*self.step(close))
+
+# 🔸 ATR: true range со сглаживанием ewm(alpha=1/length)
+class AtrState:
+    def __init__(self, length):
+        self.alpha = ewm_alpha(alpha=1 / length)
+        self.prev_close = None
+        self.atr = None
+
+    def step(self, high, low):
+        if self.prev_close is None:
+            tr = abs(high - low)
+        else:
+            tr = max(abs(high - low), abs(high - self.prev_close), abs(low - self.prev_close))
+        return ewm_step(self.atr, tr, self.alpha)
+
+    def update(self, high, low, close, volume):
+        self.atr = self.step(high, low)
+        self.prev_close = close
+        return self.atr
+
+    def preview(self, high, low, close, volume):
+        return self.step(high, low)
+
+# 🔸 MFI: скользящее окно положительного/отрицательного денежного потока
+class MfiState:
+    RESUM_EVERY = 1000  # периодический пересчёт сумм — защита от накопления ошибки
+
+    def __init__(self, length):
+        self.length = length
+        self.prev_tp = None
+        self.flows = deque(maxlen=length)
+        self.pos_sum = 0.0
+        self.neg_sum = 0.0
+        self.pos_count = 0  # ненулевых потоков в окне: пустое окно даёт ровно 0, без остатка округления
+        self.neg_count = 0
+        self.updates = 0
+
+    # Окно после добавления бара: (tp, поток, суммы, счётчики) — без изменения состояния
+    def step(self, high, low, close, volume):
+        tp = (high + low + close) / 3
+        rmf = tp * volume
+        pos = neg = 0.0
+        if self.prev_tp is not None:
+            if tp > self.prev_tp:
+                pos = rmf
+            elif tp < self.prev_tp:
+                neg = rmf
+
+        pos_sum, neg_sum = self.pos_sum, self.neg_sum
+        pos_count, neg_count = self.pos_count, self.neg_count
+        if len(self.flows) == self.length:
+            old_pos, old_neg = self.flows[0]
+            pos_sum -= old_pos
+            neg_sum -= old_neg
+            pos_count -= old_pos != 0
+            neg_count -= old_neg != 0
+        pos_sum += pos
+        neg_sum += neg
+        pos_count += pos != 0
+        neg_count += neg != 0
+        if pos_count == 0:
+            pos_sum = 0.0
+        if neg_count == 0:
+            neg_sum = 0.0
+        return tp, (pos, neg), pos_sum, neg_sum, pos_count, neg_count
+
+    def value(self, pos_sum, neg_sum, filled):
+        if filled < self.length:
+            return None
+        neg_sum = neg_sum if neg_sum != 0 else 1e-6  # защита от деления на 0
+        mfr = pos_sum / neg_sum
+        return 100 - (100 / (1 + mfr))
+
+    def update(self, high, low, close, volume):
+        self.prev_tp, flow, self.pos_sum, self.neg_sum, self.pos_count, self.neg_count = \
+            self.step(high, low, close, volume)
+        self.flows.append(flow)
+
+        self.updates += 1
+        if self.updates % self.RESUM_EVERY == 0:
+            self.pos_sum = math.fsum(p for p, _ in self.flows)
+            self.neg_sum = math.fsum(n for _, n in self.flows)
+        return self.value(self.pos_sum, self.neg_sum, len(self.flows))
+
+    def preview(self, high, low, close, volume):
+        _, _, pos_sum, neg_sum, _, _ = self.step(high, low, close, volume)
+        return self.value(pos_sum, neg_sum, min(len(self.flows) + 1, self.length))
+
+# 🔸 Канал линейной регрессии по суммам окна (y отсчитаны от offset, x = 0..n-1)
+#    Совпадает с np.polyfit по окну: линия МНК, std остатков, угол по нормированным ценам.
+#    Работает и со скалярами, и с массивами сумм (пакетный расчёт).
+def lr_from_sums(n, sy, sxy, syy, offset):
+    x_mean = (n - 1) / 2
+    sxx = n * (n * n - 1) / 12  # сумма (x - x_mean)^2
+    y_mean = sy / n
+    slope = (sxy - x_mean * sy) / sxx
+    mid = offset + y_mean
+    last = mid + slope * x_mean  # значение линии на последнем баре
+
+    sse = np.maximum(syy - sy * y_mean - slope * slope * sxx, 0.0)
+    std_dev = np.sqrt(sse / n)
+    angle = np.degrees(np.arctan(slope / mid))
+    return last + 2 * std_dev, last - 2 * std_dev, last, angle
+
+# 🔸 LR: скользящие суммы Σy, Σxy, Σy² по окну length, O(1) на бар
+#    Цены отсчитываются от offset (последняя цена на момент пересчёта) — без потери точности в Σy²
+class LrState:
+    def __init__(self, length):
+        self.length = length
+        self.window = deque(maxlen=length)
+        self.offset = None
+        self.sy = 0.0
+        self.sxy = 0.0
+        self.syy = 0.0
+        self.updates = 0
+
+    def resum(self, offset):
+        self.offset = offset
+        ys = [c - offset for c in self.window]
+        self.sy = math.fsum(ys)
+        self.syy = math.fsum(y * y for y in ys)
+        self.sxy = math.fsum(i * y for i, y in enumerate(ys))
+
+    # Суммы окна после добавления close — без изменения состояния
+    def step(self, close):
+        offset = close if self.offset is None else self.offset
+        y = close - offset
+        sy, sxy, syy = self.sy, self.sxy, self.syy
+
+        if len(self.window) == self.length:
+            old = self.window[0] - offset
+            sxy -= sy - old  # сдвиг x на 1 для оставшихся баров
+            sy -= old
+            syy -= old * old
+            x = self.length - 1
+        else:
+            x = len(self.window)
+        return offset, sy + y, sxy + x * y, syy + y * y
+
+    def value(self, offset, sy, sxy, syy, filled):
+        if filled < self.length:
+            return None
+        return tuple(float(v) for v in lr_from_sums(self.length, sy, sxy, syy, offset))
+
+    def update(self, high, low, close, volume):
+        self.offset, self.sy, self.sxy, self.syy = self.step(close)
+        self.window.append(close)
+
+        # Полный пересчёт раз в окно — ошибка скользящих сумм не накапливается
+        self.updates += 1
+        if self.updates % self.length == 0:
+            self.resum(close)
+        return self.value(self.offset, self.sy, self.sxy, self.syy, len(self.window))
+
+    def preview(self, high, low, close, volume):
+        return self.value(*self.step(close), min(len(self.window) + 1, self.length))
+
+# 🔸 Реестр классов состояний по типу индикатора
+STATE_CLASSES = {
+    "EMA": EmaState,
+    "RSI": RsiState,
+    "ATR": AtrState,
+    "MFI": MfiState,
+    "LR": LrState,
+}
+
+# 🔸 Прогрев состояния по всей истории свечей
+def warmup_state(kind, length, high, low, close, volume):
+    state = STATE_CLASSES[kind](length)
+    value = None
+    for i in range(len(close)):
+        value = state.update(high[i], low[i], close[i], volume[i])
+    return state, value
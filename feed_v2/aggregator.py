@@ -1,51 +1,141 @@
 # aggregator.py
-# Агрегация свечей M1 в старшие таймфреймы по сигналам из Redis
+# Агрегация свечей M1 в старшие таймфреймы: инкрементально в памяти, с fallback на БД
 
 # 0. Импорты
 import asyncio
-import asyncpg
-import redis.asyncio as aioredis
 import json
-from datetime import datetime, timedelta
-
-# 1. Подписка на Redis и запуск агрегации
-async def start_aggregator(redis, pg_pool):
-    pubsub = redis.pubsub()
-    await pubsub.subscribe("ohlcv_aggregate")
-    print("[AGGREGATOR] Подписка на ohlcv_aggregate активна", flush=True)
+from decimal import Decimal
+from datetime import timedelta
+
+# Длительность интервалов в минутах
+INTERVAL_MINUTES = {
+    "m5": 5,
+    "m15": 15,
+    "m30": 30,
+    "h1": 60,
+    "h4": 240
+}
+
+# Накопители OHLCV по (symbol, interval)
+accumulators = {}
+
+
+# 1. Начало бакета интервала для open_time (выравнивание от начала суток)
+def bucket_start(open_time, minutes):
+    day_start = open_time.replace(hour=0, minute=0, second=0, microsecond=0)
+    offset = (open_time.hour * 60 + open_time.minute) // minutes * minutes
+    return day_start + timedelta(minutes=offset)
+
+
+# 1.1 Обновление накопителей закрытой M1-свечой
+# Возвращает готовые бары и интервалы, которые нужно досчитать из БД (есть дыра в накопителе)
+def roll_m1_candle(symbol, open_time, o, h, l, c, v):
+    bars = []
+    fallbacks = []
+    o, h, l, c, v = Decimal(o), Decimal(h), Decimal(l), Decimal(c), Decimal(v)
+
+    for interval, minutes in INTERVAL_MINUTES.items():
+        key = (symbol, interval)
+        start = bucket_start(open_time, minutes)
+        is_last = open_time + timedelta(minutes=1) == start + timedelta(minutes=minutes)
+        acc = accumulators.get(key)
+
+        # Запоздавшая свеча (например, из repair) — накопитель не трогаем
+        if acc is not None and start < acc["start"]:
+            if is_last:
+                fallbacks.append((symbol, interval, open_time))
+            continue
 
-    async for message in pubsub.listen():
-        if message["type"] != "message":
+        if acc is None or start > acc["start"]:
+            acc = {
+                "start": start,
+                "open": o,
+                "high": h,
+                "low": l,
+                "close": c,
+                "volume": v,
+                "count": 1,
+                "last": open_time,
+                "hole": open_time != start
+            }
+            accumulators[key] = acc
+        else:
+            if open_time != acc["last"] + timedelta(minutes=1):
+                acc["hole"] = True  # пропуск или повтор минуты
+            acc["high"] = max(acc["high"], h)
+            acc["low"] = min(acc["low"], l)
+            acc["close"] = c
+            acc["volume"] += v
+            acc["count"] += 1
+            acc["last"] = max(acc["last"], open_time)
+
+        if not is_last:
             continue
 
-        try:
-            data = json.loads(message["data"])
-            symbol = data["symbol"]
-            interval = data["interval"]
-            until_str = data["until"]
-            until_dt = datetime.fromisoformat(until_str)
+        if acc["hole"] or acc["count"] != minutes:
+            fallbacks.append((symbol, interval, open_time))
+        else:
+            bars.append((interval, symbol, start, acc["open"], acc["high"], acc["low"], acc["close"], acc["volume"]))
+        del accumulators[key]
 
-            await aggregate_candles(pg_pool, redis, symbol, interval, until_dt)
+    return bars, fallbacks
 
-        except Exception as e:
-            print(f"[ERROR] Ошибка в start_aggregator: {e}", flush=True)
 
+# 1.2 Запись готовых баров (по одному executemany на интервал)
+async def save_aggregated_bars(conn, bars):
+    by_interval = {}
+    for interval, *row in bars:
+        by_interval.setdefault(interval, []).append(row)
 
-# 2. Агрегация свечей M1 в OHLCV для указанного интервала
-async def aggregate_candles(pg_pool, redis, symbol, interval, until_time):
-    interval_map = {
-        "m5": 5,
-        "m15": 15,
-        "m30": 30,
-        "h1": 60,
-        "h4": 240
+    for interval, rows in by_interval.items():
+        await conn.executemany(
+            f"""
+            INSERT INTO ohlcv2_{interval} (symbol, open_time, open, high, low, close, volume, source)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, 'aggregated')
+            ON CONFLICT DO NOTHING
+            """,
+            rows
+        )
+        print(f"[AGGREGATOR] Агрегация {interval} готова для {len(rows)} тикеров", flush=True)
+
+
+# 1.3 Уведомления о готовности интервалов
+def build_aggregate_notifications(bars):
+    return [
+        (f"ohlcv_{interval}_ready", build_aggregate_message(symbol, interval, start, o, h, l, c, v))
+        for interval, symbol, start, o, h, l, c, v in bars
+    ]
+
+
+# 1.3.1 Сообщение о готовности интервала (с OHLCV бара)
+def build_aggregate_message(symbol, interval, start, o, h, l, c, v):
+    return {
+        "action": "aggregate_ready",
+        "symbol": symbol,
+        "interval": interval,
+        "open_time": start.isoformat(),
+        "open": str(o),
+        "high": str(h),
+        "low": str(l),
+        "close": str(c),
+        "volume": str(v)
     }
 
-    if interval not in interval_map:
+
+# 1.4 Досчёт интервалов из БД в фоне (накопитель неполный)
+def schedule_fallbacks(pg_pool, redis, fallbacks):
+    for symbol, interval, until_time in fallbacks:
+        print(f"[AGGREGATOR] Накопитель неполный, агрегация из БД: {symbol} {interval} @ {until_time}", flush=True)
+        asyncio.create_task(aggregate_candles(pg_pool, redis, symbol, interval, until_time))
+
+
+# 2. Агрегация свечей M1 в OHLCV для указанного интервала
+async def aggregate_candles(pg_pool, redis, symbol, interval, until_time):
+    if interval not in INTERVAL_MINUTES:
         print(f"[AGGREGATOR] Пропущен неизвестный интервал: {interval}", flush=True)
         return
 
-    count = interval_map[interval]
+    count = INTERVAL_MINUTES[interval]
     start_time = until_time - timedelta(minutes=count - 1)
 
     async with pg_pool.acquire() as conn:
@@ -92,12 +182,7 @@ async def aggregate_candles(pg_pool, redis, symbol, interval, until_time):
 
         # Публикация готовности интервала
         channel = f"ohlcv_{interval}_ready"
-        message = {
-            "action": "aggregate_ready",
-            "symbol": symbol,
-            "interval": interval,
-            "open_time": start_time.isoformat()
-        }
+        message = build_aggregate_message(symbol, interval, start_time, open, high, low, close, volume)
         try:
             await redis.publish(channel, json.dumps(message))
             print(f"[REDIS] Published to {channel}: {message}", flush=True)
@@ -0,0 +1,87 @@
+# bench_m1_writer.py
+# Бенчмарк батчевой записи M1: N символов закрывают свечу в один момент, замер латентности флаша p50/p99
+#
+# Запуск: DATABASE_URL=... python bench_m1_writer.py --symbols 300 --rounds 20 [--with-redis]
+# Пишет в ohlcv2_* тестовые символы BENCH*USDT и удаляет их по завершении.
+
+# 0. Импорты
+import argparse
+import asyncio
+import os
+import statistics
+import time
+import asyncpg
+import redis.asyncio as aioredis
+from datetime import datetime, timedelta
+
+import m1_writer
+from m1_writer import submit_m1_candle, flush_latencies
+from aggregator import INTERVAL_MINUTES
+from ws_decoder import Kline
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+REDIS_HOST = os.getenv("REDIS_HOST")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
+
+BENCH_PREFIX = "BENCH"
+
+
+# 1. Процентиль по отсортированному списку
+def percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+# 2. Один раунд: все символы закрывают одну и ту же минуту
+async def run_round(pg_pool, redis, symbols, open_time):
+    ts = int(open_time.timestamp() * 1000)
+    kline = Kline(t=ts, T=ts + 59_999, o="100.0", h="101.0", l="99.0", c="100.5", v="12.5", x=True)
+    started = time.perf_counter()
+    await asyncio.gather(*(submit_m1_candle(pg_pool, redis, symbol, kline) for symbol in symbols))
+    return time.perf_counter() - started
+
+
+# 3. Основной сценарий бенчмарка
+async def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк батчевой записи M1-свечей")
+    parser.add_argument("--symbols", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--with-redis", action="store_true", help="публиковать уведомления в Redis")
+    args = parser.parse_args()
+
+    pg_pool = await asyncpg.create_pool(DATABASE_URL)
+    redis = None
+    if args.with_redis:
+        redis = aioredis.Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, ssl=True)
+
+    symbols = [f"{BENCH_PREFIX}{i:04d}USDT" for i in range(args.symbols)]
+    base_time = datetime.utcnow().replace(second=0, microsecond=0) - timedelta(days=3650)
+
+    print(f"[BENCH] Символов: {args.symbols}, раундов: {args.rounds}, "
+          f"окно: {m1_writer.FLUSH_DELAY * 1000:.0f} мс, батч: {m1_writer.MAX_BATCH}", flush=True)
+
+    round_times = []
+    try:
+        for i in range(args.rounds):
+            round_times.append(await run_round(pg_pool, redis, symbols, base_time + timedelta(minutes=i)))
+    finally:
+        async with pg_pool.acquire() as conn:
+            for table in ["ohlcv2_m1"] + [f"ohlcv2_{interval}" for interval in INTERVAL_MINUTES]:
+                await conn.execute(f"DELETE FROM {table} WHERE symbol LIKE $1", f"{BENCH_PREFIX}%")
+        if redis:
+            await redis.aclose()
+        await pg_pool.close()
+
+    flushes = [t * 1000 for t in flush_latencies]
+    rounds = [t * 1000 for t in round_times]
+    print(f"[BENCH] Флашей: {len(flushes)}, свечей на флаш: {args.symbols * args.rounds / max(len(flushes), 1):.0f}", flush=True)
+    print(f"[BENCH] Флаш: p50={percentile(flushes, 50):.1f} мс, p99={percentile(flushes, 99):.1f} мс, "
+          f"mean={statistics.mean(flushes):.1f} мс", flush=True)
+    print(f"[BENCH] Закрытие минуты (все символы): p50={percentile(rounds, 50):.1f} мс, "
+          f"p99={percentile(rounds, 99):.1f} мс", flush=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
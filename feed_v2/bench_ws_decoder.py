@@ -0,0 +1,74 @@
+# bench_ws_decoder.py
+# Микро-бенчмарк разбора сообщений WebSocket: пропускная способность на одно ядро
+#
+# Запуск: python bench_ws_decoder.py [--frames frames.txt] [--seconds 3]
+# frames.txt — записанные сообщения combined stream, по одному на строку.
+# Без файла генерируется типичная минута: 60 незакрытых kline + 1 закрытая + 20 markPrice на символ.
+# Сравнение декодеров: WS_DECODER=json|orjson|msgspec python bench_ws_decoder.py
+
+# 0. Импорты
+import argparse
+import json
+import time
+
+from ws_decoder import DECODER, decode_message
+
+
+# 1. Синтетические сообщения для одного символа за минуту
+def synthetic_frames(symbols=50):
+    frames = []
+    for i in range(symbols):
+        symbol = f"sym{i}usdt"
+        for n in range(61):
+            kline = {
+                "e": "kline", "E": 1700000000000 + n * 1000, "s": symbol.upper(),
+                "k": {
+                    "t": 1700000000000, "T": 1700000059999, "s": symbol.upper(), "i": "1m",
+                    "f": 100, "L": 200, "o": "0.01000", "c": "0.01010", "h": "0.01020",
+                    "l": "0.00990", "v": "123456", "n": 100, "x": n == 60,
+                    "q": "1234.5", "V": "654", "Q": "6.54", "B": "0"
+                }
+            }
+            frames.append(json.dumps({"stream": f"{symbol}@kline_1m", "data": kline}, separators=(",", ":")))
+        for n in range(20):
+            mark = {"e": "markPriceUpdate", "E": 1700000000000 + n * 3000, "s": symbol.upper(),
+                    "p": "0.01005", "i": "0.01004", "P": "0.01006", "r": "0.0001", "T": 1700006400000}
+            frames.append(json.dumps({"stream": f"{symbol}@markPrice", "data": mark}, separators=(",", ":")))
+    return frames
+
+
+# 2. Прогон функции по сообщениям в течение заданного времени
+def measure(func, frames, seconds):
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        for frame in frames:
+            func(frame)
+        count += len(frames)
+    return count / (time.perf_counter() - started)
+
+
+# 3. Точка входа
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора сообщений WebSocket")
+    parser.add_argument("--frames", help="файл с записанными сообщениями")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    if args.frames:
+        with open(args.frames) as f:
+            frames = [line.rstrip("\n") for line in f if line.strip()]
+    else:
+        frames = synthetic_frames()
+
+    baseline = measure(json.loads, frames, args.seconds)
+    current = measure(decode_message, frames, args.seconds)
+
+    print(f"[BENCH] Сообщений в наборе: {len(frames)}", flush=True)
+    print(f"[BENCH] json.loads (всё подряд): {baseline:,.0f} сообщений/сек/ядро", flush=True)
+    print(f"[BENCH] decode_message ({DECODER} + префильтр): {current:,.0f} сообщений/сек/ядро "
+          f"(x{current / baseline:.1f})", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,11 @@
 import asyncio
 import asyncpg
 import redis.asyncio as aioredis
+import multiprocessing
 import os
+import time
+import sharding
 from m1_handler import start_all_m1_streams
-from aggregator import start_aggregator
 from markprice_watcher import start_markprice_watchers
 
 # 1. Инициализация переменных окружения
@@ -15,10 +17,12 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 REDIS_HOST = os.getenv("REDIS_HOST")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
+FEED_SHARDS = int(os.getenv("FEED_SHARDS", 1))
+FEED_PG_POOL_SIZE = int(os.getenv("FEED_PG_POOL_SIZE", 10))
 
 # 2. Основная точка входа
 async def main():
-    print("[INIT] feed_v2_main стартует", flush=True)
+    print(f"[INIT] feed_v2_main стартует (шард {sharding.SHARD_INDEX + 1}/{sharding.SHARD_COUNT})", flush=True)
     await asyncio.sleep(2)
 
     pg_pool = None
@@ -26,7 +30,7 @@ async def main():
 
     try:
         # 2.1 Подключение к PostgreSQL
-        pg_pool = await asyncpg.create_pool(DATABASE_URL)
+        pg_pool = await asyncpg.create_pool(DATABASE_URL, max_size=FEED_PG_POOL_SIZE)
         print("[PG] Подключение к PostgreSQL установлено", flush=True)
 
         # 2.2 Подключение к Redis
@@ -42,8 +46,7 @@ async def main():
         # 2.3 Запуск подписки на тикеры и WebSocket-потоков
         await start_all_m1_streams(redis, pg_pool)
 
-        # 2.4 Запуск агрегатора
-        asyncio.create_task(start_aggregator(redis, pg_pool))
+        # 2.4 Агрегация старших таймфреймов выполняется в m1_writer (aggregator.roll_m1_candle)
 
         # 2.5 Запуск markprice-потоков
         from m1_handler import get_enabled_tickers
@@ -60,6 +63,39 @@ async def main():
             await pg_pool.close()
         print("[CLOSE] Соединения закрыты", flush=True)
 
-# 3. Точка входа в асинхронный цикл
-if __name__ == "__main__":
+# 3. Запуск одного шарда в отдельном процессе
+def run_shard(index, count):
+    sharding.configure_shard(index, count)
     asyncio.run(main())
+
+
+# 4. Супервизор: N процессов-шардов, перезапуск упавших
+def supervise(count):
+    ctx = multiprocessing.get_context("spawn")
+    processes = {}
+    print(f"[SUPERVISOR] Запуск {count} шардов feed_v2", flush=True)
+
+    try:
+        while True:
+            for index in range(count):
+                process = processes.get(index)
+                if process is not None and process.is_alive():
+                    continue
+                if process is not None:
+                    print(f"[SUPERVISOR] Шард {index} завершился (код {process.exitcode}), перезапуск", flush=True)
+                process = ctx.Process(target=run_shard, args=(index, count), name=f"feed_v2-shard-{index}")
+                process.start()
+                processes[index] = process
+            time.sleep(5)
+    finally:
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+
+
+# 5. Точка входа: один процесс или супервизор шардов (FEED_SHARDS > 1)
+if __name__ == "__main__":
+    if FEED_SHARDS > 1:
+        supervise(FEED_SHARDS)
+    else:
+        asyncio.run(main())
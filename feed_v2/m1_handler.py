@@ -3,143 +3,138 @@
 
 # 0. Импорты
 import asyncio
-import websockets
 import json
-import aiohttp
+import os
+import time
 from datetime import datetime, timedelta
-
-# Глобальный словарь активных потоков по тикерам
+from stream_manager import register_handler, subscribe_streams, unsubscribe_streams
+from markprice_watcher import watch_markprice, unwatch_markprice
+from m1_writer import submit_m1_candle
+from metrics import set_metric, inc_metric, publish_metrics
+from repair_engine import repair_missing_m1
+from sharding import owns
+
+# Глобальный словарь активных потоков по тикерам: {symbol: имя потока}
 active_tickers = {}
 
+# Первая полная минута после подписки (для тикеров, активированных на ходу)
+subscribed_at = {}
+
+# Глубина проверки пропущенных свечей в минутах
+MISSING_M1_LOOKBACK = int(os.getenv("MISSING_M1_LOOKBACK", 10))
+
+# Очередь закрытых свечей между чтением сокета и записью в БД
+KLINE_QUEUE_SIZE = int(os.getenv("KLINE_QUEUE_SIZE", 5000))
+KLINE_WRITERS = int(os.getenv("KLINE_WRITERS", 4))
+KLINE_WRITER_BATCH = int(os.getenv("KLINE_WRITER_BATCH", 500))
+KLINE_OVERFLOW = os.getenv("KLINE_OVERFLOW", "drop_oldest")  # drop_oldest | drop_new | block
+
+kline_queue = asyncio.Queue(maxsize=KLINE_QUEUE_SIZE)
+
+KLINE_STREAM = "kline_1m"
 
-# 1. Запрос активных тикеров из базы данных
+
+# 1. Запрос активных тикеров из базы данных (только обслуживаемые этим шардом)
 async def get_enabled_tickers(pg_pool):
     async with pg_pool.acquire() as conn:
         rows = await conn.fetch("SELECT symbol FROM tickers WHERE status = 'enabled'")
-        return [row["symbol"] for row in rows]
+        return [row["symbol"] for row in rows if owns(row["symbol"])]
 
 
-# 2. Публикация в Redis с защитой от падения
-async def safe_publish(redis, channel, message):
-    try:
-        await redis.publish(channel, json.dumps(message))
-        print(f"[REDIS] Published to {channel}: {message}", flush=True)
-    except Exception as e:
-        print(f"[ERROR] Redis publish failed: {e}", flush=True)
-# 3. Сохранение M1-свечи в базу данных
+# 2. Сохранение M1-свечи: батчевая запись в ohlcv2_m1 и уведомления в Redis (m1_writer)
 async def save_m1_candle(pg_pool, redis, symbol, kline):
-    open_time = datetime.utcfromtimestamp(kline["t"] / 1000)
-    
-    async with pg_pool.acquire() as conn:
-        await conn.execute(
-            """
-            INSERT INTO ohlcv2_m1 (symbol, open_time, open, high, low, close, volume, source)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
-            ON CONFLICT (symbol, open_time) DO UPDATE
-            SET open = EXCLUDED.open,
-                high = EXCLUDED.high,
-                low = EXCLUDED.low,
-                close = EXCLUDED.close,
-                volume = EXCLUDED.volume,
-                source = EXCLUDED.source
-            """,
-            symbol,
-            open_time,
-            kline["o"],
-            kline["h"],
-            kline["l"],
-            kline["c"],
-            kline["v"],
-            "api" if kline.get("source") == "api" else "stream"
-        )
+    await submit_m1_candle(pg_pool, redis, symbol, kline)
+
 
-    await safe_publish(redis, "ohlcv_m1_ready", {
-        "action": "m1_ready",
-        "symbol": symbol,
-        "open_time": open_time.isoformat()
-    })
-
-    # Публикация сигнала агрегации для различных интервалов
-    if open_time.minute % 5 == 4:
-        await safe_publish(redis, "ohlcv_aggregate", {
-            "action": "aggregate",
-            "symbol": symbol,
-            "interval": "m5",
-            "until": open_time.isoformat()
-        })
-
-    if open_time.minute % 15 == 14:
-        await safe_publish(redis, "ohlcv_aggregate", {
-            "action": "aggregate",
-            "symbol": symbol,
-            "interval": "m15",
-            "until": open_time.isoformat()
-        })
-
-    if open_time.minute % 30 == 29:
-        await safe_publish(redis, "ohlcv_aggregate", {
-            "action": "aggregate",
-            "symbol": symbol,
-            "interval": "m30",
-            "until": open_time.isoformat()
-        })
-
-    if open_time.minute == 59:
-        await safe_publish(redis, "ohlcv_aggregate", {
-            "action": "aggregate",
-            "symbol": symbol,
-            "interval": "h1",
-            "until": open_time.isoformat()
-        })
-
-    if open_time.hour % 4 == 3 and open_time.minute == 59:
-        await safe_publish(redis, "ohlcv_aggregate", {
-            "action": "aggregate",
-            "symbol": symbol,
-            "interval": "h4",
-            "until": open_time.isoformat()
-        })        
-# 4. Подключение к WebSocket Binance и логирование закрытых свечей
+# 3. Подписка на kline_1m через общий combined stream
 async def subscribe_m1_kline(symbol, pg_pool, redis):
     if symbol in active_tickers:
         print(f"[M1] Уже подписан: {symbol}", flush=True)
         return
 
-    url = f"wss://fstream.binance.com/ws/{symbol.lower()}@kline_1m"
-    print(f"[M1] Подключение к WebSocket для {symbol}", flush=True)
-
-    async def stream():
-        async for ws in websockets.connect(url):
-            try:
-                async for message in ws:
-                    data = json.loads(message)
-                    kline = data.get("k", {})
-                    if kline.get("x"):  # закрытая свеча
-                        await save_m1_candle(pg_pool, redis, symbol, kline)
-            except websockets.ConnectionClosed:
-                print(f"[M1] Переподключение: {symbol}", flush=True)
-                continue
-            except Exception as e:
-                print(f"[ERROR] Ошибка WebSocket для {symbol}: {e}", flush=True)
-                await asyncio.sleep(5)
-
-    task = asyncio.create_task(stream())
-    active_tickers[symbol] = task
-
-# 5. Запуск всех текущих тикеров + Redis-слушатель + фоновая проверка
+    print(f"[M1] Подписка на {symbol}@{KLINE_STREAM}", flush=True)
+    active_tickers[symbol] = f"{symbol.lower()}@{KLINE_STREAM}"
+    subscribed_at[symbol] = datetime.utcnow().replace(second=0, microsecond=0) + timedelta(minutes=1)
+    await subscribe_streams(symbol, [KLINE_STREAM])
+
+
+# 3.1 Отписка от kline_1m при деактивации тикера
+async def unsubscribe_m1_kline(symbol):
+    if active_tickers.pop(symbol, None) is None:
+        return
+    subscribed_at.pop(symbol, None)
+
+    print(f"[M1] Отписка от {symbol}@{KLINE_STREAM}", flush=True)
+    await unsubscribe_streams(symbol, [KLINE_STREAM])
+
+
+# 3.2 Обработчик сообщений kline_1m: закрытая свеча уходит в очередь, сокет не ждёт БД
+async def handle_kline(symbol, kline):
+    if kline.x:  # закрытая свеча
+        await enqueue_kline(symbol, kline)
+
+
+# 3.3 Постановка свечи в очередь с политикой переполнения
+# Отброшенные свечи попадут в missing_m1_log и будут восстановлены repair_engine
+async def enqueue_kline(symbol, kline):
+    if KLINE_OVERFLOW == "block":
+        await kline_queue.put((symbol, kline))
+    else:
+        if kline_queue.full():
+            inc_metric("kline_queue_dropped")
+            if KLINE_OVERFLOW == "drop_new":
+                print(f"[WARN] Очередь свечей переполнена, отброшена {symbol}", flush=True)
+                return
+            dropped_symbol, _ = kline_queue.get_nowait()
+            print(f"[WARN] Очередь свечей переполнена, отброшена {dropped_symbol}", flush=True)
+        kline_queue.put_nowait((symbol, kline))
+    set_metric("kline_queue_depth", kline_queue.qsize())
+
+
+# 3.4 Writer: забирает пачку свечей из очереди и пишет их через батчевый m1_writer
+async def kline_writer(pg_pool, redis):
+    while True:
+        items = [await kline_queue.get()]
+        while len(items) < KLINE_WRITER_BATCH and not kline_queue.empty():
+            items.append(kline_queue.get_nowait())
+        set_metric("kline_queue_depth", kline_queue.qsize())
+
+        results = await asyncio.gather(
+            *(save_m1_candle(pg_pool, redis, symbol, kline) for symbol, kline in items),
+            return_exceptions=True
+        )
+
+        # Задержка от закрытия свечи (поле T) до фиксации в БД
+        now_ms = time.time() * 1000
+        lags = [now_ms - kline.T for (_, kline), result in zip(items, results)
+                if not isinstance(result, Exception)]
+        if lags:
+            set_metric("kline_commit_lag_ms", round(max(lags), 1))
+        failed = sum(isinstance(result, Exception) for result in results)
+        if failed:
+            inc_metric("kline_write_failed", failed)
+
+
+# 4. Запуск всех текущих тикеров + Redis-слушатель + фоновая проверка
 async def start_all_m1_streams(redis, pg_pool):
+    register_handler(KLINE_STREAM, handle_kline)
+    for _ in range(KLINE_WRITERS):
+        asyncio.create_task(kline_writer(pg_pool, redis))
+
     symbols = await get_enabled_tickers(pg_pool)
     print(f"[M1] Тикеры из БД: {symbols}", flush=True)
     for symbol in symbols:
         await subscribe_m1_kline(symbol, pg_pool, redis)
+        subscribed_at.pop(symbol, None)  # при старте проверяем всё окно — пропуски за время простоя
 
     asyncio.create_task(redis_listener(redis, pg_pool))
     asyncio.create_task(watch_new_tickers(pg_pool, redis))
     asyncio.create_task(check_missing_m1(pg_pool))
-    asyncio.create_task(repair_missing_m1(pg_pool, redis))
+    asyncio.create_task(repair_missing_m1(pg_pool, redis, active_tickers))
+    asyncio.create_task(publish_metrics(redis))
 
 
-# 6. Устойчивый Redis listener: восстанавливает соединение при обрыве
+# 5. Устойчивый Redis listener: восстанавливает соединение при обрыве
 async def redis_listener(redis, pg_pool):
     while True:
         try:
@@ -152,10 +147,15 @@ async def redis_listener(redis, pg_pool):
                     continue
                 try:
                     data = json.loads(message["data"])
+                    symbol = data.get("symbol", "").upper()
+                    if not symbol or not owns(symbol):
+                        continue
                     if data.get("action") == "activate":
-                        symbol = data.get("symbol", "").upper()
-                        if symbol:
-                            await subscribe_m1_kline(symbol, pg_pool, redis)
+                        await subscribe_m1_kline(symbol, pg_pool, redis)
+                        await watch_markprice(symbol, redis)
+                    elif data.get("action") == "deactivate":
+                        await unsubscribe_m1_kline(symbol)
+                        await unwatch_markprice(symbol)
                 except Exception as e:
                     print(f"[ERROR] Ошибка разбора сообщения Redis: {e}", flush=True)
 
@@ -164,7 +164,7 @@ async def redis_listener(redis, pg_pool):
             await asyncio.sleep(5)
 
 
-# 7. Периодическая проверка на новые тикеры из БД (на случай пропуска Redis-сообщения)
+# 6. Периодическая проверка на новые тикеры из БД (на случай пропуска Redis-сообщения)
 async def watch_new_tickers(pg_pool, redis):
     while True:
         try:
@@ -173,85 +173,61 @@ async def watch_new_tickers(pg_pool, redis):
                 if symbol not in active_tickers:
                     print(f"[M1] Новый тикер из БД: {symbol}", flush=True)
                     await subscribe_m1_kline(symbol, pg_pool, redis)
+                    await watch_markprice(symbol, redis)
+
+            for symbol in set(active_tickers) - set(symbols):
+                print(f"[M1] Тикер отключён в БД: {symbol}", flush=True)
+                await unsubscribe_m1_kline(symbol)
+                await unwatch_markprice(symbol)
         except Exception as e:
             print(f"[ERROR] Ошибка при проверке тикеров из БД: {e}", flush=True)
 
         await asyncio.sleep(300)
 
 
-# 8. Контроль пропущенных свечей и запись в missing_m1_log
+# 7. Контроль пропущенных свечей за окно MISSING_M1_LOOKBACK минут: один anti-join и одна вставка
 async def check_missing_m1(pg_pool):
     while True:
         try:
-            target_time = datetime.utcnow().replace(second=0, microsecond=0) - timedelta(minutes=1)
+            started = time.perf_counter()
+            end_time = datetime.utcnow().replace(second=0, microsecond=0) - timedelta(minutes=1)
+            start_time = end_time - timedelta(minutes=MISSING_M1_LOOKBACK - 1)
+            symbols = list(active_tickers)
+            since = [subscribed_at.get(symbol) for symbol in symbols]
+
             async with pg_pool.acquire() as conn:
-                for symbol in active_tickers:
-                    row = await conn.fetchrow(
-                        "SELECT 1 FROM ohlcv2_m1 WHERE symbol = $1 AND open_time = $2",
-                        symbol,
-                        target_time
+                rows = await conn.fetch(
+                    """
+                    INSERT INTO missing_m1_log (symbol, open_time)
+                    SELECT s.symbol, t.open_time
+                    FROM unnest($1::text[], $2::timestamp[]) AS s(symbol, since)
+                    CROSS JOIN LATERAL generate_series(
+                        GREATEST($3::timestamp, COALESCE(s.since, $3::timestamp)),
+                        $4::timestamp,
+                        interval '1 minute'
+                    ) AS t(open_time)
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM ohlcv2_m1 m
+                        WHERE m.symbol = s.symbol AND m.open_time = t.open_time
                     )
-                    if row is None:
-                        await conn.execute(
-                            """
-                            INSERT INTO missing_m1_log (symbol, open_time)
-                            VALUES ($1, $2)
-                            ON CONFLICT DO NOTHING
-                            """,
-                            symbol,
-                            target_time
-                        )
-                        print(f"[MISSING] Не найдена свеча M1: {symbol} @ {target_time}", flush=True)
+                    ON CONFLICT DO NOTHING
+                    RETURNING symbol, open_time
+                    """,
+                    symbols,
+                    since,
+                    start_time,
+                    end_time
+                )
+
+            for row in rows:
+                print(f"[MISSING] Не найдена свеча M1: {row['symbol']} @ {row['open_time']}", flush=True)
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            set_metric("missing_m1_sweep_ms", round(elapsed_ms, 1))
+            set_metric("missing_m1_found", len(rows))
+            print(f"[MISSING] Проверка {len(symbols)} тикеров за {MISSING_M1_LOOKBACK} мин: "
+                  f"новых пропусков {len(rows)}, {elapsed_ms:.1f} мс", flush=True)
         except Exception as e:
             print(f"[ERROR] Ошибка в check_missing_m1: {e}", flush=True)
 
         await asyncio.sleep(60)
-
-
-# 9. Автоматическое восстановление пропущенных свечей через Binance API
-async def repair_missing_m1(pg_pool, redis):
-    while True:
-        try:
-            async with pg_pool.acquire() as conn:
-                rows = await conn.fetch("SELECT symbol, open_time FROM missing_m1_log WHERE fixed = false ORDER BY open_time ASC LIMIT 10")
-                for row in rows:
-                    symbol = row["symbol"]
-                    open_time = row["open_time"]
-                    start_ts = int(open_time.timestamp() * 1000)
-                    end_ts = start_ts + 60_000 - 1
-
-                    url = f"https://fapi.binance.com/fapi/v1/klines?symbol={symbol}&interval=1m&startTime={start_ts}&endTime={end_ts}"
-
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(url) as resp:
-                            if resp.status != 200:
-                                print(f"[REPAIR] Ошибка ответа от Binance для {symbol}: {resp.status}", flush=True)
-                                continue
-                            data = await resp.json()
-                            if not data:
-                                print(f"[REPAIR] Binance вернул пусто для {symbol} @ {open_time}", flush=True)
-                                continue
-
-                            k = data[0]  # одна свеча
-                            kline = {
-                                "t": k[0],
-                                "o": k[1],
-                                "h": k[2],
-                                "l": k[3],
-                                "c": k[4],
-                                "v": k[5],
-                                "x": True,
-                                "source": "api"
-                            }
-
-                            await save_m1_candle(pg_pool, redis, symbol, kline)
-                            await conn.execute(
-                                "UPDATE missing_m1_log SET fixed = true, fixed_at = now() WHERE symbol = $1 AND open_time = $2",
-                                symbol,
-                                open_time
-                            )
-                            print(f"[REPAIR] Свеча восстановлена: {symbol} @ {open_time}", flush=True)
-        except Exception as e:
-            print(f"[ERROR] Ошибка в repair_missing_m1: {e}", flush=True)
-
-        await asyncio.sleep(30)
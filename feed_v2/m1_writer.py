@@ -0,0 +1,173 @@
+# m1_writer.py
+# Микро-батчинг записи M1-свечей: COPY в staging + одна upsert-операция + один Redis pipeline на флаш
+
+# 0. Импорты
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from aggregator import (
+    INTERVAL_MINUTES,
+    roll_m1_candle,
+    save_aggregated_bars,
+    build_aggregate_notifications,
+    schedule_fallbacks
+)
+from metrics import set_metric
+
+# 1. Настройки
+FLUSH_DELAY = float(os.getenv("M1_FLUSH_DELAY_MS", 20)) / 1000  # окно накопления свечей
+MAX_BATCH = int(os.getenv("M1_MAX_BATCH", 1000))                # принудительный флаш при переполнении
+
+STAGING_TABLE = "ohlcv2_m1_staging"
+COLUMNS = ["symbol", "open_time", "open", "high", "low", "close", "volume", "source"]
+
+# Очередь ожидающих записи свечей: [(record, future)]
+pending = []
+flush_now = asyncio.Event()
+flush_task = None
+
+# Длительность последних флашей в секундах (для метрик и бенчмарка)
+flush_latencies = deque(maxlen=1000)
+
+
+# 2. Уведомление о готовности M1-свечи (с OHLCV — подписчикам не нужно перечитывать бар из БД)
+def build_m1_notification(symbol, open_time, o, h, l, c, v):
+    return ("ohlcv_m1_ready", {
+        "action": "m1_ready",
+        "symbol": symbol,
+        "open_time": open_time.isoformat(),
+        "open": str(o),
+        "high": str(h),
+        "low": str(l),
+        "close": str(c),
+        "volume": str(v)
+    })
+
+
+# 3. Постановка свечи в батч и ожидание её записи
+async def submit_m1_candle(pg_pool, redis, symbol, kline):
+    global flush_task
+
+    record = (
+        symbol,
+        datetime.utcfromtimestamp(kline.t / 1000),
+        kline.o,
+        kline.h,
+        kline.l,
+        kline.c,
+        kline.v,
+        "api" if kline.source == "api" else "stream"
+    )
+    future = asyncio.get_running_loop().create_future()
+    pending.append((record, future))
+
+    if len(pending) >= MAX_BATCH:
+        flush_now.set()
+    if flush_task is None or flush_task.done():
+        flush_task = asyncio.create_task(delayed_flush(pg_pool, redis))
+
+    await future
+
+
+# 4. Ожидание окна накопления и запуск флаша
+async def delayed_flush(pg_pool, redis):
+    while pending:
+        try:
+            await asyncio.wait_for(flush_now.wait(), FLUSH_DELAY)
+        except asyncio.TimeoutError:
+            pass
+        flush_now.clear()
+
+        batch = pending[:MAX_BATCH]
+        del pending[:MAX_BATCH]
+        await flush_batch(pg_pool, redis, batch)
+
+
+# 5. Запись батча: COPY → staging, INSERT ... SELECT ... ON CONFLICT, агрегаты из памяти, затем Redis pipeline
+async def flush_batch(pg_pool, redis, batch):
+    started = time.perf_counter()
+
+    # Дедупликация по (symbol, open_time): побеждает последняя версия свечи
+    records = {}
+    for record, _ in batch:
+        records[(record[0], record[1])] = record
+
+    try:
+        async with pg_pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    f"""
+                    CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE}
+                    ON COMMIT DELETE ROWS AS
+                    SELECT {', '.join(COLUMNS)} FROM ohlcv2_m1 WITH NO DATA
+                    """
+                )
+                await conn.copy_records_to_table(
+                    STAGING_TABLE,
+                    records=list(records.values()),
+                    columns=COLUMNS
+                )
+                await conn.execute(
+                    f"""
+                    INSERT INTO ohlcv2_m1 ({', '.join(COLUMNS)})
+                    SELECT {', '.join(COLUMNS)} FROM {STAGING_TABLE}
+                    ON CONFLICT (symbol, open_time) DO UPDATE
+                    SET open = EXCLUDED.open,
+                        high = EXCLUDED.high,
+                        low = EXCLUDED.low,
+                        close = EXCLUDED.close,
+                        volume = EXCLUDED.volume,
+                        source = EXCLUDED.source
+                    """
+                )
+
+            # Инкрементальная агрегация старших таймфреймов
+            bars, fallbacks = [], []
+            for symbol, open_time, o, h, l, c, v, _ in records.values():
+                rolled, missed = roll_m1_candle(symbol, open_time, o, h, l, c, v)
+                bars.extend(rolled)
+                fallbacks.extend(missed)
+
+            if bars:
+                try:
+                    await save_aggregated_bars(conn, bars)
+                except Exception as e:
+                    print(f"[ERROR] Запись агрегатов не удалась, агрегация из БД: {e}", flush=True)
+                    fallbacks.extend((symbol, interval, start + timedelta(minutes=INTERVAL_MINUTES[interval] - 1))
+                                     for interval, symbol, start, *_ in bars)
+                    bars = []
+    except Exception as e:
+        print(f"[ERROR] Запись батча M1 ({len(records)} свечей) не удалась: {e}", flush=True)
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        return
+
+    if redis is not None:
+        messages = [build_m1_notification(*record[:7]) for record in records.values()]
+        messages.extend(build_aggregate_notifications(bars))
+        await publish_batch(redis, messages)
+        schedule_fallbacks(pg_pool, redis, fallbacks)
+
+    flush_latencies.append(time.perf_counter() - started)
+    set_metric("m1_flush_ms", round(flush_latencies[-1] * 1000, 1))
+    set_metric("m1_flush_size", len(records))
+
+    for _, future in batch:
+        if not future.done():
+            future.set_result(None)
+
+
+# 6. Публикация всех уведомлений батча одним pipeline
+async def publish_batch(redis, messages):
+    try:
+        pipe = redis.pipeline(transaction=False)
+        for channel, message in messages:
+            pipe.publish(channel, json.dumps(message))
+        await pipe.execute()
+        print(f"[REDIS] Опубликовано сообщений: {len(messages)}", flush=True)
+    except Exception as e:
+        print(f"[ERROR] Redis pipeline publish failed: {e}", flush=True)
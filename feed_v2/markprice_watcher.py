@@ -1,40 +1,76 @@
 # markprice_watcher.py
-# Получение mark price по каждому тикеру и обновление Redis
+# Получение mark price по каждому тикеру: таблица цен в памяти, пакетная запись в Redis и поток обновлений
 
 # 0. Импорты
 import asyncio
-import websockets
-import json
-import time
+import os
+from stream_manager import register_handler, subscribe_streams, unsubscribe_streams
+from metrics import set_metric
 
-# 1. Подписка на WebSocket Binance и обновление Redis
+# 1. Настройки
+MARKPRICE_STREAM = os.getenv("MARKPRICE_STREAM", "markPrice")            # markPrice (3 сек) или markPrice@1s
+PRICE_FLUSH_INTERVAL = float(os.getenv("PRICE_FLUSH_INTERVAL", 1.0))     # период записи, допускается < 1 сек
+PRICES_STREAM = os.getenv("PRICES_STREAM", "prices_stream")
+PRICES_STREAM_MAXLEN = int(os.getenv("PRICES_STREAM_MAXLEN", 10000))
+
+# Последние цены по тикерам и тикеры с изменившейся ценой с прошлой записи
+price_table = {}
+changed = set()
+
+
+# 2. Обработчик сообщений markPrice из combined stream
+def make_markprice_handler():
+    async def handle_markprice(symbol, event):
+        price = event.p
+        if price:
+            price = float(price)
+            if price_table.get(symbol) != price:
+                price_table[symbol] = price
+                changed.add(symbol)
+    return handle_markprice
+
+
+# 3. Запись изменившихся цен: один MSET и одна запись в поток на тик
+async def flush_prices(redis):
+    while True:
+        await asyncio.sleep(PRICE_FLUSH_INTERVAL)
+        if not changed:
+            continue
+
+        updates = {symbol: price_table[symbol] for symbol in changed if symbol in price_table}
+        changed.clear()
+        if not updates:
+            continue
+
+        try:
+            pipe = redis.pipeline(transaction=False)
+            pipe.mset({f"price:{symbol}": price for symbol, price in updates.items()})
+            pipe.xadd(PRICES_STREAM, updates, maxlen=PRICES_STREAM_MAXLEN, approximate=True)
+            await pipe.execute()
+            set_metric("price_updates_per_flush", len(updates))
+        except Exception as e:
+            # Тикеры возвращаются в changed — следующий сброс запишет их актуальные цены
+            changed.update(updates)
+            print(f"[ERROR] Запись цен в Redis не удалась: {e}", flush=True)
+
+
+# 4. Подписка тикера на поток markPrice
 async def watch_markprice(symbol, redis):
-    url = f"wss://fstream.binance.com/ws/{symbol.lower()}@markPrice"
-    print(f"[MARK] Подключение к потоку markPrice для {symbol}", flush=True)
-
-    async def stream():
-        last_update = 0
-        async for ws in websockets.connect(url):
-            try:
-                async for message in ws:
-                    data = json.loads(message)
-                    price = data.get("p")
-                    if price:
-                        now = time.time()
-                        if now - last_update >= 1:
-                            await redis.set(f"price:{symbol}", float(price))
-                            last_update = now
-            except websockets.ConnectionClosed:
-                print(f"[MARK] Переподключение: {symbol}", flush=True)
-                continue
-            except Exception as e:
-                print(f"[ERROR] Ошибка markPrice для {symbol}: {e}", flush=True)
-                await asyncio.sleep(5)
-
-    asyncio.create_task(stream())
-
-
-# 2. Запуск по всем тикерам
+    print(f"[MARK] Подписка на поток {MARKPRICE_STREAM} для {symbol}", flush=True)
+    await subscribe_streams(symbol, [MARKPRICE_STREAM])
+
+
+# 5. Отписка тикера от потока markPrice
+async def unwatch_markprice(symbol):
+    print(f"[MARK] Отписка от потока {MARKPRICE_STREAM} для {symbol}", flush=True)
+    price_table.pop(symbol, None)
+    changed.discard(symbol)
+    await unsubscribe_streams(symbol, [MARKPRICE_STREAM])
+
+
+# 6. Запуск по всем тикерам
 async def start_markprice_watchers(symbols, redis):
+    register_handler(MARKPRICE_STREAM, make_markprice_handler())
+    asyncio.create_task(flush_prices(redis))
     for symbol in symbols:
         await watch_markprice(symbol, redis)
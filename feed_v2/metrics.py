@@ -0,0 +1,39 @@
+# metrics.py
+# Метрики feed_v2: значения в памяти процесса + периодическая публикация в Redis-хэш
+
+# 0. Импорты
+import asyncio
+import os
+import time
+import sharding
+
+METRICS_KEY = os.getenv("FEED_METRICS_KEY", "metrics:feed_v2")
+METRICS_INTERVAL = int(os.getenv("FEED_METRICS_INTERVAL", 10))
+
+# Текущие значения метрик: {имя: число}
+metrics = {}
+
+
+# 1. Установка значения метрики
+def set_metric(name, value):
+    metrics[name] = value
+
+
+# 2. Увеличение счётчика
+def inc_metric(name, value=1):
+    metrics[name] = metrics.get(name, 0) + value
+
+
+# 3. Периодическая публикация метрик в Redis
+async def publish_metrics(redis):
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        if not metrics:
+            continue
+        try:
+            mapping = dict(metrics)
+            mapping["updated_at"] = time.time()
+            key = METRICS_KEY if sharding.SHARD_COUNT <= 1 else f"{METRICS_KEY}:{sharding.SHARD_INDEX}"
+            await redis.hset(key, mapping=mapping)
+        except Exception as e:
+            print(f"[ERROR] Публикация метрик не удалась: {e}", flush=True)
@@ -0,0 +1,6 @@
+-- Учёт попыток восстановления в missing_m1_log (repair_engine.repair_missing_m1).
+-- Применяется один раз до выката feed_v2 с подсчётом попыток: ALTER TABLE берёт ACCESS EXCLUSIVE,
+-- поэтому сервис схему не меняет — без колонок проход repair логирует ошибку и повторяется.
+ALTER TABLE missing_m1_log
+    ADD COLUMN IF NOT EXISTS attempts integer NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS last_attempt_at timestamp;
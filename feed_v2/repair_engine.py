@@ -0,0 +1,211 @@
+# repair_engine.py
+# Восстановление пропущенных M1-свечей диапазонами через Binance API с учётом лимита веса
+
+# 0. Импорты
+import asyncio
+import os
+import aiohttp
+from datetime import datetime, timedelta
+from m1_writer import submit_m1_candle
+from ws_decoder import Kline
+from metrics import set_metric, inc_metric
+import sharding
+from trading_common.binance_weight import WeightBucket
+
+# 1. Настройки
+KLINES_URL = "https://fapi.binance.com/fapi/v1/klines"
+KLINES_LIMIT = 1500                 # максимум свечей за один запрос
+KLINES_WEIGHT = 10                  # вес запроса klines при limit > 1000
+WEIGHT_LIMIT = int(os.getenv("BINANCE_WEIGHT_LIMIT", 2400))     # лимит веса в минуту на IP
+WEIGHT_RESERVE = int(os.getenv("BINANCE_WEIGHT_RESERVE", 600))  # запас для остальных клиентов
+REPAIR_BATCH = int(os.getenv("REPAIR_BATCH", 5000))             # строк missing_m1_log за один проход
+REPAIR_CONCURRENCY = int(os.getenv("REPAIR_CONCURRENCY", 4))
+REPAIR_MAX_ATTEMPTS = int(os.getenv("REPAIR_MAX_ATTEMPTS", 5))     # после стольких пустых ответов пропуск считается невосстановимым
+REPAIR_RETRY_DELAY = int(os.getenv("REPAIR_RETRY_DELAY", 600))     # секунд до повторной попытки неудачного диапазона
+
+EPOCH = datetime(1970, 1, 1)
+
+
+# 2. Token bucket по весу запросов Binance (общий с repair, синхронизируется с X-MBX-USED-WEIGHT-1M)
+weight_bucket = WeightBucket(WEIGHT_LIMIT - WEIGHT_RESERVE)
+
+
+# 3. Перевод времени в миллисекунды Binance (open_time хранится как naive UTC)
+def to_ms(dt):
+    return int((dt - EPOCH).total_seconds() * 1000)
+
+
+# 4. Группировка пропусков в диапазоны не длиннее KLINES_LIMIT минут по каждому тикеру
+def coalesce_ranges(rows):
+    ranges = []
+    current = None
+    for row in rows:
+        symbol, open_time = row["symbol"], row["open_time"]
+        if (
+            current is None
+            or current["symbol"] != symbol
+            or open_time - current["start"] >= timedelta(minutes=KLINES_LIMIT)
+        ):
+            current = {"symbol": symbol, "start": open_time, "end": open_time, "times": set()}
+            ranges.append(current)
+        current["end"] = open_time
+        current["times"].add(open_time)
+    return ranges
+
+
+# 5. Запрос свечей диапазона одним вызовом
+async def fetch_range(session, symbol, start, end):
+    params = {
+        "symbol": symbol,
+        "interval": "1m",
+        "startTime": to_ms(start),
+        "endTime": to_ms(end) + 60_000 - 1,
+        "limit": KLINES_LIMIT
+    }
+
+    while True:
+        await weight_bucket.acquire(KLINES_WEIGHT)
+        async with session.get(KLINES_URL, params=params) as resp:
+            used = resp.headers.get("X-MBX-USED-WEIGHT-1M")
+            if used is not None:
+                weight_bucket.sync(int(used))
+                set_metric("binance_used_weight_1m", int(used))
+
+            if resp.status in (418, 429):
+                retry_after = int(resp.headers.get("Retry-After", 60))
+                print(f"[REPAIR] Binance ограничил запросы ({resp.status}), пауза {retry_after} сек", flush=True)
+                await asyncio.sleep(retry_after)
+                continue
+
+            if resp.status != 200:
+                print(f"[REPAIR] Ошибка ответа от Binance для {symbol}: {resp.status}", flush=True)
+                return []
+
+            return await resp.json()
+
+
+# 6. Восстановление одного диапазона: возвращает open_time восстановленных свечей
+async def repair_range(session, pg_pool, redis, semaphore, rng):
+    symbol = rng["symbol"]
+    async with semaphore:
+        data = await fetch_range(session, symbol, rng["start"], rng["end"])
+
+    klines = []
+    for k in data:
+        open_time = EPOCH + timedelta(milliseconds=k[0])
+        if open_time not in rng["times"]:
+            continue  # свеча есть в БД, повторно не пишем
+        klines.append((open_time, Kline(
+            t=k[0],
+            T=k[6],
+            o=k[1],
+            h=k[2],
+            l=k[3],
+            c=k[4],
+            v=k[5],
+            x=True,
+            source="api"
+        )))
+
+    if not klines:
+        print(f"[REPAIR] Binance вернул пусто для {symbol} @ {rng['start']} → {rng['end']}", flush=True)
+        return symbol, []
+
+    # Все свечи уходят в батчевый writer одним пакетом
+    await asyncio.gather(*(submit_m1_candle(pg_pool, redis, symbol, kline) for _, kline in klines))
+    print(f"[REPAIR] {symbol}: восстановлено {len(klines)} из {len(rng['times'])} свечей", flush=True)
+    return symbol, [open_time for open_time, _ in klines]
+
+
+# 7. Основной цикл восстановления
+# Колонки attempts / last_attempt_at — миграция migrations/001_missing_m1_log_attempts.sql
+# Выборка по кругу между тикерами: сначала первый диапазон каждого тикера, неудачные попытки — в конце очереди,
+# поэтому тикер с постоянными пропусками не занимает весь проход
+# owned_symbols — тикеры шарда; без шардирования чинятся пропуски по всем тикерам
+async def repair_missing_m1(pg_pool, redis, owned_symbols):
+    semaphore = asyncio.Semaphore(REPAIR_CONCURRENCY)
+
+    async with aiohttp.ClientSession() as session:
+        while True:
+            repaired = 0
+            try:
+                symbols_filter = list(owned_symbols) if sharding.SHARD_COUNT > 1 else None
+                async with pg_pool.acquire() as conn:
+                    rows = await conn.fetch(
+                        """
+                        SELECT symbol, open_time
+                        FROM (
+                            SELECT symbol, open_time, attempts,
+                                   ROW_NUMBER() OVER (PARTITION BY symbol ORDER BY open_time) AS rn
+                            FROM missing_m1_log
+                            WHERE fixed = false
+                              AND attempts < $3
+                              AND (last_attempt_at IS NULL OR last_attempt_at < now() - make_interval(secs => $4))
+                              AND ($2::text[] IS NULL OR symbol = ANY($2::text[]))
+                        ) m
+                        ORDER BY attempts, (rn - 1) / $5, symbol, open_time
+                        LIMIT $1
+                        """,
+                        REPAIR_BATCH,
+                        symbols_filter,
+                        REPAIR_MAX_ATTEMPTS,
+                        REPAIR_RETRY_DELAY,
+                        KLINES_LIMIT
+                    )
+
+                rows = sorted(rows, key=lambda row: (row["symbol"], row["open_time"]))
+                ranges = coalesce_ranges(rows)
+                results = await asyncio.gather(
+                    *(repair_range(session, pg_pool, redis, semaphore, rng) for rng in ranges),
+                    return_exceptions=True
+                )
+
+                symbols, open_times = [], []
+                for result in results:
+                    if isinstance(result, Exception):
+                        print(f"[ERROR] Ошибка восстановления диапазона: {result}", flush=True)
+                        continue
+                    symbol, times = result
+                    symbols.extend([symbol] * len(times))
+                    open_times.extend(times)
+
+                if open_times:
+                    async with pg_pool.acquire() as conn:
+                        await conn.execute(
+                            """
+                            UPDATE missing_m1_log m
+                            SET fixed = true, fixed_at = now()
+                            FROM unnest($1::text[], $2::timestamp[]) AS r(symbol, open_time)
+                            WHERE m.symbol = r.symbol AND m.open_time = r.open_time
+                            """,
+                            symbols,
+                            open_times
+                        )
+
+                # Невосстановленные пропуски прохода: +1 попытка, повтор не раньше REPAIR_RETRY_DELAY
+                fixed_set = set(zip(symbols, open_times))
+                failed = [(row["symbol"], row["open_time"]) for row in rows if (row["symbol"], row["open_time"]) not in fixed_set]
+                if failed:
+                    async with pg_pool.acquire() as conn:
+                        await conn.execute(
+                            """
+                            UPDATE missing_m1_log m
+                            SET attempts = m.attempts + 1, last_attempt_at = now()
+                            FROM unnest($1::text[], $2::timestamp[]) AS r(symbol, open_time)
+                            WHERE m.symbol = r.symbol AND m.open_time = r.open_time
+                            """,
+                            [symbol for symbol, _ in failed],
+                            [open_time for _, open_time in failed]
+                        )
+                    inc_metric("repair_m1_failed_attempts", len(failed))
+
+                repaired = len(open_times)
+                inc_metric("repair_m1_fixed", repaired)
+                set_metric("repair_m1_pending", len(rows) - repaired)
+                if rows:
+                    print(f"[REPAIR] Проход: пропусков {len(rows)}, диапазонов {len(ranges)}, восстановлено {repaired}", flush=True)
+            except Exception as e:
+                print(f"[ERROR] Ошибка в repair_missing_m1: {e}", flush=True)
+
+            # Пока есть что чинить — следующий проход сразу
+            await asyncio.sleep(1 if repaired else 30)
@@ -0,0 +1,51 @@
+# sharding.py
+# Распределение тикеров между процессами feed_v2 по consistent hashing
+
+# 0. Импорты
+import bisect
+import hashlib
+import os
+
+VNODES = 64  # виртуальных узлов на шард — равномерность распределения
+
+# Текущий шард процесса (задаётся супервизором через configure_shard)
+SHARD_COUNT = int(os.getenv("FEED_SHARDS", 1))
+SHARD_INDEX = int(os.getenv("FEED_SHARD_INDEX", 0))
+
+ring = []
+ring_keys = []
+
+
+# 1. Стабильный между процессами хэш (встроенный hash() рандомизирован)
+def stable_hash(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+# 2. Построение кольца для заданного числа шардов
+def build_ring(count):
+    global ring, ring_keys
+    ring = sorted((stable_hash(f"shard-{i}-{v}"), i) for i in range(count) for v in range(VNODES))
+    ring_keys = [key for key, _ in ring]
+
+
+# 3. Настройка шарда текущего процесса
+def configure_shard(index, count):
+    global SHARD_INDEX, SHARD_COUNT
+    SHARD_INDEX = index
+    SHARD_COUNT = count
+    build_ring(count)
+
+
+# 4. Номер шарда, обслуживающего тикер
+def shard_for(symbol):
+    if SHARD_COUNT <= 1:
+        return 0
+    if not ring:
+        build_ring(SHARD_COUNT)
+    pos = bisect.bisect(ring_keys, stable_hash(symbol.upper())) % len(ring)
+    return ring[pos][1]
+
+
+# 5. Обслуживает ли текущий процесс тикер
+def owns(symbol):
+    return shard_for(symbol) == SHARD_INDEX
@@ -0,0 +1,171 @@
+# stream_manager.py
+# Мультиплексирование потоков Binance: много символов в combined stream, шардирование по сокетам
+
+# 0. Импорты
+import asyncio
+import websockets
+import json
+import os
+import random
+from ws_decoder import decode_message
+
+# 1. Настройки
+BINANCE_STREAM_URL = "wss://fstream.binance.com/stream"
+STREAMS_PER_SOCKET = int(os.getenv("FEED_STREAMS_PER_SOCKET", 150))  # лимит Binance — 200 потоков на соединение
+MAX_SOCKETS = int(os.getenv("FEED_MAX_SOCKETS", 8))
+SUBSCRIBE_BATCH = 50  # потоков в одном SUBSCRIBE/UNSUBSCRIBE фрейме
+RECONNECT_BASE_DELAY = float(os.getenv("FEED_RECONNECT_BASE_DELAY", 1))  # секунд: первая пауза переподключения
+RECONNECT_MAX_DELAY = float(os.getenv("FEED_RECONNECT_MAX_DELAY", 60))   # потолок экспоненциальной паузы
+
+# Обработчики по типу потока: {"kline_1m": handler(symbol, Kline), "markPrice": handler(symbol, MarkPrice)}
+stream_handlers = {}
+
+# Шарды (сокеты) и принадлежность потока шарду
+shards = []
+stream_shard = {}
+
+
+# 2. Один сокет combined stream с набором потоков
+class StreamShard:
+    def __init__(self, index):
+        self.index = index
+        self.streams = set()
+        self.ws = None
+        self.request_id = 0
+        self.task = None
+        self.failures = 0  # подряд неудачных подключений (без единого сообщения)
+
+    def url(self, streams):
+        return f"{BINANCE_STREAM_URL}?streams={'/'.join(sorted(streams))}"
+
+    # 2.1 Отправка SUBSCRIBE/UNSUBSCRIBE в открытый сокет
+    async def send_method(self, method, streams):
+        if self.ws is None:
+            return  # при следующем подключении потоки уйдут в URL
+        for i in range(0, len(streams), SUBSCRIBE_BATCH):
+            self.request_id += 1
+            frame = {
+                "method": method,
+                "params": streams[i:i + SUBSCRIBE_BATCH],
+                "id": self.request_id
+            }
+            try:
+                await self.ws.send(json.dumps(frame))
+            except websockets.ConnectionClosed:
+                return
+            await asyncio.sleep(0.2)  # Binance: не более 10 входящих сообщений в секунду
+
+    # 2.2 Пауза перед переподключением: экспонента от числа неудач подряд со случайной добавкой,
+    #     чтобы шарды после общего обрыва не переподключались одновременно
+    def reconnect_delay(self):
+        delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** self.failures)
+        self.failures += 1
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    # 2.3 Чтение сокета и диспетчеризация сообщений
+    async def run(self):
+        while self.streams:
+            try:
+                snapshot = set(self.streams)
+                async with websockets.connect(self.url(snapshot)) as ws:
+                    # Все потоки сняты, пока шёл коннект — сокет не нужен
+                    if not self.streams:
+                        break
+                    self.ws = ws
+                    print(f"[STREAM] Шард {self.index}: подключено {len(snapshot)} потоков", flush=True)
+
+                    # Потоки, изменённые во время подключения
+                    await self.send_method("SUBSCRIBE", sorted(self.streams - snapshot))
+                    await self.send_method("UNSUBSCRIBE", sorted(snapshot - self.streams))
+
+                    async for message in ws:
+                        self.failures = 0
+                        await dispatch_message(message)
+            except websockets.ConnectionClosed:
+                delay = self.reconnect_delay()
+                print(f"[STREAM] Шард {self.index}: переподключение через {delay:.1f} сек", flush=True)
+                await asyncio.sleep(delay)
+            except Exception as e:
+                delay = self.reconnect_delay()
+                print(f"[ERROR] Шард {self.index}: ошибка WebSocket: {e}, переподключение через {delay:.1f} сек", flush=True)
+                await asyncio.sleep(delay)
+            finally:
+                self.ws = None
+
+        print(f"[STREAM] Шард {self.index}: нет потоков, сокет закрыт", flush=True)
+
+
+# 3. Разбор сообщения combined stream и вызов обработчика
+async def dispatch_message(message):
+    decoded = decode_message(message)
+    if decoded is None:
+        return  # незакрытая свеча или ответ на SUBSCRIBE/UNSUBSCRIBE
+
+    stream, event = decoded
+    symbol, kind = stream.split("@", 1)
+    handler = stream_handlers.get(kind)
+    if handler is None:
+        return
+
+    try:
+        await handler(symbol.upper(), event)
+    except Exception as e:
+        print(f"[ERROR] Обработчик {kind} для {symbol}: {e}", flush=True)
+
+
+# 4. Регистрация обработчика для типа потока
+def register_handler(kind, handler):
+    stream_handlers[kind] = handler
+
+
+# 5. Выбор шарда с наименьшей загрузкой (новый сокет — только если есть место)
+def pick_shard():
+    candidates = [s for s in shards if len(s.streams) < STREAMS_PER_SOCKET]
+    if candidates:
+        return min(candidates, key=lambda s: len(s.streams))
+
+    if len(shards) < MAX_SOCKETS:
+        shard = StreamShard(len(shards))
+        shards.append(shard)
+        return shard
+
+    shard = min(shards, key=lambda s: len(s.streams))
+    print(f"[WARN] Достигнут лимит сокетов ({MAX_SOCKETS}), шард {shard.index} переполнен", flush=True)
+    return shard
+
+
+# 6. Добавление потоков: SUBSCRIBE в живой сокет или запуск нового шарда
+async def subscribe_streams(symbol, kinds):
+    added = {}
+    for kind in kinds:
+        stream = f"{symbol.lower()}@{kind}"
+        if stream in stream_shard:
+            continue
+        shard = pick_shard()
+        shard.streams.add(stream)
+        stream_shard[stream] = shard
+        added.setdefault(shard, []).append(stream)
+
+    for shard, streams in added.items():
+        if shard.task is None or shard.task.done():
+            shard.task = asyncio.create_task(shard.run())
+        else:
+            await shard.send_method("SUBSCRIBE", streams)
+
+
+# 7. Удаление потоков: UNSUBSCRIBE в живой сокет
+async def unsubscribe_streams(symbol, kinds):
+    removed = {}
+    for kind in kinds:
+        stream = f"{symbol.lower()}@{kind}"
+        shard = stream_shard.pop(stream, None)
+        if shard is None:
+            continue
+        shard.streams.discard(stream)
+        removed.setdefault(shard, []).append(stream)
+
+    for shard, streams in removed.items():
+        if shard.streams:
+            await shard.send_method("UNSUBSCRIBE", streams)
+        elif shard.ws is not None:
+            await shard.ws.close()
@@ -0,0 +1,126 @@
+# ws_decoder.py
+# Быстрый разбор сообщений combined stream: msgspec/orjson при наличии, иначе stdlib json
+
+# 0. Импорты
+import json
+import os
+from typing import NamedTuple
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# 1. Типизированные события
+class Kline(NamedTuple):
+    t: int          # open time, мс
+    T: int          # close time, мс
+    o: str
+    h: str
+    l: str
+    c: str
+    v: str
+    x: bool         # свеча закрыта
+    source: str = "stream"
+
+
+class MarkPrice(NamedTuple):
+    E: int          # event time, мс
+    p: str
+
+
+# 2. Выбор декодера: WS_DECODER=auto|msgspec|orjson|json
+WS_DECODER = os.getenv("WS_DECODER", "auto")
+
+if msgspec is not None and WS_DECODER in ("auto", "msgspec"):
+    DECODER = "msgspec"
+
+    class _KlineStruct(msgspec.Struct):
+        t: int
+        T: int
+        o: str
+        h: str
+        l: str
+        c: str
+        v: str
+        x: bool
+
+    class _KlineData(msgspec.Struct):
+        k: _KlineStruct
+
+    class _KlineFrame(msgspec.Struct):
+        stream: str
+        data: _KlineData
+
+    class _MarkPriceData(msgspec.Struct):
+        E: int
+        p: str
+
+    class _MarkPriceFrame(msgspec.Struct):
+        stream: str
+        data: _MarkPriceData
+
+    _kline_decoder = msgspec.json.Decoder(_KlineFrame)
+    _markprice_decoder = msgspec.json.Decoder(_MarkPriceFrame)
+    loads = msgspec.json.Decoder().decode
+
+    def _decode_kline(raw):
+        frame = _kline_decoder.decode(raw)
+        k = frame.data.k
+        return frame.stream, Kline(k.t, k.T, k.o, k.h, k.l, k.c, k.v, k.x)
+
+    def _decode_markprice(raw):
+        frame = _markprice_decoder.decode(raw)
+        return frame.stream, MarkPrice(frame.data.E, frame.data.p)
+
+else:
+    if orjson is not None and WS_DECODER in ("auto", "orjson"):
+        DECODER = "orjson"
+        loads = orjson.loads
+    else:
+        DECODER = "json"
+        loads = json.loads
+
+    def _decode_kline(raw):
+        payload = loads(raw)
+        k = payload["data"]["k"]
+        return payload["stream"], Kline(k["t"], k["T"], k["o"], k["h"], k["l"], k["c"], k["v"], k["x"])
+
+    def _decode_markprice(raw):
+        payload = loads(raw)
+        data = payload["data"]
+        return payload["stream"], MarkPrice(data["E"], data["p"])
+
+
+# 3. Дешёвый префильтр: незакрытая kline-свеча (около 60 сообщений в минуту на символ)
+def is_open_kline(raw):
+    if isinstance(raw, bytes):
+        return b"@kline_" in raw[:64] and b'"x":false' in raw
+    return "@kline_" in raw[:64] and '"x":false' in raw
+
+
+# 4. Разбор сообщения: (stream, событие) или None, если сообщение не нужно разбирать
+def decode_message(raw):
+    if is_open_kline(raw):
+        return None
+
+    head = raw[:64]
+    if isinstance(head, bytes):
+        head = head.decode("ascii", "ignore")
+
+    if "@kline_" in head:
+        return _decode_kline(raw)
+    if "@markPrice" in head:
+        return _decode_markprice(raw)
+
+    payload = loads(raw)
+    stream = payload.get("stream")
+    if not stream:
+        return None  # ответ на SUBSCRIBE/UNSUBSCRIBE
+    return stream, payload["data"]
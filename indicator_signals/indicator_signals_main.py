@@ -26,7 +26,7 @@ redis_client = redis.Redis(
     ssl=True
 )
 
-# 🔸 In-memory хранилище значений индикаторов
+# 🔸 In-memory хранилище значений индикаторов: {(instance_id, symbol): deque[(open_time, value)]}
 signal_state_storage = {}
 
 # 🔸 Диспетчер обработчиков по типу индикатора
@@ -83,30 +83,40 @@ async def listen_to_indicators(db_pool):
                     logging.error(f"❌ Ошибка при обработке сообщения {entry_id}: {e}")
 
 # 🔸 Обработка одного сообщения индикатора
+#    Пакетное сообщение (поле indicators) содержит все индикаторы бара со значениями —
+#    обработчик вызывается один раз на тип индикатора со всеми его записями
 async def handle_indicator_message(data: dict, db_pool):
     try:
         debug_log(f"📥 Получено сообщение: {data}")
 
         symbol = data["symbol"]
         timeframe = data["timeframe"]
-        indicator = data["indicator"]
-        params = json.loads(data["params"])
         calculated_at = data["calculated_at"]
 
-        processor = INDICATOR_DISPATCH.get(indicator)
-        if processor:
-            debug_log(f"🔍 Обработка индикатора {indicator} для {symbol} / {timeframe}")
-            await processor(
-                symbol=symbol,
-                timeframe=timeframe,
-                params=params,
-                ts=calculated_at,
-                state=signal_state_storage,
-                publish=publish_to_signals_stream,
-                db_pool=db_pool
-            )
+        if "indicators" in data:
+            entries = json.loads(data["indicators"])
         else:
-            debug_log(f"⚠️ Пропущен неподдерживаемый индикатор: {indicator}")
+            entries = [{"indicator": data["indicator"], "params": json.loads(data["params"])}]
+
+        grouped = {}
+        for entry in entries:
+            grouped.setdefault(entry["indicator"], []).append(entry)
+
+        for indicator, indicator_entries in grouped.items():
+            processor = INDICATOR_DISPATCH.get(indicator)
+            if processor:
+                debug_log(f"🔍 Обработка индикатора {indicator} для {symbol} / {timeframe}")
+                await processor(
+                    symbol=symbol,
+                    timeframe=timeframe,
+                    entries=indicator_entries,
+                    ts=calculated_at,
+                    state=signal_state_storage,
+                    publish=publish_to_signals_stream,
+                    db_pool=db_pool
+                )
+            else:
+                debug_log(f"⚠️ Пропущен неподдерживаемый индикатор: {indicator}")
 
     except Exception as e:
         logging.error(f"Ошибка обработки сообщения: {e}")
@@ -1,11 +1,16 @@
+import os
+from collections import deque
 from debug_utils import debug_log
 from datetime import datetime
 
+# 🔸 Сколько последних значений хранить по (instance_id, symbol)
+HISTORY_SIZE = int(os.getenv("SIGNAL_HISTORY_SIZE", 10))
+
 # 🔸 Кэш instance_id по (length, timeframe)
 instance_cache = {}
 
-# 🔸 Кэш последнего сгенерированного сигнала по (symbol, timeframe, direction)
-last_signal_cache = {}
+# 🔸 Последний проверенный бар по (symbol, timeframe) — пересечение проверяется один раз на бар
+evaluated_bars = {}
 
 # 🔸 Получение instance_id для EMA по длине и таймфрейму
 async def get_instance_id(db_pool, length: str, timeframe: str) -> int:
@@ -33,27 +38,62 @@ async def get_instance_id(db_pool, length: str, timeframe: str) -> int:
             debug_log(f"⚠️ Не найден instance_id для EMA {length} / {timeframe}")
             return None
 
-# 🔸 Получение двух последних значений по указанному параметру
-async def get_last_two_values(db_pool, instance_id: int, symbol: str, param_name: str):
+# 🔸 Значение бара в историю (instance_id, symbol): повтор бара заменяет значение, старые бары игнорируются
+def record_value(state: dict, instance_id: int, symbol: str, open_time: datetime, value: float):
+    history = state.setdefault((instance_id, symbol), deque(maxlen=HISTORY_SIZE))
+    if history and history[-1][0] == open_time:
+        history[-1] = (open_time, value)
+    elif not history or history[-1][0] < open_time:
+        history.append((open_time, value))
+
+# 🔸 Загрузка истории из БД (старт сервиса или значение не пришло в Stream)
+async def load_history(db_pool, state: dict, instance_id: int, symbol: str, param_name: str, open_time: datetime):
     async with db_pool.acquire() as conn:
         rows = await conn.fetch("""
-            SELECT value
+            SELECT open_time, value
             FROM indicator_values_v2
             WHERE instance_id = $1
               AND symbol = $2
               AND param_name = $3
+              AND open_time <= $4
             ORDER BY open_time DESC
-            LIMIT 2
-        """, instance_id, symbol, param_name)
+            LIMIT $5
+        """, instance_id, symbol, param_name, open_time, HISTORY_SIZE)
+
+    state[(instance_id, symbol)] = deque(
+        ((row["open_time"], float(row["value"])) for row in reversed(rows)),
+        maxlen=HISTORY_SIZE
+    )
+
+# 🔸 Два последних значения на бар open_time: (prev, curr) из памяти, при отсутствии — из БД
+async def get_last_two_values(db_pool, state: dict, instance_id: int, symbol: str, param_name: str, open_time: datetime):
+    history = state.get((instance_id, symbol))
+    if not history or len(history) < 2 or history[-1][0] < open_time:
+        await load_history(db_pool, state, instance_id, symbol, param_name, open_time)
+        history = state[(instance_id, symbol)]
 
-        if len(rows) == 2:
-            return rows[1]["value"], rows[0]["value"]  # prev, curr
+    if len(history) < 2 or history[-1][0] != open_time:
         return None, None
+    return history[-2][1], history[-1][1]  # prev, curr
 
-# 🔸 Обработка сигнала EMA для генерации сигнала пересечения
-async def process_ema_cross_signal(symbol: str, timeframe: str, params: dict, ts: str, state: dict, publish, db_pool):
+# 🔸 Обработка EMA-индикаторов бара: значения из Stream в память, проверка пересечения EMA9/EMA21
+#    entries — все EMA одного сообщения (symbol, timeframe, бар)
+async def process_ema_cross_signal(symbol: str, timeframe: str, entries: list, ts: str, state: dict, publish, db_pool):
     try:
         ts = ts or datetime.utcnow().isoformat()
+        open_time = datetime.fromisoformat(ts)
+
+        # 🔹 Значения из сообщения → история в памяти
+        for entry in entries:
+            if "instance_id" in entry and "values" in entry:
+                for param_name, value in entry["values"].items():
+                    record_value(state, entry["instance_id"], symbol, open_time, float(value))
+
+        lengths = {str(entry["params"].get("length")) for entry in entries}
+        if not lengths & {"9", "21"}:
+            return
+        if evaluated_bars.get((symbol, timeframe)) == ts:
+            return
 
         # 🔹 Получение instance_id для EMA9 и EMA21
         ema9_id = await get_instance_id(db_pool, "9", timeframe)
@@ -62,32 +102,25 @@ async def process_ema_cross_signal(symbol: str, timeframe: str, params: dict, ts
         if not ema9_id or not ema21_id:
             return
 
-        # 🔹 Получение последних двух значений для ema9 и ema21
-        ema9_prev, ema9_curr = await get_last_two_values(db_pool, ema9_id, symbol, 'ema9')
-        ema21_prev, ema21_curr = await get_last_two_values(db_pool, ema21_id, symbol, 'ema21')
+        # 🔹 Последние два значения ema9 и ema21 на этом баре
+        ema9_prev, ema9_curr = await get_last_two_values(db_pool, state, ema9_id, symbol, 'ema9', open_time)
+        ema21_prev, ema21_curr = await get_last_two_values(db_pool, state, ema21_id, symbol, 'ema21', open_time)
 
         if None in [ema9_prev, ema9_curr, ema21_prev, ema21_curr]:
             return
+        evaluated_bars[(symbol, timeframe)] = ts
 
         # 🔹 Проверка сигнала LONG
         if ema9_prev <= ema21_prev and ema9_curr > ema21_curr:
-            cache_key = (symbol, timeframe, "LONG")
-            if last_signal_cache.get(cache_key) == ts:
-                return
             message = f"EMA_{timeframe}_LONG"
             debug_log(f"✔ Пересечение вверх: {symbol} / {timeframe}")
             await publish(symbol=symbol, message=message, time=ts)
-            last_signal_cache[cache_key] = ts
 
         # 🔹 Проверка сигнала SHORT
         elif ema9_prev >= ema21_prev and ema9_curr < ema21_curr:
-            cache_key = (symbol, timeframe, "SHORT")
-            if last_signal_cache.get(cache_key) == ts:
-                return
             message = f"EMA_{timeframe}_SHORT"
             debug_log(f"✔ Пересечение вниз: {symbol} / {timeframe}")
             await publish(symbol=symbol, message=message, time=ts)
-            last_signal_cache[cache_key] = ts
 
     except Exception as e:
-        debug_log(f"Ошибка в process_ema_cross_signal: {e}")
\ No newline at end of file
+        debug_log(f"Ошибка в process_ema_cross_signal: {e}")
@@ -0,0 +1,416 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+import numpy as np
+import asyncpg
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import lfilter
+
+from indicator_state import ewm_alpha, lr_from_sums
+from retention import retention_cutoff
+from timeframes import TF_MINUTES
+
+# 🔸 Пересчёт истории indicator_values_v2 (новый инстанс или изменённая формула)
+#
+#   python backfill.py --instances 12,14 --workers 4
+#   python backfill.py --instances 12 --symbols BTCUSDT,ETHUSDT --since 2025-05-01T00:00:00 --restart
+#
+# Задание — пара (инстанс, тикер). История ohlcv2_<tf> читается порциями по --chunk баров,
+# индикатор считается векторно по порции с переносом состояния между порциями,
+# значения пишутся COPY в staging + upsert, прогресс — в той же транзакции (продолжение после остановки).
+# Каждый процесс держит одно соединение с БД: нагрузка на пул живого конвейера ограничена --workers.
+# Значения старше границы хранения (retention.py) будут удалены очисткой — по умолчанию --since = эта граница.
+# Продолжение прогревает состояние от начала задания (since) — значения совпадают с непрерывным проходом;
+# запуск с --until не помечает задание завершённым, следующий запуск продолжит с последнего записанного бара.
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+PROGRESS_TABLE = "indicator_backfill_progress"
+STAGING_TABLE = "indicator_values_v2_staging"
+COLUMNS = ["instance_id", "symbol", "open_time", "param_name", "value"]
+
+# 🔸 ewm(adjust=False) по порции с продолжением от prev (первое значение ряда — как в pandas)
+def ewm_chunk(values, alpha, prev):
+    if len(values) == 0:
+        return values, prev
+    head = np.empty(0)
+    if prev is None:
+        head, values, prev = values[:1], values[1:], values[0]
+    smoothed, _ = lfilter([alpha], [1, -(1 - alpha)], values, zi=[(1 - alpha) * prev])
+    out = np.concatenate([head, smoothed])
+    return out, out[-1]
+
+# 🔸 Значения по окнам, заканчивающимся на каждом баре порции (NaN — окно ещё не заполнено)
+def window_outputs(window_values, tail_len, count, length):
+    out = np.full(count, np.nan)
+    first = max(0, length - 1 - tail_len)  # первый бар порции с полным окном
+    out[first:] = window_values[tail_len + first - (length - 1):]
+    return out
+
+class EmaBackfill:
+    def __init__(self, length):
+        self.alpha = ewm_alpha(span=length)
+        self.param = f"ema{length}"
+        self.prev = None
+
+    def run(self, high, low, close, volume):
+        ema, self.prev = ewm_chunk(close, self.alpha, self.prev)
+        return {self.param: ema}
+
+class RsiBackfill:
+    def __init__(self, length):
+        self.alpha = ewm_alpha(alpha=1 / length)
+        self.param = f"rsi{length}"
+        self.prev_close = None
+        self.avg_gain = None
+        self.avg_loss = None
+
+    def run(self, high, low, close, volume):
+        out = np.full(len(close), np.nan)
+        if self.prev_close is None:
+            deltas, offset = np.diff(close), 1
+        else:
+            deltas, offset = np.diff(np.concatenate([[self.prev_close], close])), 0
+        self.prev_close = close[-1]
+
+        gain, self.avg_gain = ewm_chunk(np.maximum(deltas, 0.0), self.alpha, self.avg_gain)
+        loss, self.avg_loss = ewm_chunk(-np.minimum(deltas, 0.0), self.alpha, self.avg_loss)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rsi = np.where(loss == 0, np.where(gain > 0, 100.0, np.nan), 100 - (100 / (1 + gain / loss)))
+        out[offset:] = rsi
+        return {self.param: out}
+
+class AtrBackfill:
+    def __init__(self, length):
+        self.alpha = ewm_alpha(alpha=1 / length)
+        self.param = f"atr{length}"
+        self.prev_close = None
+        self.atr = None
+
+    def run(self, high, low, close, volume):
+        prev_close = np.concatenate([[np.nan if self.prev_close is None else self.prev_close], close[:-1]])
+        hl = np.abs(high - low)
+        with np.errstate(invalid="ignore"):
+            tr = np.where(
+                np.isnan(prev_close),
+                hl,
+                np.maximum(np.maximum(hl, np.abs(high - prev_close)), np.abs(low - prev_close))
+            )
+        self.prev_close = close[-1]
+        atr, self.atr = ewm_chunk(tr, self.alpha, self.atr)
+        return {self.param: atr}
+
+class MfiBackfill:
+    def __init__(self, length):
+        self.length = length
+        self.param = f"mfi{length}"
+        self.prev_tp = np.nan
+        self.pos_tail = np.empty(0)
+        self.neg_tail = np.empty(0)
+
+    def run(self, high, low, close, volume):
+        tp = (high + low + close) / 3
+        rmf = tp * volume
+        prev_tp = np.concatenate([[self.prev_tp], tp[:-1]])
+        self.prev_tp = tp[-1]
+
+        pos = np.concatenate([self.pos_tail, np.where(tp > prev_tp, rmf, 0.0)])
+        neg = np.concatenate([self.neg_tail, np.where(tp < prev_tp, rmf, 0.0)])
+        tail_len = len(self.pos_tail)
+        self.pos_tail = pos[-(self.length - 1):] if self.length > 1 else np.empty(0)
+        self.neg_tail = neg[-(self.length - 1):] if self.length > 1 else np.empty(0)
+        if len(pos) < self.length:
+            return {self.param: np.full(len(close), np.nan)}
+
+        pos_sum = sliding_window_view(pos, self.length).sum(axis=1)
+        neg_sum = sliding_window_view(neg, self.length).sum(axis=1)
+        safe_neg = np.where(neg_sum != 0, neg_sum, 1e-6)  # защита от деления на 0
+        mfi = 100 - (100 / (1 + pos_sum / safe_neg))
+        return {self.param: window_outputs(mfi, tail_len, len(close), self.length)}
+
+class LrBackfill:
+    PARAMS = ("lr_upper", "lr_lower", "lr_mid", "lr_angle")
+
+    def __init__(self, length):
+        self.length = length
+        self.tail = np.empty(0)
+
+    def run(self, high, low, close, volume):
+        closes = np.concatenate([self.tail, close])
+        tail_len = len(self.tail)
+        self.tail = closes[-(self.length - 1):] if self.length > 1 else np.empty(0)
+        if len(closes) < self.length:
+            return {param: np.full(len(close), np.nan) for param in self.PARAMS}
+
+        windows = sliding_window_view(closes, self.length)
+        offset = windows[:, -1]
+        y = windows - offset[:, None]
+        channel = lr_from_sums(self.length, y.sum(axis=1), y @ np.arange(self.length), (y * y).sum(axis=1), offset)
+        return {
+            param: window_outputs(values, tail_len, len(close), self.length)
+            for param, values in zip(self.PARAMS, channel)
+        }
+
+BACKFILL_KERNELS = {
+    "EMA": (EmaBackfill, 9),
+    "RSI": (RsiBackfill, 14),
+    "ATR": (AtrBackfill, 14),
+    "MFI": (MfiBackfill, 14),
+    "LR": (LrBackfill, 50),
+}
+
+# 🔸 Округление как в модулях индикаторов
+def value_digits(kind, param, precision_price):
+    if kind in ("RSI", "MFI"):
+        return 2
+    if param == "lr_angle":
+        return 5
+    return precision_price
+
+# 🔸 Таблица прогресса (продолжение после остановки)
+async def ensure_progress_table(conn):
+    await conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {PROGRESS_TABLE} (
+            instance_id integer NOT NULL,
+            symbol text NOT NULL,
+            since_open_time timestamp,
+            until_open_time timestamp,
+            last_open_time timestamp,
+            done boolean NOT NULL DEFAULT false,
+            updated_at timestamp NOT NULL DEFAULT now(),
+            PRIMARY KEY (instance_id, symbol)
+        )
+        """
+    )
+    await conn.execute(
+        f"""
+        ALTER TABLE {PROGRESS_TABLE}
+            ADD COLUMN IF NOT EXISTS since_open_time timestamp,
+            ADD COLUMN IF NOT EXISTS until_open_time timestamp
+        """
+    )
+
+# since — начало записи задания (от него же прогрев при продолжении), until — граница запуска (NULL — без границы);
+# done выставляется только после прохода без границы
+async def save_progress(conn, instance_id, symbol, since, until, last_open_time, done):
+    await conn.execute(
+        f"""
+        INSERT INTO {PROGRESS_TABLE} (instance_id, symbol, since_open_time, until_open_time, last_open_time, done, updated_at)
+        VALUES ($1, $2, $3, $4, $5, $6, now())
+        ON CONFLICT (instance_id, symbol) DO UPDATE
+        SET since_open_time = EXCLUDED.since_open_time,
+            until_open_time = EXCLUDED.until_open_time,
+            last_open_time = COALESCE(EXCLUDED.last_open_time, {PROGRESS_TABLE}.last_open_time),
+            done = EXCLUDED.done,
+            updated_at = now()
+        """,
+        instance_id, symbol, since, until, last_open_time, done
+    )
+
+# 🔸 Запись значений порции: COPY → staging, upsert (пересчёт перезаписывает старые значения)
+async def write_values(conn, records):
+    await conn.execute(
+        f"""
+        CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE}
+        ON COMMIT DELETE ROWS AS
+        SELECT {', '.join(COLUMNS)} FROM indicator_values_v2 WITH NO DATA
+        """
+    )
+    await conn.copy_records_to_table(STAGING_TABLE, records=records, columns=COLUMNS)
+    await conn.execute(
+        f"""
+        INSERT INTO indicator_values_v2 ({', '.join(COLUMNS)})
+        SELECT {', '.join(COLUMNS)} FROM {STAGING_TABLE}
+        ON CONFLICT (instance_id, symbol, open_time, param_name) DO UPDATE
+        SET value = EXCLUDED.value
+        """
+    )
+
+# 🔸 Одно задание (инстанс, тикер) в процессе-исполнителе
+async def backfill_job(job, options):
+    instance_id, kind, tf, params, symbol, precision_price = job
+    kernel_class, default_length = BACKFILL_KERNELS[kind]
+    length = int(params.get("length", default_length))
+    kernel = kernel_class(length)
+    step = timedelta(minutes=TF_MINUTES[tf])
+    started = time.perf_counter()
+    written = 0
+
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        until = options["until"]
+        since = options["since"] or retention_cutoff(tf, datetime.utcnow())
+        write_from = since
+        if not options["restart"]:
+            row = await conn.fetchrow(
+                f"""
+                SELECT since_open_time, last_open_time, done
+                FROM {PROGRESS_TABLE}
+                WHERE instance_id = $1 AND symbol = $2
+                """,
+                instance_id, symbol
+            )
+            if row and row["done"]:
+                return instance_id, symbol, 0, 0.0
+            if row and row["last_open_time"]:
+                if until is not None and row["last_open_time"] >= until:
+                    return instance_id, symbol, 0, 0.0
+                # Продолжение: прогрев от начала задания, как при непрерывном проходе — значения совпадают
+                since = row["since_open_time"] or since
+                write_from = row["last_open_time"] + step
+
+        # Прогрев: состояние набирается на барах до since (и на уже записанных барах при продолжении),
+        # записываются только бары начиная с write_from
+        after = since - step * (options["warmup"] + 1)
+        last_written = None
+        while True:
+            rows = await conn.fetch(
+                f"""
+                SELECT open_time, high, low, close, volume
+                FROM ohlcv2_{tf.lower()}
+                WHERE symbol = $1 AND open_time > $2 AND ($3::timestamp IS NULL OR open_time <= $3)
+                ORDER BY open_time
+                LIMIT {int(options['chunk'])}
+                """,
+                symbol, after, until
+            )
+            if not rows:
+                break
+
+            times = [row["open_time"] for row in rows]
+            data = np.array([(row["high"], row["low"], row["close"], row["volume"]) for row in rows], dtype=float)
+            outputs = kernel.run(data[:, 0], data[:, 1], data[:, 2], data[:, 3])
+
+            first = next((i for i, t in enumerate(times) if t >= write_from), len(times))
+            records = [
+                (instance_id, symbol, times[i], param, round(float(values[i]), value_digits(kind, param, precision_price)))
+                for param, values in outputs.items()
+                for i in range(first, len(times))
+                if not np.isnan(values[i])
+            ]
+
+            if first < len(times):
+                async with conn.transaction():
+                    if records:
+                        await write_values(conn, records)
+                    await save_progress(conn, instance_id, symbol, since, until, times[-1], False)
+                written += len(records)
+                last_written = times[-1]
+
+            after = times[-1]
+            if options["pause"]:
+                await asyncio.sleep(options["pause"])  # уступаем БД живому конвейеру
+
+        await save_progress(conn, instance_id, symbol, since, until, last_written, until is None)
+    finally:
+        await conn.close()
+
+    return instance_id, symbol, written, time.perf_counter() - started
+
+# 🔸 Точка входа процесса-исполнителя
+def run_job(job, options):
+    return asyncio.run(backfill_job(job, options))
+
+# 🔸 Список заданий: инстансы × тикеры
+async def plan_jobs(args):
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        await ensure_progress_table(conn)
+
+        instance_ids = [int(x) for x in args.instances.split(",")] if args.instances else None
+        instances = await conn.fetch(
+            """
+            SELECT id, indicator, timeframe
+            FROM indicator_instances_v2
+            WHERE ($1::int[] IS NULL AND enabled = true) OR id = ANY($1::int[])
+            """,
+            instance_ids
+        )
+        params = await conn.fetch(
+            "SELECT instance_id, param, value FROM indicator_parameters_v2 WHERE instance_id = ANY($1)",
+            [row["id"] for row in instances]
+        )
+
+        symbols = [s.strip().upper() for s in args.symbols.split(",")] if args.symbols else None
+        tickers = await conn.fetch(
+            """
+            SELECT symbol, precision_price
+            FROM tickers
+            WHERE ($1::text[] IS NULL AND status = 'enabled') OR symbol = ANY($1::text[])
+            """,
+            symbols
+        )
+
+        if args.restart:
+            await conn.execute(
+                f"DELETE FROM {PROGRESS_TABLE} WHERE instance_id = ANY($1) AND symbol = ANY($2)",
+                [row["id"] for row in instances], [row["symbol"] for row in tickers]
+            )
+    finally:
+        await conn.close()
+
+    instance_params = {}
+    for row in params:
+        instance_params.setdefault(row["instance_id"], {})[row["param"]] = row["value"]
+
+    jobs = []
+    for instance in instances:
+        kind = instance["indicator"].upper()
+        tf = instance["timeframe"].upper()
+        if kind not in BACKFILL_KERNELS or tf not in TF_MINUTES:
+            logging.warning(f"⚠️ Инстанс {instance['id']} ({kind} {tf}) не поддерживается — пропущен")
+            continue
+        for ticker in tickers:
+            jobs.append((instance["id"], kind, tf, instance_params.get(instance["id"], {}),
+                         ticker["symbol"], ticker["precision_price"]))
+    return jobs
+
+def main():
+    parser = argparse.ArgumentParser(description="Пересчёт истории индикаторов в indicator_values_v2")
+    parser.add_argument("--instances", help="id инстансов через запятую (по умолчанию — все включённые)")
+    parser.add_argument("--symbols", help="тикеры через запятую (по умолчанию — все включённые)")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="начало записи (по умолчанию — граница хранения)")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="конец записи (по умолчанию — до последнего бара)")
+    parser.add_argument("--warmup", type=int, default=500, help="баров прогрева до --since")
+    parser.add_argument("--chunk", type=int, default=20000, help="баров в порции")
+    parser.add_argument("--workers", type=int, default=2, help="процессов (= соединений с БД)")
+    parser.add_argument("--pause", type=float, default=0.05, help="пауза между порциями, сек")
+    parser.add_argument("--restart", action="store_true", help="начать заново, игнорируя прогресс")
+    args = parser.parse_args()
+
+    jobs = asyncio.run(plan_jobs(args))
+    logging.info(f"📋 Заданий: {len(jobs)}, процессов: {args.workers}")
+    options = {
+        "since": args.since,
+        "until": args.until,
+        "warmup": args.warmup,
+        "chunk": args.chunk,
+        "pause": args.pause,
+        "restart": args.restart,
+    }
+
+    started = time.perf_counter()
+    total = 0
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context) as pool:
+        futures = {pool.submit(run_job, job, options): job for job in jobs}
+        for done, future in enumerate(as_completed(futures), 1):
+            job = futures[future]
+            try:
+                instance_id, symbol, written, elapsed = future.result()
+                total += written
+                logging.info(f"✅ [{done}/{len(jobs)}] инстанс {instance_id} {symbol}: {written} значений за {elapsed:.1f} с")
+            except Exception as e:
+                logging.error(f"❌ [{done}/{len(jobs)}] инстанс {job[0]} {job[4]}: {e}")
+
+    logging.info(f"🏁 Готово: {total} значений за {time.perf_counter() - started:.1f} с")
+
+if __name__ == "__main__":
+    main()
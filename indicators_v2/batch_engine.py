@@ -0,0 +1,403 @@
+import abc
+import math
+import logging
+import numpy as np
+from datetime import datetime
+from typing import Dict, List, Any
+from debug_utils import debug_log
+from indicator_state import ewm_alpha, lr_from_sums, value_windows, seed_value_window
+from atr import load_atr_history, MEDIAN_WINDOW
+
+# 🔸 Пакетный расчёт индикаторов по всем тикерам, закрывшим один бар (tf, open_time)
+#    Состояние инстанса хранится в массивах по слотам тикеров: шаг — одна векторная операция на все тикеры.
+#    Формулы поэлементно совпадают с indicator_state.py (те же операции IEEE в том же порядке).
+
+NAT = np.datetime64("NaT", "ms")
+
+# 🔸 Базовое состояние: слоты тикеров, время последнего бара и значение по слоту
+class BatchState(abc.ABC):
+    fields: Dict[str, float] = {}  # имя массива -> значение при сбросе
+
+    def __init__(self, length):
+        self.length = length
+        self.slots: Dict[str, int] = {}
+        self.capacity = 0
+        self.open_time = np.empty(0, dtype="datetime64[ms]")
+        self.value = np.empty(0)
+        for name in self.fields:
+            setattr(self, name, np.empty(0))
+
+    # Индексы слотов тикеров (новые тикеры получают слот, массивы растут по мере надобности)
+    def slot_indexes(self, symbols):
+        for symbol in symbols:
+            if symbol not in self.slots:
+                self.slots[symbol] = len(self.slots)
+        if len(self.slots) > self.capacity:
+            self.grow(max(len(self.slots), 2 * self.capacity, 64))
+        return np.fromiter((self.slots[s] for s in symbols), dtype=np.intp, count=len(symbols))
+
+    def grow(self, capacity):
+        extra = capacity - self.capacity
+        self.open_time = np.concatenate([self.open_time, np.full(extra, NAT)])
+        self.value = np.concatenate([self.value, np.full(extra, np.nan)])
+        for name, fill in self.fields.items():
+            setattr(self, name, np.concatenate([getattr(self, name), np.full(extra, fill)]))
+        self.capacity = capacity
+
+    def reset(self, idx):
+        for name, fill in self.fields.items():
+            getattr(self, name)[idx] = fill
+
+    # Шаг по одному бару для слотов idx; NaN — значение не определено
+    @abc.abstractmethod
+    def step(self, idx, high, low, close, volume):
+        ...
+
+# 🔸 Векторный ewm(adjust=False): тот же шаг, что indicator_state.ewm_step
+def ewm_step_vec(prev, value, alpha):
+    stepped = ((1 - alpha) * prev + alpha * value) / ((1 - alpha) + alpha)
+    return np.where(np.isnan(prev), value, np.where(prev != value, stepped, prev))
+
+class BatchEma(BatchState):
+    fields = {"ema": np.nan}
+
+    def __init__(self, length):
+        super().__init__(length)
+        self.alpha = ewm_alpha(span=length)
+
+    def step(self, idx, high, low, close, volume):
+        self.ema[idx] = ewm_step_vec(self.ema[idx], close, self.alpha)
+        return self.ema[idx]
+
+class BatchRsi(BatchState):
+    fields = {"prev_close": np.nan, "avg_gain": np.nan, "avg_loss": np.nan}
+
+    def __init__(self, length):
+        super().__init__(length)
+        self.alpha = ewm_alpha(alpha=1 / length)
+
+    def step(self, idx, high, low, close, volume):
+        prev_close = self.prev_close[idx]
+        self.prev_close[idx] = close
+        has_prev = ~np.isnan(prev_close)
+        idx, close, prev_close = idx[has_prev], close[has_prev], prev_close[has_prev]
+
+        delta = close - prev_close
+        gain = ewm_step_vec(self.avg_gain[idx], np.maximum(delta, 0.0), self.alpha)
+        loss = ewm_step_vec(self.avg_loss[idx], -np.minimum(delta, 0.0), self.alpha)
+        self.avg_gain[idx] = gain
+        self.avg_loss[idx] = loss
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rsi = np.where(loss == 0, np.where(gain > 0, 100.0, np.nan), 100 - (100 / (1 + gain / loss)))
+        values = np.full(len(has_prev), np.nan)
+        values[has_prev] = rsi
+        return values
+
+class BatchAtr(BatchState):
+    fields = {"prev_close": np.nan, "atr": np.nan}
+
+    def __init__(self, length):
+        super().__init__(length)
+        self.alpha = ewm_alpha(alpha=1 / length)
+
+    def step(self, idx, high, low, close, volume):
+        prev_close = self.prev_close[idx]
+        hl = np.abs(high - low)
+        with np.errstate(invalid="ignore"):
+            tr = np.where(
+                np.isnan(prev_close),
+                hl,
+                np.maximum(np.maximum(hl, np.abs(high - prev_close)), np.abs(low - prev_close))
+            )
+        self.prev_close[idx] = close
+        self.atr[idx] = ewm_step_vec(self.atr[idx], tr, self.alpha)
+        return self.atr[idx]
+
+class BatchMfi(BatchState):
+    RESUM_EVERY = 1000
+    fields = {"prev_tp": np.nan, "pos_sum": 0.0, "neg_sum": 0.0, "pos_count": 0, "neg_count": 0,
+              "filled": 0, "cursor": 0, "updates": 0}
+
+    def __init__(self, length):
+        super().__init__(length)
+        self.pos_flows = np.zeros((0, length))
+        self.neg_flows = np.zeros((0, length))
+
+    def grow(self, capacity):
+        extra = capacity - self.capacity
+        self.pos_flows = np.concatenate([self.pos_flows, np.zeros((extra, self.length))])
+        self.neg_flows = np.concatenate([self.neg_flows, np.zeros((extra, self.length))])
+        super().grow(capacity)
+
+    def reset(self, idx):
+        super().reset(idx)
+        self.pos_flows[idx] = 0.0
+        self.neg_flows[idx] = 0.0
+
+    def step(self, idx, high, low, close, volume):
+        tp = (high + low + close) / 3
+        rmf = tp * volume
+        prev_tp = self.prev_tp[idx]
+        pos = np.where(tp > prev_tp, rmf, 0.0)
+        neg = np.where(tp < prev_tp, rmf, 0.0)
+        self.prev_tp[idx] = tp
+
+        cursor = self.cursor[idx].astype(np.intp)
+        full = self.filled[idx] == self.length
+        old_pos = np.where(full, self.pos_flows[idx, cursor], 0.0)
+        old_neg = np.where(full, self.neg_flows[idx, cursor], 0.0)
+        pos_sum = np.where(full, self.pos_sum[idx] - old_pos, self.pos_sum[idx])
+        neg_sum = np.where(full, self.neg_sum[idx] - old_neg, self.neg_sum[idx])
+        pos_count = self.pos_count[idx] - (full & (old_pos != 0))
+        neg_count = self.neg_count[idx] - (full & (old_neg != 0))
+
+        self.pos_flows[idx, cursor] = pos
+        self.neg_flows[idx, cursor] = neg
+        self.cursor[idx] = (cursor + 1) % self.length
+        self.filled[idx] = np.minimum(self.filled[idx] + 1, self.length)
+
+        pos_sum = pos_sum + pos
+        neg_sum = neg_sum + neg
+        pos_count = pos_count + (pos != 0)
+        neg_count = neg_count + (neg != 0)
+        pos_sum[pos_count == 0] = 0.0
+        neg_sum[neg_count == 0] = 0.0
+
+        updates = self.updates[idx] + 1
+        for i in np.flatnonzero(updates % self.RESUM_EVERY == 0):
+            slot = idx[i]
+            pos_sum[i] = math.fsum(self.pos_flows[slot])
+            neg_sum[i] = math.fsum(self.neg_flows[slot])
+
+        self.pos_sum[idx], self.neg_sum[idx] = pos_sum, neg_sum
+        self.pos_count[idx], self.neg_count[idx] = pos_count, neg_count
+        self.updates[idx] = updates
+
+        safe_neg = np.where(neg_sum != 0, neg_sum, 1e-6)  # защита от деления на 0
+        mfi = 100 - (100 / (1 + pos_sum / safe_neg))
+        return np.where(self.filled[idx] == self.length, mfi, np.nan)
+
+BATCH_STATE_CLASSES = {
+    "EMA": BatchEma,
+    "RSI": BatchRsi,
+    "ATR": BatchAtr,
+    "MFI": BatchMfi,
+}
+
+# 🔸 Пакетные состояния по инстансам: instance_id -> BatchState
+batch_states: Dict[int, BatchState] = {}
+
+# 🔸 Отключённый тикер: слот остаётся, но состояние помечается пустым — при возврате будет прогрев
+#    instance_ids — только этих инстансов (перечитанный буфер одного таймфрейма)
+def forget_batch_symbol(symbol, instance_ids=None):
+    for instance_id, state in batch_states.items():
+        if instance_ids is not None and instance_id not in instance_ids:
+            continue
+        slot = state.slots.get(symbol)
+        if slot is not None:
+            state.open_time[slot] = NAT
+
+# 🔸 Бар пакета: данные тикеров, общие для всех инстансов, собираются один раз
+class BarBatch:
+    def __init__(self, symbols, rings, bar_time):
+        self.symbols = tuple(symbols)
+        self.rings = rings
+        self.bar_time = bar_time
+        self.lengths = np.array([len(rings[s]) for s in symbols])
+        self.prev_times = np.array([rings[s]["open_time"][-2] if len(rings[s]) > 1 else NAT for s in symbols])
+        self.last = {
+            col: np.array([rings[s][col][-1] for s in symbols])
+            for col in ("high", "low", "close", "volume")
+        }
+
+    # LR для всех длин сразу: префиксные суммы по окну самой длинной регрессии
+    #    Тикеры с более короткой историей считаются отдельно по своим длинам. Возвращает {length: (symbols, values)}
+    def lr_channels(self, lengths):
+        channels = {}
+        widest = max(lengths)
+        members = [s for s, n in zip(self.symbols, self.lengths) if n >= widest]
+        if members:
+            closes = np.vstack([self.rings[s]["close"][-widest:] for s in members])
+            for length, values in lr_prefix(closes, lengths).items():
+                channels[length] = (members, values)
+
+        for length in lengths:
+            short = [s for s, n in zip(self.symbols, self.lengths) if length <= n < widest]
+            if not short:
+                continue
+            closes = np.vstack([self.rings[s]["close"][-length:] for s in short])
+            values = lr_prefix(closes, [length])[length]
+            if length in channels:
+                members, full = channels[length]
+                values = tuple(np.concatenate([a, b]) for a, b in zip(full, values))
+                short = members + short
+            channels[length] = (short, values)
+        return channels
+
+# 🔸 Продвижение состояния инстанса на бар пакета для всех его тикеров; значения по порядку batch.symbols
+def advance_batch(kind, instance_id, length, batch: BarBatch):
+    state = batch_states.get(instance_id)
+    if state is None or state.length != length:
+        state = batch_states[instance_id] = BATCH_STATE_CLASSES[kind](length)
+
+    if getattr(state, "batch_symbols", None) != batch.symbols:
+        state.batch_symbols = batch.symbols
+        state.batch_idx = state.slot_indexes(batch.symbols)
+    idx = state.batch_idx
+
+    state_times = state.open_time[idx]
+    ready = state_times == batch.prev_times
+
+    # Следующий бар по порядку — один векторный шаг по последнему столбцу
+    if ready.all():
+        state.value[idx] = state.step(idx, batch.last["high"], batch.last["low"], batch.last["close"], batch.last["volume"])
+    elif ready.any():
+        step_idx = idx[ready]
+        state.value[step_idx] = state.step(
+            step_idx, batch.last["high"][ready], batch.last["low"][ready],
+            batch.last["close"][ready], batch.last["volume"][ready]
+        )
+
+    # Новый тикер, разрыв, смена параметров или повтор бара (исправленные OHLCV) — прогрев по окну буфера, по группам одной длины
+    cold = ~ready
+    if cold.any():
+        groups: Dict[int, List[int]] = {}
+        for i in np.flatnonzero(cold):
+            groups.setdefault(int(batch.lengths[i]), []).append(i)
+        for bars, members in groups.items():
+            warm_idx = idx[members]
+            window = {
+                col: np.vstack([batch.rings[batch.symbols[i]][col] for i in members])
+                for col in ("high", "low", "close", "volume")
+            }
+            state.reset(warm_idx)
+            for j in range(bars):
+                values = state.step(warm_idx, window["high"][:, j], window["low"][:, j],
+                                    window["close"][:, j], window["volume"][:, j])
+            state.value[warm_idx] = values
+        debug_log(f"🔥 Пакетный прогрев {kind}{length} (instance {instance_id}) для {int(cold.sum())} тикеров")
+
+    state.open_time[idx] = batch.bar_time
+    return state.value[idx]
+
+# 🔸 LR по матрице закрытий (тикеры × bars) для нескольких длин окна из общих префиксных сумм
+#    Цены отсчитываются от последнего закрытия тикера — разности префиксов без потери точности
+def lr_prefix(closes: np.ndarray, lengths):
+    bars = closes.shape[1]
+    offset = closes[:, -1]
+    y = closes - offset[:, None]
+    x = np.arange(bars)
+    zero = np.zeros((len(closes), 1))
+    prefix_y = np.hstack([zero, np.cumsum(y, axis=1)])
+    prefix_yy = np.hstack([zero, np.cumsum(y * y, axis=1)])
+    prefix_xy = np.hstack([zero, np.cumsum(y * x, axis=1)])
+
+    channels = {}
+    for length in lengths:
+        start = bars - length
+        sy = prefix_y[:, -1] - prefix_y[:, start]
+        syy = prefix_yy[:, -1] - prefix_yy[:, start]
+        sxy = prefix_xy[:, -1] - prefix_xy[:, start] - start * sy  # x — от начала окна
+        channels[length] = lr_from_sums(length, sy, sxy, syy, offset)
+    return channels
+
+# 🔸 Значения всех инстансов таймфрейма для пакета тикеров
+#    instances — [(instance_id, kind, cfg)]; возвращает {instance_id: (symbols, values)}
+def compute_values(instances, symbols, rings, bar_time):
+    batch = BarBatch(symbols, rings, bar_time)
+    lr_lengths = sorted({int(cfg["params"].get("length", 50)) for _, kind, cfg in instances if kind == "LR"})
+    lr_channels = batch.lr_channels(lr_lengths) if lr_lengths else {}
+
+    computed = {}
+    for instance_id, kind, cfg in instances:
+        try:
+            if kind == "LR":
+                length = int(cfg["params"].get("length", 50))
+                if length in lr_channels:
+                    computed[instance_id] = lr_channels[length]
+                continue
+
+            default = 9 if kind == "EMA" else 14
+            length = int(cfg["params"].get("length", default))
+            values = advance_batch(kind, instance_id, length, batch)
+
+            # RSI/MFI: как в поштучном расчёте — нужно хотя бы length + 1 баров
+            if kind in ("RSI", "MFI"):
+                values = np.where(batch.lengths >= length + 1, values, np.nan)
+            computed[instance_id] = (batch.symbols, values)
+        except Exception as e:
+            logging.error(f"❌ Ошибка пакетного расчёта {kind} (instance {instance_id}): {e}")
+    return computed
+
+# 🔸 Результаты в формате модулей индикаторов: {symbol: [result]} для result_sink
+async def build_batch_results(db, instances, computed, tf, open_time, precisions) -> Dict[str, List[Dict[str, Any]]]:
+    open_dt = datetime.fromisoformat(open_time)
+    results: Dict[str, List[Dict[str, Any]]] = {}
+
+    for instance_id, kind, cfg in instances:
+        if instance_id not in computed:
+            continue
+        symbols, values = computed[instance_id]
+        stream_publish = cfg["stream_publish"]
+
+        if kind == "LR":
+            length = int(cfg["params"].get("length", 50))
+            upper, lower, mid, angle = values
+            for i, symbol in enumerate(symbols):
+                precision = precisions[symbol]
+                lr_values = [
+                    ("lr_upper", round(float(upper[i]), precision)),
+                    ("lr_lower", round(float(lower[i]), precision)),
+                    ("lr_mid",   round(float(mid[i]), precision)),
+                    ("lr_angle", round(float(angle[i]), 5))
+                ]
+                results.setdefault(symbol, []).append({
+                    "instance_id": instance_id,
+                    "indicator": "LR",
+                    "params": {"length": str(length)},
+                    "values": lr_values,
+                    "redis": {f"{symbol}:{tf}:LR:{name}": value for name, value in lr_values},
+                    "stream_publish": stream_publish
+                })
+            continue
+
+        default = 9 if kind == "EMA" else 14
+        length = int(cfg["params"].get("length", default))
+        param_name = f"{kind.lower()}{length}"
+
+        # ATR: окна median(30) новых тикеров прогреваются из БД одним запросом на инстанс
+        if kind == "ATR":
+            cold = [s for s in symbols if (instance_id, s) not in value_windows]
+            if cold:
+                try:
+                    history = await load_atr_history(db, instance_id, param_name, cold, open_dt)
+                except Exception as e:
+                    logging.error(f"❌ Ошибка загрузки истории ATR (instance {instance_id}): {e}")
+                    history = {}
+                for symbol in cold:
+                    seed_value_window(instance_id, symbol, MEDIAN_WINDOW, history.get(symbol, []))
+
+        for symbol, raw in zip(symbols, values):
+            if np.isnan(raw):
+                continue
+            digits = precisions[symbol] if kind in ("EMA", "ATR") else 2
+            value = round(float(raw), digits)
+            redis_values = {f"{symbol}:{tf}:{kind}:{length}": value}
+
+            if kind == "ATR":
+                window = value_windows[(instance_id, symbol)]
+                window.push(value, open_dt)
+                if len(window) >= 3:
+                    redis_values[f"{symbol}:{tf}:ATR:median_30"] = round(window.median(), precisions[symbol])
+
+            results.setdefault(symbol, []).append({
+                "instance_id": instance_id,
+                "indicator": kind,
+                "params": {"length": str(length)},
+                "values": [(param_name, value)],
+                "redis": redis_values,
+                "stream_publish": stream_publish
+            })
+
+    return results
@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import time
+import numpy as np
+
+from ohlcv_buffer import OhlcvRing
+from indicator_state import advance_indicator, indicator_states
+from batch_engine import compute_values, batch_states
+from lr import process_lr
+
+# 🔸 Бенчмарк: закрытие бара для N тикеров — поштучный расчёт против пакетного
+#
+#   python bench_batch_engine.py --symbols 50,150,300,600 --bars 20
+#
+# Данные синтетические, без БД и Redis: меряется только расчёт (буферы уже продвинуты).
+# Заодно сверяются значения EMA/RSI/ATR/MFI/LR пакетного и поштучного пути.
+
+INSTANCES = [
+    (1, "EMA", {"params": {"length": "9"}, "stream_publish": False}),
+    (2, "EMA", {"params": {"length": "21"}, "stream_publish": False}),
+    (3, "EMA", {"params": {"length": "50"}, "stream_publish": False}),
+    (4, "EMA", {"params": {"length": "200"}, "stream_publish": False}),
+    (5, "RSI", {"params": {"length": "14"}, "stream_publish": False}),
+    (6, "ATR", {"params": {"length": "14"}, "stream_publish": False}),
+    (7, "MFI", {"params": {"length": "14"}, "stream_publish": False}),
+    (8, "LR", {"params": {"length": "50"}, "stream_publish": False}),
+    (9, "LR", {"params": {"length": "100"}, "stream_publish": False}),
+]
+
+T0 = np.datetime64("2025-01-01T00:00", "ms")
+STEP = np.timedelta64(5, "m")
+
+# 🔸 Случайное блуждание свечей для одного тикера
+def random_bars(rng, count):
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.002, count)))
+    spread = np.abs(rng.normal(0, 0.001, count)) * close
+    volume = rng.uniform(10, 1000, count)
+    return close + spread, close - spread, close, volume
+
+def make_rings(symbols, history, rng):
+    data = {s: random_bars(rng, history) for s in symbols}
+    rings = {s: OhlcvRing(250, 5) for s in symbols}
+    return data, rings
+
+def push_bar(rings, data, symbols, i):
+    bar_time = T0 + STEP * i
+    for s in symbols:
+        high, low, close, volume = data[s]
+        rings[s].append(bar_time, high[i], low[i], close[i], volume[i])
+    return bar_time
+
+# 🔸 Поштучный путь: как process_* по каждому тикеру
+async def per_symbol(rings, symbols):
+    values = {}
+    for instance_id, kind, cfg in INSTANCES:
+        length = int(cfg["params"]["length"])
+        for s in symbols:
+            if kind == "LR":
+                result = await process_lr(instance_id, s, "M5", "", cfg["params"], rings[s], None, None, 12, False)
+                values[(instance_id, s)] = result["values"][2][1] if result else None
+            else:
+                values[(instance_id, s)] = advance_indicator(kind, instance_id, s, length, rings[s])
+    return values
+
+def batch(rings, symbols, bar_time):
+    return compute_values(INSTANCES, symbols, rings, bar_time)
+
+async def run(count, bars, warm):
+    rng = np.random.default_rng(count)
+    symbols = [f"SYM{i}USDT" for i in range(count)]
+    data, rings = make_rings(symbols, warm + bars, rng)
+    indicator_states.clear()
+    batch_states.clear()
+
+    single_times, batch_times = [], []
+    max_diff = 0.0
+    for i in range(warm + bars):
+        bar_time = push_bar(rings, data, symbols, i)
+        if i < warm - 1:
+            continue
+
+        started = time.perf_counter()
+        single = await per_symbol(rings, symbols)
+        single_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        computed = batch(rings, symbols, bar_time)
+        batch_times.append(time.perf_counter() - started)
+
+        # Сверка значений (LR — mid до 12 знаков, остальные — сырые значения)
+        for instance_id, kind, _ in INSTANCES:
+            members, values = computed[instance_id]
+            if kind == "LR":
+                values = values[2]
+            for s, v in zip(members, values):
+                ref = single[(instance_id, s)]
+                if ref is None or np.isnan(v):
+                    continue
+                max_diff = max(max_diff, abs(float(v) - ref) / max(abs(ref), 1e-12))
+
+    # Первый замер — прогрев состояний, в статистику не входит
+    single_ms = np.median(single_times[1:]) * 1000
+    batch_ms = np.median(batch_times[1:]) * 1000
+    print(f"{count:>5} тикеров: поштучно {single_ms:8.2f} мс, пакетом {batch_ms:7.2f} мс, "
+          f"x{single_ms / batch_ms:5.1f}, макс. отн. расхождение {max_diff:.1e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк пакетного расчёта индикаторов")
+    parser.add_argument("--symbols", default="50,150,300,600")
+    parser.add_argument("--bars", type=int, default=20, help="замеряемых баров")
+    parser.add_argument("--warm", type=int, default=250, help="баров истории до замеров")
+    args = parser.parse_args()
+
+    for count in [int(x) for x in args.symbols.split(",")]:
+        asyncio.run(run(count, args.bars, args.warm))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import math
+import bisect
+from collections import deque
+from typing import Dict, Tuple, Any
+from debug_utils import debug_log
+from trading_common.indicator_core import (
+    ewm_alpha, ewm_step, EmaState, RsiState, AtrState, MfiState, LrState,
+    lr_from_sums, STATE_CLASSES, warmup_state
+)
+
+# 🔸 Состояния индикаторов по (instance_id, symbol): обновление за O(1) на новый бар
+#    Классы состояний — общий пакет trading_common (те же формулы считают live-значения в live_indicators)
+indicator_states: Dict[Tuple[int, str], Any] = {}
+
+# 🔸 Скользящие окна значений по (instance_id, symbol) — порядковые статистики (median_30 по ATR)
+value_windows: Dict[Tuple[int, str], "RollingWindow"] = {}
+
+# 🔸 Скользящее окно с порядковыми статистиками: deque по времени + отсортированная копия
+#    Поиск позиции — bisect за O(log n); для окон в десятки значений вставка/удаление — один memmove
+class RollingWindow:
+    def __init__(self, size):
+        self.size = size
+        self.values = deque()
+        self.ordered = []
+        self.open_time = None
+
+    def __len__(self):
+        return len(self.values)
+
+    # Новое значение бара; повтор того же бара заменяет последнее значение
+    def push(self, value, open_time=None):
+        if open_time is not None and open_time == self.open_time and self.values:
+            old = self.values.pop()
+            del self.ordered[bisect.bisect_left(self.ordered, old)]
+        elif len(self.values) == self.size:
+            old = self.values.popleft()
+            del self.ordered[bisect.bisect_left(self.ordered, old)]
+        self.values.append(value)
+        bisect.insort(self.ordered, value)
+        self.open_time = open_time
+
+    # Медиана как statistics.median: среднее двух центральных при чётном размере
+    def median(self):
+        n = len(self.ordered)
+        mid = n // 2
+        if n % 2:
+            return self.ordered[mid]
+        return (self.ordered[mid - 1] + self.ordered[mid]) / 2
+
+    # Квантиль q ∈ [0, 1] с линейной интерполяцией (как numpy.quantile по умолчанию): p25 — 0.25, p75 — 0.75
+    def quantile(self, q):
+        pos = q * (len(self.ordered) - 1)
+        low = int(math.floor(pos))
+        high = min(low + 1, len(self.ordered) - 1)
+        return self.ordered[low] + (self.ordered[high] - self.ordered[low]) * (pos - low)
+
+# 🔸 Окно значений инстанса: при первом обращении заполняется историей (по возрастанию времени)
+def seed_value_window(instance_id, symbol, size, history):
+    window = RollingWindow(size)
+    for value in history[-size:]:
+        window.push(value)
+    value_windows[(instance_id, symbol)] = window
+    return window
+
+# 🔸 Значение индикатора на последнем баре свечей с инкрементальным обновлением состояния
+# candles — OhlcvRing (колонки open_time, high, low, close, volume — массивы по возрастанию времени)
+def advance_indicator(kind, instance_id, symbol, length, candles):
+    key = (instance_id, symbol)
+    entry = indicator_states.get(key)
+    open_times = candles["open_time"]
+    last_time = open_times[-1]
+
+    high = candles["high"]
+    low = candles["low"]
+    close = candles["close"]
+    volume = candles["volume"]
+
+    # Следующий бар по порядку — один шаг O(1)
+    if entry and entry["length"] == length and len(open_times) > 1 and open_times[-2] == entry["open_time"]:
+        value = entry["state"].update(float(high[-1]), float(low[-1]), float(close[-1]), float(volume[-1]))
+        entry["open_time"] = last_time
+        entry["value"] = value
+        return value
+
+    # Первый запуск, разрыв, смена параметров или повтор бара (бар мог прийти с исправленными OHLCV) — прогрев по истории
+    state, value = warmup_state(kind, length, high.tolist(), low.tolist(), close.tolist(), volume.tolist())
+    indicator_states[key] = {"state": state, "length": length, "open_time": last_time, "value": value}
+    debug_log(f"🔥 Прогрев состояния {kind}{length} для {symbol} (instance {instance_id}) по {len(close)} барам")
+    return value
+
+# 🔸 Освобождение состояний удалённого/изменённого инстанса
+def drop_instance_states(instance_id):
+    for store in (indicator_states, value_windows):
+        for key in [key for key in store if key[0] == instance_id]:
+            del store[key]
+
+# 🔸 Освобождение состояний отключённого тикера (instance_ids — только этих инстансов, например одного таймфрейма)
+def drop_symbol_states(symbol, instance_ids=None):
+    for store in (indicator_states, value_windows):
+        for key in [key for key in store if key[1] == symbol and (instance_ids is None or key[0] in instance_ids)]:
+            del store[key]
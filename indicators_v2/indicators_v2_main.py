@@ -1,5 +1,6 @@
 import asyncio
 import os
+import time
 import json
 import logging
 import asyncpg
@@ -10,7 +11,7 @@ import pandas_ta as pta
 import ta
 from decimal import Decimal, ROUND_DOWN
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple, Optional
 from debug_utils import debug_log
 
 # 🔸 Импорты файлов индикаторов
@@ -19,6 +20,11 @@ from atr import process_atr
 from lr import process_lr
 from rsi import process_rsi
 from mfi import process_mfi
+from result_sink import flush_results, flush_batch_results
+from batch_engine import compute_values, build_batch_results, batch_states, forget_batch_symbol
+from indicator_state import drop_instance_states, drop_symbol_states
+from retention import run_retention
+from ohlcv_buffer import OhlcvRing, advance_buffer, ensure_buffer, reseed_hooks
 
 # 🔸 Конфигурация логирования
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
@@ -30,8 +36,30 @@ REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
 
 # 🔸 In-memory хранилища
 tickers_storage: Dict[str, Dict[str, int]] = {}
-ohlcv_cache: Dict[str, Dict[str, Any]] = {}
+ohlcv_buffers: Dict[str, OhlcvRing] = {}
 indicator_configs: Dict[int, Dict[str, Any]] = {}
+instances_by_tf: Dict[str, List[Tuple[int, str, Dict[str, Any]]]] = {}
+pending_batches: Dict[Tuple[str, str], Dict[str, Any]] = {}
+config_lock = asyncio.Lock()
+
+# 🔸 Реестр типов индикаторов: новый тип — новая запись здесь
+INDICATOR_REGISTRY = {
+    "EMA": process_ema,
+    "ATR": process_atr,
+    "LR": process_lr,
+    "RSI": process_rsi,
+    "MFI": process_mfi,
+}
+
+# 🔸 Ограничение параллельных расчётов инстансов на одно событие
+INDICATOR_CONCURRENCY = int(os.getenv("INDICATOR_CONCURRENCY", 10))
+
+# 🔸 Изменения конфигурации: канал LISTEN/NOTIFY и интервал страховочной полной сверки
+CONFIG_CHANNEL = os.getenv("INDICATOR_CONFIG_CHANNEL", "indicator_config")
+CONFIG_RECONCILE_INTERVAL = int(os.getenv("INDICATOR_CONFIG_RECONCILE_INTERVAL", 3600))
+
+# 🔸 Окно сбора пакета событий одного бара (0 — поштучный расчёт по каждому событию)
+INDICATOR_BATCH_WINDOW = float(os.getenv("INDICATOR_BATCH_WINDOW_MS", 150)) / 1000
 
 # 🔸 Подключение к PostgreSQL (асинхронный пул)
 async def init_pg_pool():
@@ -89,6 +117,15 @@ async def load_indicator_config(pg_pool) -> Dict[int, Dict[str, Any]]:
 
     debug_log(f"📦 Загружено конфигураций индикаторов: {len(config)}")
     return config
+# 🔸 Индекс инстансов по таймфрейму: timeframe -> [(instance_id, kind, cfg)]
+def build_instance_index(configs: Dict[int, Dict[str, Any]]) -> Dict[str, List[Tuple[int, str, Dict[str, Any]]]]:
+    index: Dict[str, List[Tuple[int, str, Dict[str, Any]]]] = {}
+    for instance_id, cfg in configs.items():
+        kind = cfg["indicator"].upper()
+        if kind not in INDICATOR_REGISTRY:
+            continue
+        index.setdefault(cfg["timeframe"].upper(), []).append((instance_id, kind, cfg))
+    return index
 # 🔸 Подписка на события Pub/Sub от агрегаторов
 async def subscribe_to_ohlcv(redis, pg_pool):
     pubsub = redis.pubsub()
@@ -118,184 +155,306 @@ async def subscribe_to_ohlcv(redis, pg_pool):
 
             debug_log(f"📥 Получено событие: {symbol} / {tf} / {open_time}")
 
-            candles = await get_latest_ohlcv(symbol, tf, open_time, pg_pool)
-            if candles.empty:
-                logging.warning(f"⚠️ Расчёт прерван: нет свечей для {symbol} / {tf} / {open_time}")
-                continue
-
-            # 🔹 Найти EMA-инстансы для данного timeframe
-            ema_instances = [
-                (instance_id, cfg)
-                for instance_id, cfg in indicator_configs.items()
-                if cfg["indicator"].upper() == "EMA" and cfg["timeframe"].upper() == tf
-            ]
-
-            # 🔹 Выполнить расчёт EMA
-            for instance_id, cfg in ema_instances:
-                await process_ema(
-                    instance_id=instance_id,
-                    symbol=symbol,
-                    tf=tf,
-                    open_time=open_time,
-                    params=cfg["params"],
-                    candles=candles,
-                    redis=redis,
-                    db=pg_pool,
-                    precision_price=tickers_storage[symbol]["precision_price"],
-                    stream_publish=cfg["stream_publish"]
-                )
-            # 🔹 Найти ATR-инстансы для данного timeframe
-            atr_instances = [
-                (instance_id, cfg)
-                for instance_id, cfg in indicator_configs.items()
-                if cfg["indicator"].upper() == "ATR" and cfg["timeframe"].upper() == tf
-            ]
-
-            # 🔹 Выполнить расчёт ATR
-            for instance_id, cfg in atr_instances:
-                await process_atr(
-                    instance_id=instance_id,
-                    symbol=symbol,
-                    tf=tf,
-                    open_time=open_time,
-                    params=cfg["params"],
-                    candles=candles,
-                    redis=redis,
-                    db=pg_pool,
-                    precision_price=tickers_storage[symbol]["precision_price"],
-                    stream_publish=cfg["stream_publish"]
-                )
-            # 🔹 Найти LR-инстансы для данного timeframe
-            lr_instances = [
-                (instance_id, cfg)
-                for instance_id, cfg in indicator_configs.items()
-                if cfg["indicator"].upper() == "LR" and cfg["timeframe"].upper() == tf
-            ]
-
-            # 🔹 Выполнить расчёт LR
-            for instance_id, cfg in lr_instances:
-                await process_lr(
-                    instance_id=instance_id,
-                    symbol=symbol,
-                    tf=tf,
-                    open_time=open_time,
-                    params=cfg["params"],
-                    candles=candles,
-                    redis=redis,
-                    db=pg_pool,
-                    precision_price=tickers_storage[symbol]["precision_price"],
-                    stream_publish=cfg["stream_publish"]
-                )   
-            # 🔹 Найти RSI-инстансы для данного timeframe
-            rsi_instances = [
-                (instance_id, cfg)
-                for instance_id, cfg in indicator_configs.items()
-                if cfg["indicator"].upper() == "RSI" and cfg["timeframe"].upper() == tf
-            ]
-
-            # 🔹 Выполнить расчёт RSI
-            for instance_id, cfg in rsi_instances:
-                await process_rsi(
-                    instance_id=instance_id,
-                    symbol=symbol,
-                    tf=tf,
-                    open_time=open_time,
-                    params=cfg["params"],
-                    candles=candles,
-                    redis=redis,
-                    db=pg_pool,
-                    precision_price=tickers_storage[symbol]["precision_price"],
-                    stream_publish=cfg["stream_publish"]
-                )
-            # 🔹 Найти MFI-инстансы для данного timeframe
-            mfi_instances = [
-                (instance_id, cfg)
-                for instance_id, cfg in indicator_configs.items()
-                if cfg["indicator"].upper() == "MFI" and cfg["timeframe"].upper() == tf
-            ]
-
-            # 🔹 Выполнить расчёт MFI
-            for instance_id, cfg in mfi_instances:
-                await process_mfi(
-                    instance_id=instance_id,
-                    symbol=symbol,
-                    tf=tf,
-                    open_time=open_time,
-                    params=cfg["params"],
-                    candles=candles,
-                    redis=redis,
-                    db=pg_pool,
-                    precision_price=tickers_storage[symbol]["precision_price"],
-                    stream_publish=cfg["stream_publish"]
-                )                             
+            if INDICATOR_BATCH_WINDOW > 0:
+                collect_event(redis, pg_pool, symbol, tf, open_time, data)
+            else:
+                await process_event(redis, pg_pool, symbol, tf, open_time, data)
         except Exception as e:
             logging.error(f"❌ Ошибка при обработке события PubSub: {e}")
-# 🔸 Получение и кэширование свечей (включая volume)
-async def get_latest_ohlcv(symbol: str, tf: str, open_time: str, pg_pool) -> pd.DataFrame:
-    cache_key = f"{symbol}:{tf}"
+# 🔸 Поштучный расчёт: все инстансы таймфрейма для одного тикера
+async def process_event(redis, pg_pool, symbol: str, tf: str, open_time: str, data: dict):
+    candles = await get_latest_ohlcv(symbol, tf, open_time, data, pg_pool)
+    if candles is None:
+        logging.warning(f"⚠️ Расчёт прерван: нет свечей для {symbol} / {tf} / {open_time}")
+        return
+
+    # 🔹 Все инстансы таймфрейма — одним поиском по индексу, расчёт параллельно,
+    #    запись результатов бара — одним пакетом (Redis pipeline + executemany)
+    instances = instances_by_tf.get(tf, [])
+    precision_price = tickers_storage[symbol]["precision_price"]
+    semaphore = asyncio.Semaphore(INDICATOR_CONCURRENCY)
+
+    async def run_instance(instance_id, kind, cfg):
+        async with semaphore:
+            return await INDICATOR_REGISTRY[kind](
+                instance_id=instance_id,
+                symbol=symbol,
+                tf=tf,
+                open_time=open_time,
+                params=cfg["params"],
+                candles=candles,
+                redis=redis,
+                db=pg_pool,
+                precision_price=precision_price,
+                stream_publish=cfg["stream_publish"]
+            )
+
+    results = await asyncio.gather(*(run_instance(*instance) for instance in instances))
+    await flush_results(redis, pg_pool, symbol, tf, open_time, results)
+# 🔸 Пакетный режим: события одного бара (tf, open_time) собираются в окно и считаются вместе
+def collect_event(redis, pg_pool, symbol: str, tf: str, open_time: str, data: dict):
+    key = (tf, open_time)
+    batch = pending_batches.get(key)
+    if batch is None:
+        batch = pending_batches[key] = {"events": {}, "full": asyncio.Event(), "started": time.perf_counter()}
+        asyncio.create_task(run_bar_batch(redis, pg_pool, tf, open_time, batch))
+    batch["events"][symbol] = data
+    if len(batch["events"]) >= len(tickers_storage):
+        batch["full"].set()  # пришли все тикеры — окно не ждём
+# 🔸 Расчёт пакета: буферы всех тикеров, один векторный проход по инстансам, одна запись
+async def run_bar_batch(redis, pg_pool, tf: str, open_time: str, batch: dict):
+    try:
+        await asyncio.wait_for(batch["full"].wait(), INDICATOR_BATCH_WINDOW)
+    except asyncio.TimeoutError:
+        pass
+    pending_batches.pop((tf, open_time), None)
 
     try:
-        incoming_time = datetime.fromisoformat(open_time)
+        events = batch["events"]
+        symbols = [symbol for symbol in events if symbol in tickers_storage]
+        rings = await asyncio.gather(*(
+            get_latest_ohlcv(symbol, tf, open_time, events[symbol], pg_pool) for symbol in symbols
+        ))
+        ready = {symbol: ring for symbol, ring in zip(symbols, rings) if ring is not None}
+        if not ready:
+            logging.warning(f"⚠️ Расчёт прерван: нет свечей для пакета {tf} / {open_time}")
+            return
+
+        instances = instances_by_tf.get(tf, [])
+        bar_time = np.datetime64(datetime.fromisoformat(open_time), "ms")
+        computed = compute_values(instances, list(ready), ready, bar_time)
+        precisions = {symbol: tickers_storage[symbol]["precision_price"] for symbol in ready}
+        results = await build_batch_results(pg_pool, instances, computed, tf, open_time, precisions)
+        await flush_batch_results(redis, pg_pool, tf, open_time, results)
+
+        elapsed = (time.perf_counter() - batch["started"]) * 1000
+        debug_log(f"📦 Пакет {tf} / {open_time}: тикеров {len(ready)}, инстансов {len(instances)}, {elapsed:.0f} мс")
+    except Exception as e:
+        logging.error(f"❌ Ошибка пакетного расчёта {tf} / {open_time}: {e}")
+# 🔸 Свечи для расчёта: кольцевой буфер (symbol, tf), продвинутый на бар события
+async def get_latest_ohlcv(symbol: str, tf: str, open_time: str, event: dict, pg_pool) -> Optional[OhlcvRing]:
+    try:
+        open_dt = datetime.fromisoformat(open_time)
     except Exception:
         logging.error(f"❌ Невалидный формат open_time: {open_time}")
-        return pd.DataFrame()
-
-    # Проверка кэша
-    cached = ohlcv_cache.get(cache_key)
-    if cached:
-        cached_time = cached["open_time"]
-        if incoming_time < cached_time:
-            logging.warning(f"⚠️ Устаревшее событие: {symbol} / {tf} / {open_time}")
-            return cached["candles"]
-        if incoming_time == cached_time:
-            debug_log(f"🧠 Используем кэш для {symbol} / {tf} / {open_time}")
-            return cached["candles"]
-
-    # Загрузка новых свечей из базы
-    table_name = f"ohlcv2_{tf.lower()}"
+        return None
+
     try:
-        async with pg_pool.acquire() as conn:
-            rows = await conn.fetch(
-                f"""
-                SELECT open_time, high, low, close, volume
-                FROM {table_name}
-                WHERE symbol = $1
-                ORDER BY open_time DESC
-                LIMIT 250
-                """,
-                symbol
-            )
+        return await advance_buffer(ohlcv_buffers, pg_pool, symbol, tf, open_dt, event)
     except Exception as e:
         logging.error(f"❌ Ошибка при загрузке свечей для {symbol} / {tf}: {e}")
-        return pd.DataFrame()
+        return None
+# 🔸 Загрузка конфигурации одного инстанса (None — удалён или выключен)
+async def load_instance_config(pg_pool, instance_id: int) -> Optional[Dict[str, Any]]:
+    async with pg_pool.acquire() as conn:
+        row = await conn.fetchrow(
+            "SELECT id, indicator, timeframe, stream_publish FROM indicator_instances_v2 WHERE id = $1 AND enabled = true",
+            instance_id
+        )
+        if row is None:
+            return None
+        params = await conn.fetch(
+            "SELECT param, value FROM indicator_parameters_v2 WHERE instance_id = $1",
+            instance_id
+        )
+    return {
+        "indicator": row["indicator"],
+        "timeframe": row["timeframe"],
+        "stream_publish": row["stream_publish"],
+        "params": {param["param"]: param["value"] for param in params}
+    }
+# 🔸 Точечные изменения индекса: списки заменяются целиком — идущие расчёты видят прежний список
+def index_remove(instance_id: int):
+    for tf, entries in list(instances_by_tf.items()):
+        if any(entry[0] == instance_id for entry in entries):
+            instances_by_tf[tf] = [entry for entry in entries if entry[0] != instance_id]
+
+def index_add(instance_id: int, cfg: Dict[str, Any]):
+    kind = cfg["indicator"].upper()
+    if kind not in INDICATOR_REGISTRY:
+        return
+    tf = cfg["timeframe"].upper()
+    instances_by_tf[tf] = instances_by_tf.get(tf, []) + [(instance_id, kind, cfg)]
+# 🔸 Применение новой конфигурации инстанса (cfg=None — удаление)
+async def apply_instance_config(redis, pg_pool, instance_id: int, cfg: Optional[Dict[str, Any]]):
+    old = indicator_configs.get(instance_id)
+    if cfg == old:
+        return
+
+    # Изменился только флаг публикации — состояние расчёта остаётся
+    if old is not None and cfg is not None and {**old, "stream_publish": None} == {**cfg, "stream_publish": None}:
+        indicator_configs[instance_id] = cfg
+        index_remove(instance_id)
+        index_add(instance_id, cfg)
+        logging.info(f"🔄 Инстанс {instance_id}: stream_publish = {cfg['stream_publish']}")
+        return
+
+    if old is not None:
+        indicator_configs.pop(instance_id, None)
+        index_remove(instance_id)
+        drop_instance_states(instance_id)
+        batch_states.pop(instance_id, None)
+        logging.info(f"🗑️ Инстанс {instance_id} ({old['indicator']} {old['timeframe']}) снят с расчёта")
+
+    if cfg is not None:
+        indicator_configs[instance_id] = cfg
+        asyncio.create_task(warm_instance(redis, pg_pool, instance_id, cfg))
+# 🔸 Прогрев нового инстанса по истории в фоне; в индекс (и в публикацию) — только после прогрева
+async def warm_instance(redis, pg_pool, instance_id: int, cfg: Dict[str, Any]):
+    kind = cfg["indicator"].upper()
+    if kind not in INDICATOR_REGISTRY:
+        logging.warning(f"⚠️ Инстанс {instance_id}: неизвестный индикатор {cfg['indicator']}")
+        return
+    tf = cfg["timeframe"].upper()
+    started = time.perf_counter()
+
+    rings = {}
+    for symbol in list(tickers_storage):
+        try:
+            ring = await ensure_buffer(ohlcv_buffers, pg_pool, symbol, tf)
+        except Exception as e:
+            logging.error(f"❌ Ошибка загрузки свечей для прогрева {symbol} / {tf}: {e}")
+            continue
+        if ring is not None:
+            rings[symbol] = ring
 
-    if not rows or len(rows) < 10:
-        logging.warning(f"⚠️ Недостаточно данных OHLCV для {symbol} / {tf}")
-        return pd.DataFrame()
+    # Пока грузились свечи, инстанс могли изменить или удалить — прогрев не нужен
+    if indicator_configs.get(instance_id) is not cfg:
+        return
 
-    df = pd.DataFrame(rows, columns=["open_time", "high", "low", "close", "volume"])
-    df = df[::-1]  # Сортировка по времени (ASC)
+    try:
+        if INDICATOR_BATCH_WINDOW > 0:
+            by_time: Dict[Any, List[str]] = {}
+            for symbol, ring in rings.items():
+                by_time.setdefault(ring.last_time, []).append(symbol)
+            for bar_time, symbols in by_time.items():
+                compute_values([(instance_id, kind, cfg)], symbols, rings, bar_time)
+        else:
+            for symbol, ring in rings.items():
+                await INDICATOR_REGISTRY[kind](
+                    instance_id=instance_id,
+                    symbol=symbol,
+                    tf=tf,
+                    open_time=ring.last_time.astype("datetime64[s]").item().isoformat(),
+                    params=cfg["params"],
+                    candles=ring,
+                    redis=redis,
+                    db=pg_pool,
+                    precision_price=tickers_storage.get(symbol, {}).get("precision_price", 8),
+                    stream_publish=False
+                )
+    except Exception as e:
+        logging.error(f"❌ Ошибка прогрева инстанса {instance_id}: {e}")
+
+    # За время прогрева инстанс могли изменить или удалить — созданные прогревом состояния освобождаются
+    # (действующий конфиг, если есть, прогреется заново по первому бару), в индекс инстанс не попадает
+    if indicator_configs.get(instance_id) is not cfg:
+        drop_instance_states(instance_id)
+        batch_states.pop(instance_id, None)
+        return
+    index_add(instance_id, cfg)
+    elapsed = time.perf_counter() - started
+    logging.info(f"✅ Инстанс {instance_id} ({kind} {tf}) прогрет по {len(rings)} тикерам за {elapsed:.1f} с и включён")
+# 🔸 Уведомления Postgres об изменениях конфигурации: payload — id инстанса
+async def listen_config_changes(redis, pg_pool):
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(DATABASE_URL)
 
-    # Обновление кэша
-    ohlcv_cache[cache_key] = {
-        "open_time": incoming_time,
-        "candles": df
-    }
+            def on_notify(connection, pid, channel, payload):
+                asyncio.create_task(handle_config_notification(redis, pg_pool, payload))
+
+            await conn.add_listener(CONFIG_CHANNEL, on_notify)
+            logging.info(f"📡 LISTEN {CONFIG_CHANNEL} активен")
+
+            # Сразу после LISTEN (и при старте, и после обрыва) — сверка: изменения между загрузкой
+            # конфигурации и подпиской или за время обрыва иначе ждали бы периодической сверки
+            await reconcile_configs(redis, pg_pool)
 
-    debug_log(f"📊 Загружены {len(df)} свечей для {symbol} / {tf} / {open_time}")
-    return df
-# 🔄 Периодическое обновление тикеров и конфигураций
-async def refresh_all_periodically(pg_pool):
+            while not conn.is_closed():
+                await asyncio.sleep(5)
+        except Exception as e:
+            logging.error(f"❌ LISTEN {CONFIG_CHANNEL} прерван, переподключение через 5 сек: {e}")
+        finally:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        await asyncio.sleep(5)
+# 🔸 Обработка одного уведомления: перечитываем только изменённый инстанс
+async def handle_config_notification(redis, pg_pool, payload: str):
+    try:
+        instance_id = int(payload)
+        async with config_lock:
+            cfg = await load_instance_config(pg_pool, instance_id)
+            await apply_instance_config(redis, pg_pool, instance_id, cfg)
+    except Exception as e:
+        logging.error(f"❌ Ошибка применения изменения конфигурации ({payload}): {e}")
+# 🔸 Активация/деактивация тикеров (тот же канал, что у feed_v2)
+async def listen_ticker_activation(redis, pg_pool):
+    while True:
+        try:
+            pubsub = redis.pubsub()
+            await pubsub.subscribe("ticker_activation")
+            logging.info("📡 Подписка на ticker_activation активна.")
+
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                try:
+                    data = json.loads(message["data"])
+                    symbol = data.get("symbol", "").upper()
+                    if data.get("action") == "activate":
+                        async with pg_pool.acquire() as conn:
+                            row = await conn.fetchrow(
+                                "SELECT precision_price FROM tickers WHERE symbol = $1 AND status = 'enabled'",
+                                symbol
+                            )
+                        if row is not None:
+                            tickers_storage[symbol] = {"precision_price": row["precision_price"]}
+                            logging.info(f"➕ Тикер {symbol} добавлен в расчёт")
+                    elif data.get("action") == "deactivate":
+                        remove_ticker(symbol)
+                except Exception as e:
+                    logging.error(f"❌ Ошибка разбора ticker_activation: {e}")
+        except Exception as e:
+            logging.error(f"❌ Подписка ticker_activation упала, переподключение через 5 сек: {e}")
+            await asyncio.sleep(5)
+# 🔸 Отключение тикера: освобождаем буферы и состояния
+def remove_ticker(symbol: str):
+    if tickers_storage.pop(symbol, None) is None:
+        return
+    for key in [key for key in ohlcv_buffers if key.startswith(f"{symbol}:")]:
+        del ohlcv_buffers[key]
+    drop_symbol_states(symbol)
+    forget_batch_symbol(symbol)
+    logging.info(f"➖ Тикер {symbol} снят с расчёта")
+# 🔸 Буфер (symbol, tf) перечитан после правок задним числом: состояния инстансов этого таймфрейма
+#    посчитаны по старым барам — сбрасываются и прогреваются заново по первому бару
+def drop_timeframe_states(symbol: str, tf: str):
+    instance_ids = {instance_id for instance_id, cfg in indicator_configs.items() if cfg["timeframe"].upper() == tf}
+    drop_symbol_states(symbol, instance_ids)
+    forget_batch_symbol(symbol, instance_ids)
+# 🔸 Полная сверка (страховка от потерянных уведомлений): применяются только отличия
+async def reconcile_configs(redis, pg_pool):
+    tickers = await load_tickers(pg_pool)
+    for symbol in set(tickers_storage) - set(tickers):
+        remove_ticker(symbol)
+    tickers_storage.update(tickers)
+
+    configs = await load_indicator_config(pg_pool)
+    async with config_lock:
+        for instance_id in set(configs) | set(indicator_configs):
+            if configs.get(instance_id) != indicator_configs.get(instance_id):
+                await apply_instance_config(redis, pg_pool, instance_id, configs.get(instance_id))
+# 🔄 Редкая периодическая сверка тикеров и конфигураций (основной путь — уведомления)
+async def refresh_all_periodically(redis, pg_pool):
     while True:
-        await asyncio.sleep(300)  # каждые 5 минут
+        await asyncio.sleep(CONFIG_RECONCILE_INTERVAL)
         try:
-            global tickers_storage
-            global indicator_configs
-            tickers_storage = await load_tickers(pg_pool)
-            indicator_configs = await load_indicator_config(pg_pool)
-            logging.info("🔄 Обновлены тикеры и конфигурации индикаторов")
+            await reconcile_configs(redis, pg_pool)
+            debug_log("🔄 Сверка тикеров и конфигураций индикаторов выполнена")
         except Exception as e:
-            logging.error(f"❌ Ошибка при обновлении тикеров/конфигураций: {e}")                
+            logging.error(f"❌ Ошибка при обновлении тикеров/конфигураций: {e}")
 # 🔸 Главная точка входа
 async def main():
     logging.info("🚀 indicators_v2_main.py запущен.")
@@ -308,11 +467,17 @@ async def main():
     logging.info(f"✅ Загружено тикеров: {len(tickers_storage)}")
     
     global indicator_configs
+    global instances_by_tf
     indicator_configs = await load_indicator_config(pg_pool)
+    instances_by_tf = build_instance_index(indicator_configs)
     logging.info(f"📥 Конфигураций расчёта: {len(indicator_configs)}")
     
+    reseed_hooks.append(drop_timeframe_states)
     asyncio.create_task(subscribe_to_ohlcv(redis, pg_pool))
-    asyncio.create_task(refresh_all_periodically(pg_pool))
+    asyncio.create_task(refresh_all_periodically(redis, pg_pool))
+    asyncio.create_task(listen_config_changes(redis, pg_pool))
+    asyncio.create_task(listen_ticker_activation(redis, pg_pool))
+    asyncio.create_task(run_retention(pg_pool))
 
     # Заглушка: основной цикл
     while True:
@@ -1,34 +1,8 @@
 import logging
-import pandas as pd
-import numpy as np
-import json
-from datetime import datetime
 from debug_utils import debug_log
-# 🔸 Очистка старых значений (оставляем только 100 последних)
-async def cleanup_old_values(db, instance_id, symbol, param_name):
-    try:
-        async with db.acquire() as conn:
-            await conn.execute(
-                """
-                DELETE FROM indicator_values_v2
-                WHERE ctid IN (
-                    SELECT ctid FROM (
-                        SELECT ctid,
-                               ROW_NUMBER() OVER (
-                                   PARTITION BY instance_id, symbol, param_name
-                                   ORDER BY open_time DESC
-                               ) AS rownum
-                        FROM indicator_values_v2
-                        WHERE instance_id = $1 AND symbol = $2 AND param_name = $3
-                    ) sub
-                    WHERE sub.rownum > 300
-                )
-                """,
-                instance_id, symbol, param_name
-            )
-    except Exception as e:
-        logging.error(f"❌ Ошибка при очистке LR {param_name} для {symbol}: {e}")
-# 🔸 Расчёт линейной регрессии и запись в Redis + БД + Stream
+from indicator_state import advance_indicator
+
+# 🔸 Расчёт линейной регрессии: результат для записи в Redis + БД + Stream
 async def process_lr(instance_id, symbol, tf, open_time, params, candles, redis, db, precision_price, stream_publish):
     try:
         length = int(params.get("length", 50))
@@ -36,36 +10,21 @@ async def process_lr(instance_id, symbol, tf, open_time, params, candles, redis,
             logging.warning(f"⚠️ Нет close в свечах {symbol} / {tf}")
             return
 
-        closes = candles["close"].astype(float)
-        if len(closes) < length:
+        if len(candles) < length:
             logging.warning(f"⚠️ Недостаточно данных для расчёта LR {symbol} / {tf}")
             return
 
-        closes = closes.tail(length).reset_index(drop=True)
-        x = np.arange(length)
-
-        # 🔹 A. Линейная регрессия по ценам
-        coeffs_raw = np.polyfit(x, closes, deg=1)
-        slope_raw = coeffs_raw[0]
-        mid_raw = closes.mean()
-        intercept_raw = mid_raw - slope_raw * (length // 2) + ((1 - (length % 2)) / 2) * slope_raw
-
-        reg_line_raw = slope_raw * x + intercept_raw
-        std_dev = np.sqrt(np.mean((closes - reg_line_raw) ** 2))
-
-        upper_val = round(float(reg_line_raw[-1] + 2 * std_dev), precision_price)
-        lower_val = round(float(reg_line_raw[-1] - 2 * std_dev), precision_price)
-        mid_val   = round(float(reg_line_raw[-1]), precision_price)
-
-        # 🔹 B. Расчёт угла по нормализованным данным
-        base_price = closes.mean()
-        norm = (closes - base_price) / base_price
-        coeffs_norm = np.polyfit(x, norm, deg=1)
-        slope_norm = coeffs_norm[0]
-        angle_val = round(float(np.degrees(np.arctan(slope_norm))), 5)
+        # 🔹 Канал и угол из скользящих сумм окна (O(1) на бар), как np.polyfit по последним length барам
+        lr_raw = advance_indicator("LR", instance_id, symbol, length, candles)
+        if lr_raw is None:
+            logging.warning(f"⚠️ Недостаточно данных для расчёта LR {symbol} / {tf}")
+            return
+        upper_raw, lower_raw, mid_raw, angle_raw = lr_raw
 
-        # Сохранение значений
-        open_dt = datetime.fromisoformat(open_time)
+        upper_val = round(upper_raw, precision_price)
+        lower_val = round(lower_raw, precision_price)
+        mid_val   = round(mid_raw, precision_price)
+        angle_val = round(angle_raw, 5)
 
         results = [
             ("lr_upper", upper_val),
@@ -74,42 +33,16 @@ async def process_lr(instance_id, symbol, tf, open_time, params, candles, redis,
             ("lr_angle", angle_val)
         ]
 
-        # Redis
-        for param_name, value in results:
-            redis_key = f"{symbol}:{tf}:LR:{param_name}"
-            await redis.set(redis_key, value)
-
-        # БД
-        async with db.acquire() as conn:
-            await conn.executemany(
-                """
-                INSERT INTO indicator_values_v2
-                (instance_id, symbol, open_time, param_name, value)
-                VALUES ($1, $2, $3, $4, $5)
-                ON CONFLICT DO NOTHING
-                """,
-                [(instance_id, symbol, open_dt, param, val) for param, val in results]
-            )
-
-        await cleanup_old_values(db, instance_id, symbol, param_name)
-        
         debug_log(f"✅ LR{length} для {symbol} / {tf} рассчитан (angle={angle_val})")
 
-        if stream_publish:
-            try:
-                await redis.xadd(
-                    "indicators_ready_stream",
-                    {
-                        "symbol": symbol,
-                        "timeframe": tf,
-                        "indicator": "LR",
-                        "params": json.dumps({"length": str(length)}),
-                        "calculated_at": open_time
-                    }
-                )
-                debug_log(f"📤 Stream: LR{length} опубликован для {symbol} / {tf}")
-            except Exception as e:
-                logging.error(f"❌ Ошибка публикации LR в Redis Stream: {e}")
+        return {
+            "instance_id": instance_id,
+            "indicator": "LR",
+            "params": {"length": str(length)},
+            "values": results,
+            "redis": {f"{symbol}:{tf}:LR:{param_name}": value for param_name, value in results},
+            "stream_publish": stream_publish
+        }
 
     except Exception as e:
         logging.error(f"❌ Ошибка расчёта LR {symbol} / {tf}: {e}")
\ No newline at end of file
@@ -0,0 +1,207 @@
+import os
+import asyncio
+import logging
+import numpy as np
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from debug_utils import debug_log
+from timeframes import TF_MINUTES
+
+# 🔸 Кольцевые буферы OHLCV по (symbol, tf): загрузка из БД один раз, дальше — по бару из события
+
+OHLCV_BUFFER_SIZE = int(os.getenv("OHLCV_BUFFER_SIZE", 250))
+MIN_BARS = 10
+RESEED_DELAY = float(os.getenv("OHLCV_RESEED_DELAY", 2.0))  # секунд: задержка перечитывания после правок задним числом
+
+# Отложенные перечитывания буферов по ключу symbol:tf — не больше одного на серию правок
+pending_reseeds: Dict[str, asyncio.Task] = {}
+
+# Обработчики перечитанного буфера (symbol, tf): состояния, посчитанные по старым барам, сбрасываются
+reseed_hooks: List[Callable[[str, str], None]] = []
+
+COLUMNS = ("open_time", "high", "low", "close", "volume")
+PRICE_COLUMNS = ("high", "low", "close", "volume")
+
+# 🔸 Буфер фиксированной ёмкости: каждое значение пишется дважды (i и i + capacity),
+#    поэтому окно последних баров — всегда непрерывный срез без копирования
+class OhlcvRing:
+    columns = COLUMNS
+
+    def __init__(self, capacity: int, step_minutes: int):
+        self.capacity = capacity
+        self.step = np.timedelta64(step_minutes, "m")
+        self.start = 0
+        self.size = 0
+        self.data = {col: np.empty(2 * capacity, dtype=float) for col in PRICE_COLUMNS}
+        self.data["open_time"] = np.empty(2 * capacity, dtype="datetime64[ms]")
+
+    def __len__(self):
+        return self.size
+
+    # Колонка как view последних баров (по возрастанию времени)
+    def __getitem__(self, col: str) -> np.ndarray:
+        return self.data[col][self.start:self.start + self.size]
+
+    @property
+    def last_time(self):
+        return self.data["open_time"][self.start + self.size - 1] if self.size else None
+
+    def write(self, i, open_time, high, low, close, volume):
+        for col, value in zip(COLUMNS, (open_time, high, low, close, volume)):
+            self.data[col][i] = value
+            self.data[col][i + self.capacity] = value
+
+    def append(self, open_time, high, low, close, volume):
+        if self.size < self.capacity:
+            i = self.size
+            self.size += 1
+        else:
+            i = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.write(i, open_time, high, low, close, volume)
+
+    # Повторное событие того же бара (например, после repair) — перезапись последнего бара
+    def replace_last(self, open_time, high, low, close, volume):
+        self.write((self.start + self.size - 1) % self.capacity, open_time, high, low, close, volume)
+
+# 🔸 Загрузка последних баров из БД в новый буфер
+async def seed_buffer(pg_pool, symbol: str, tf: str) -> Optional[OhlcvRing]:
+    async with pg_pool.acquire() as conn:
+        rows = await conn.fetch(
+            f"""
+            SELECT open_time, high, low, close, volume
+            FROM ohlcv2_{tf.lower()}
+            WHERE symbol = $1
+            ORDER BY open_time DESC
+            LIMIT {OHLCV_BUFFER_SIZE}
+            """,
+            symbol
+        )
+
+    if not rows or len(rows) < MIN_BARS:
+        logging.warning(f"⚠️ Недостаточно данных OHLCV для {symbol} / {tf}")
+        return None
+
+    ring = OhlcvRing(OHLCV_BUFFER_SIZE, TF_MINUTES[tf])
+    for row in reversed(rows):
+        ring.append(
+            np.datetime64(row["open_time"], "ms"),
+            float(row["high"]), float(row["low"]), float(row["close"]), float(row["volume"])
+        )
+    debug_log(f"📊 Загружены {len(ring)} свечей для {symbol} / {tf}")
+    return ring
+
+# 🔸 Буфер тикера без продвижения (прогрев нового инстанса): существующий или загруженный из БД
+async def ensure_buffer(buffers: Dict[str, OhlcvRing], pg_pool, symbol: str, tf: str) -> Optional[OhlcvRing]:
+    key = f"{symbol}:{tf}"
+    if key not in buffers:
+        ring = await seed_buffer(pg_pool, symbol, tf)
+        if ring is None:
+            return None
+        buffers.setdefault(key, ring)
+    return buffers[key]
+
+# 🔸 Один бар: из события (если в нём есть OHLCV) или одной строкой из БД
+async def fetch_bar(pg_pool, symbol: str, tf: str, open_dt: datetime, event: dict):
+    if all(col in event for col in PRICE_COLUMNS):
+        return tuple(float(event[col]) for col in PRICE_COLUMNS)
+
+    async with pg_pool.acquire() as conn:
+        row = await conn.fetchrow(
+            f"""
+            SELECT high, low, close, volume
+            FROM ohlcv2_{tf.lower()}
+            WHERE symbol = $1 AND open_time = $2
+            """,
+            symbol, open_dt
+        )
+    if row is None:
+        return None
+    return tuple(float(row[col]) for col in PRICE_COLUMNS)
+
+# 🔸 Отложенное перечитывание буфера: серия правок задним числом (repair) даёт одно перечитывание
+def schedule_reseed(buffers: Dict[str, OhlcvRing], pg_pool, symbol: str, tf: str):
+    key = f"{symbol}:{tf}"
+    if key in pending_reseeds:
+        return
+    logging.warning(f"⚠️ Правки задним числом в окне буфера {symbol} / {tf}: перечитывание через {RESEED_DELAY} с")
+
+    async def reseed():
+        try:
+            await asyncio.sleep(RESEED_DELAY)
+            ring = await seed_buffer(pg_pool, symbol, tf)
+            if ring is not None:
+                buffers[key] = ring
+            else:
+                buffers.pop(key, None)
+            for hook in reseed_hooks:
+                hook(symbol, tf)
+            logging.info(f"🔄 Буфер {symbol} / {tf} перечитан после правок задним числом")
+        except Exception as e:
+            logging.error(f"❌ Ошибка перечитывания буфера {symbol} / {tf}: {e}")
+        finally:
+            pending_reseeds.pop(key, None)
+
+    pending_reseeds[key] = asyncio.create_task(reseed())
+
+# 🔸 Бар старше последнего в буфере: вне окна или без изменений — игнорируется,
+#    изменённый или отсутствовавший бар внутри окна — отложенное перечитывание
+async def handle_backdated_bar(buffers: Dict[str, OhlcvRing], pg_pool, symbol: str, tf: str, ring: OhlcvRing, open_dt: datetime, event: dict):
+    bar_time = np.datetime64(open_dt, "ms")
+    open_times = ring["open_time"]
+    if bar_time < open_times[0]:
+        debug_log(f"⏪ Бар вне окна буфера, пропущен: {symbol} / {tf} / {open_dt.isoformat()}")
+        return
+
+    i = int(np.searchsorted(open_times, bar_time))
+    if open_times[i] == bar_time:
+        bar = await fetch_bar(pg_pool, symbol, tf, open_dt, event)
+        if bar is None or bar == tuple(float(ring[col][i]) for col in PRICE_COLUMNS):
+            debug_log(f"⏪ Бар задним числом без изменений: {symbol} / {tf} / {open_dt.isoformat()}")
+            return
+
+    debug_log(f"⏪ Изменён бар в окне буфера: {symbol} / {tf} / {open_dt.isoformat()}")
+    schedule_reseed(buffers, pg_pool, symbol, tf)
+
+# 🔸 Продвижение буфера на бар события с проверкой согласованности
+#    Возвращает буфер, заканчивающийся на этом баре, или None (расчёт не нужен / нет данных)
+async def advance_buffer(buffers: Dict[str, OhlcvRing], pg_pool, symbol: str, tf: str, open_dt: datetime, event: dict):
+    key = f"{symbol}:{tf}"
+    ring = buffers.get(key)
+    bar_time = np.datetime64(open_dt, "ms")
+
+    if ring is None:
+        ring = await seed_buffer(pg_pool, symbol, tf)
+        if ring is None:
+            return None
+        buffers[key] = ring
+        if ring.last_time == bar_time:
+            return ring
+
+    last_time = ring.last_time
+
+    # Бар из прошлого (repair задним числом): расчёт не нужен, буфер перечитывается только если бар в окне изменился
+    if bar_time < last_time:
+        await handle_backdated_bar(buffers, pg_pool, symbol, tf, ring, open_dt, event)
+        return None
+
+    # Разрыв в последовательности баров — буфер неполный, перечитываем из БД
+    if bar_time > last_time + ring.step:
+        logging.warning(f"⚠️ Разрыв баров {symbol} / {tf}: {last_time} → {bar_time}, буфер перезагружен")
+        ring = await seed_buffer(pg_pool, symbol, tf)
+        if ring is None:
+            buffers.pop(key, None)
+            return None
+        buffers[key] = ring
+        return ring if ring.last_time == bar_time else None
+
+    bar = await fetch_bar(pg_pool, symbol, tf, open_dt, event)
+    if bar is None:
+        logging.warning(f"⚠️ Бар не найден: {symbol} / {tf} / {open_dt.isoformat()}")
+        return None
+
+    if bar_time == last_time:
+        ring.replace_last(bar_time, *bar)
+    else:
+        ring.append(bar_time, *bar)
+    return ring
@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+from indicator_state import STATE_CLASSES, warmup_state
+
+# 🔸 Сверка инкрементального движка (indicator_state) с исходными pandas-формулами
+#
+# Запуск на записанных свечах:
+#   python parity_check.py --csv candles.csv            (колонки open_time, high, low, close, volume)
+#   python parity_check.py --symbol BTCUSDT --tf M5     (последние --limit свечей из ohlcv2_<tf>, DATABASE_URL)
+# Код возврата 1 — расхождение больше допуска.
+
+# 🔸 Эталонные формулы pandas (как в ema.py / rsi.py / atr.py / mfi.py / lr.py до перехода на состояния)
+def reference_series(kind, length, df):
+    high = df["high"].astype(float)
+    low = df["low"].astype(float)
+    close = df["close"].astype(float)
+    volume = df["volume"].astype(float)
+
+    if kind == "EMA":
+        return close.ewm(span=length, adjust=False).mean()
+
+    if kind == "RSI":
+        delta = close.diff()
+        avg_gain = delta.clip(lower=0).ewm(alpha=1/length, adjust=False).mean()
+        avg_loss = (-delta.clip(upper=0)).ewm(alpha=1/length, adjust=False).mean()
+        return 100 - (100 / (1 + avg_gain / avg_loss))
+
+    if kind == "ATR":
+        prev_close = close.shift(1)
+        tr = pd.concat([
+            (high - low).abs(),
+            (high - prev_close).abs(),
+            (low - prev_close).abs()
+        ], axis=1).max(axis=1)
+        return tr.ewm(alpha=1/length, adjust=False).mean()
+
+    if kind == "MFI":
+        tp = (high + low + close) / 3
+        rmf = tp * volume
+        delta_tp = tp.diff()
+        pos_sum = rmf.where(delta_tp > 0, 0.0).rolling(length).sum()
+        neg_sum = rmf.where(delta_tp < 0, 0.0).rolling(length).sum()
+        return 100 - (100 / (1 + pos_sum / neg_sum.replace(0, 1e-6)))
+
+    if kind == "LR":
+        return lr_reference(close.to_numpy(), length)
+
+    raise ValueError(kind)
+
+# 🔸 Эталон LR: np.polyfit по каждому окну (как lr.py до перехода на скользящие суммы)
+#    Возвращает массив (бары × 4): upper, lower, mid, angle
+def lr_reference(closes, length):
+    out = np.full((len(closes), 4), np.nan)
+    x = np.arange(length)
+    for i in range(length - 1, len(closes)):
+        window = closes[i - length + 1:i + 1]
+        slope = np.polyfit(x, window, deg=1)[0]
+        mid = window.mean()
+        intercept = mid - slope * (length // 2) + ((1 - (length % 2)) / 2) * slope
+        reg_line = slope * x + intercept
+        std_dev = np.sqrt(np.mean((window - reg_line) ** 2))
+        norm = (window - mid) / mid
+        angle = np.degrees(np.arctan(np.polyfit(x, norm, deg=1)[0]))
+        out[i] = (reg_line[-1] + 2 * std_dev, reg_line[-1] - 2 * std_dev, reg_line[-1], angle)
+    return out
+
+# 🔸 Значения инкрементального движка: прогрев на первых warmup барах, дальше по одному бару
+def streaming_series(kind, length, df, warmup):
+    high = df["high"].to_numpy(dtype=float)
+    low = df["low"].to_numpy(dtype=float)
+    close = df["close"].to_numpy(dtype=float)
+    volume = df["volume"].to_numpy(dtype=float)
+
+    state, value = warmup_state(kind, length, high[:warmup], low[:warmup], close[:warmup], volume[:warmup])
+    values = [None] * (warmup - 1) + [value]
+    for i in range(warmup, len(close)):
+        values.append(state.update(high[i], low[i], close[i], volume[i]))
+    width = 4 if kind == "LR" else 1
+    return np.array([[np.nan] * width if v is None else np.atleast_1d(v) for v in values], dtype=float)
+
+# 🔸 Загрузка свечей из ohlcv2_<tf>
+async def load_candles(symbol, tf, limit):
+    import asyncpg
+    conn = await asyncpg.connect(os.getenv("DATABASE_URL"))
+    try:
+        rows = await conn.fetch(
+            f"""
+            SELECT open_time, high, low, close, volume
+            FROM ohlcv2_{tf.lower()}
+            WHERE symbol = $1
+            ORDER BY open_time DESC
+            LIMIT {int(limit)}
+            """,
+            symbol
+        )
+    finally:
+        await conn.close()
+    return pd.DataFrame(rows, columns=["open_time", "high", "low", "close", "volume"])[::-1].reset_index(drop=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Сверка инкрементальных индикаторов с pandas")
+    parser.add_argument("--csv")
+    parser.add_argument("--symbol")
+    parser.add_argument("--tf", default="M5")
+    parser.add_argument("--limit", type=int, default=2000)
+    parser.add_argument("--lengths", default="9,14,21,50")
+    parser.add_argument("--warmup", type=int, default=250)
+    parser.add_argument("--tolerance", type=float, default=1e-9, help="допустимое относительное расхождение")
+    parser.add_argument("--atol", type=float, default=1e-12, help="допустимое абсолютное расхождение")
+    args = parser.parse_args()
+
+    if args.csv:
+        df = pd.read_csv(args.csv)
+    elif args.symbol:
+        df = asyncio.run(load_candles(args.symbol, args.tf, args.limit))
+    else:
+        parser.error("нужен --csv или --symbol")
+
+    warmup = min(args.warmup, len(df))
+    failed = False
+    for kind in STATE_CLASSES:
+        for length in [int(x) for x in args.lengths.split(",")]:
+            ref = np.asarray(reference_series(kind, length, df), dtype=float).reshape(len(df), -1)
+            inc = streaming_series(kind, length, df, warmup)
+            mask = ~np.isnan(ref) & ~np.isnan(inc)
+            diff = np.abs(ref[mask] - inc[mask])
+            scale = np.maximum(np.abs(ref[mask]), 1e-12)
+            rel = float(np.max(diff / scale)) if mask.any() else 0.0
+            # Значения около нуля (угол LR на плоском рынке) сравниваются по абсолютному допуску
+            within = bool(np.all(diff <= args.tolerance * np.abs(ref[mask]) + args.atol))
+
+            # Для сравнения: прод-расчёт pandas по последним 250 барам (окно обрезает историю длинных EMA)
+            window_ref = np.asarray(reference_series(kind, length, df.tail(250)), dtype=float).reshape(min(250, len(df)), -1)[-1]
+            window_rel = float(np.max(np.abs(window_ref - inc[-1]) / np.maximum(np.abs(window_ref), 1e-12)))
+
+            status = "OK" if within else "FAIL"
+            failed |= status == "FAIL"
+            print(f"{status:4} {kind}{length:<4} баров={mask.sum():<6} max_rel={rel:.2e}  vs окно 250: {window_rel:.2e}")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
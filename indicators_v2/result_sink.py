@@ -0,0 +1,79 @@
+import logging
+import json
+from datetime import datetime
+from typing import List, Dict, Any
+from debug_utils import debug_log
+
+# 🔸 Сброс результатов всех инстансов по одному бару (symbol, tf, open_time):
+#    один Redis pipeline (все SET + один XADD) и один executemany в indicator_values_v2
+async def flush_results(redis, db, symbol: str, tf: str, open_time: str, results: List[Dict[str, Any]]):
+    await flush_batch_results(redis, db, tf, open_time, {symbol: results})
+
+# 🔸 Сброс результатов пакета тикеров одного бара (tf, open_time): {symbol: [result]}
+#    один executemany на все тикеры и один pipeline (SET + по одному XADD на тикер)
+async def flush_batch_results(redis, db, tf: str, open_time: str, results_by_symbol: Dict[str, List[Dict[str, Any]]]):
+    filtered = {}
+    for symbol, results in results_by_symbol.items():
+        results = [r for r in results if r]
+        if results:
+            filtered[symbol] = results
+    results_by_symbol = filtered
+    if not results_by_symbol:
+        return
+
+    open_dt = datetime.fromisoformat(open_time)
+    rows = [
+        (r["instance_id"], symbol, open_dt, param_name, value)
+        for symbol, results in results_by_symbol.items()
+        for r in results
+        for param_name, value in r["values"]
+    ]
+    label = next(iter(results_by_symbol)) if len(results_by_symbol) == 1 else f"{len(results_by_symbol)} тикеров"
+
+    # 🔹 БД: все значения бара одним пакетом (до XADD — подписчики Stream читают значения из БД)
+    try:
+        async with db.acquire() as conn:
+            await conn.executemany(
+                """
+                INSERT INTO indicator_values_v2
+                (instance_id, symbol, open_time, param_name, value)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT DO NOTHING
+                """,
+                rows
+            )
+    except Exception as e:
+        logging.error(f"❌ Ошибка записи индикаторов {label} / {tf}: {e}")
+
+    # 🔹 Redis: значения + по одному сообщению в Stream на тикер со списком индикаторов
+    try:
+        pipe = redis.pipeline(transaction=False)
+        published_total = 0
+        for symbol, results in results_by_symbol.items():
+            published = [
+                {
+                    "instance_id": r["instance_id"],
+                    "indicator": r["indicator"],
+                    "params": r["params"],
+                    "values": dict(r["values"])
+                }
+                for r in results if r.get("stream_publish")
+            ]
+            for r in results:
+                for key, value in r["redis"].items():
+                    pipe.set(key, value)
+            if published:
+                pipe.xadd(
+                    "indicators_ready_stream",
+                    {
+                        "symbol": symbol,
+                        "timeframe": tf,
+                        "calculated_at": open_time,
+                        "indicators": json.dumps(published)
+                    }
+                )
+                published_total += len(published)
+        await pipe.execute()
+        debug_log(f"📤 {label} / {tf}: записано значений {len(rows)}, в Stream {published_total}")
+    except Exception as e:
+        logging.error(f"❌ Ошибка публикации индикаторов в Redis {label} / {tf}: {e}")
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Dict
+from debug_utils import debug_log
+from timeframes import TF_MINUTES
+
+# 🔸 Хранение значений indicator_values_v2: периодическая пакетная очистка по open_time < cutoff
+#    вместо DELETE ... ROW_NUMBER() на каждую запись
+
+# Глубина хранения в барах по таймфрейму: INDICATOR_RETENTION="M1=1440,M5=300,M15=300"
+RETENTION_DEFAULT_BARS = int(os.getenv("INDICATOR_RETENTION_BARS", 300))
+RETENTION_INTERVAL = int(os.getenv("INDICATOR_RETENTION_INTERVAL", 600))  # секунд между проходами
+RETENTION_BATCH = int(os.getenv("INDICATOR_RETENTION_BATCH", 10000))      # строк за один DELETE
+
+# 🔸 Разбор настройки глубины хранения по таймфреймам
+def parse_retention(value: str) -> Dict[str, int]:
+    bars = {tf: RETENTION_DEFAULT_BARS for tf in TF_MINUTES}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        tf, _, count = item.partition("=")
+        bars[tf.strip().upper()] = int(count)
+    return bars
+
+RETENTION_BARS = parse_retention(os.getenv("INDICATOR_RETENTION", ""))
+
+# 🔸 Граница хранения для таймфрейма: всё, что открыто раньше, удаляется
+def retention_cutoff(tf: str, now: datetime) -> datetime:
+    return now - timedelta(minutes=TF_MINUTES[tf] * RETENTION_BARS[tf])
+
+# 🔸 DELETE порциями до исчерпания (короткие транзакции, без долгих блокировок)
+#    query — DELETE ... WHERE ctid = ANY(ARRAY(SELECT ... LIMIT <последний параметр>))
+async def purge_batches(pg_pool, query: str, *args) -> int:
+    total = 0
+    while True:
+        async with pg_pool.acquire() as conn:
+            status = await conn.execute(query, *args, RETENTION_BATCH)
+        deleted = int(status.split()[-1])
+        total += deleted
+        if deleted < RETENTION_BATCH:
+            return total
+        await asyncio.sleep(0.1)  # уступаем горячему пути между порциями
+
+# 🔸 Очистка одного таймфрейма
+async def purge_timeframe(pg_pool, tf: str, cutoff: datetime) -> int:
+    return await purge_batches(
+        pg_pool,
+        """
+        DELETE FROM indicator_values_v2
+        WHERE ctid = ANY(ARRAY(
+            SELECT v.ctid
+            FROM indicator_values_v2 v
+            JOIN indicator_instances_v2 i ON i.id = v.instance_id
+            WHERE upper(i.timeframe) = $1 AND v.open_time < $2
+            LIMIT $3
+        ))
+        """,
+        tf, cutoff
+    )
+
+# 🔸 Значения удалённых инстансов: таймфрейм по ним не определить, поэтому удаляются целиком
+async def purge_orphans(pg_pool) -> int:
+    return await purge_batches(
+        pg_pool,
+        """
+        DELETE FROM indicator_values_v2
+        WHERE ctid = ANY(ARRAY(
+            SELECT v.ctid
+            FROM indicator_values_v2 v
+            WHERE NOT EXISTS (SELECT 1 FROM indicator_instances_v2 i WHERE i.id = v.instance_id)
+            LIMIT $1
+        ))
+        """
+    )
+
+# 🔸 Периодическая очистка всех таймфреймов
+async def run_retention(pg_pool):
+    while True:
+        now = datetime.utcnow()
+        for tf in TF_MINUTES:
+            try:
+                cutoff = retention_cutoff(tf, now)
+                deleted = await purge_timeframe(pg_pool, tf, cutoff)
+                if deleted:
+                    debug_log(f"🧹 {tf}: удалено {deleted} значений старше {cutoff}")
+            except Exception as e:
+                logging.error(f"❌ Ошибка очистки индикаторов {tf}: {e}")
+        try:
+            deleted = await purge_orphans(pg_pool)
+            if deleted:
+                debug_log(f"🧹 Удалено {deleted} значений удалённых инстансов")
+        except Exception as e:
+            logging.error(f"❌ Ошибка очистки значений удалённых инстансов: {e}")
+        await asyncio.sleep(RETENTION_INTERVAL)
@@ -0,0 +1,2 @@
+# 🔸 Таймфреймы indicators_v2: длительность бара в минутах
+TF_MINUTES = {"M1": 1, "M5": 5, "M15": 15, "M30": 30, "H1": 60, "H4": 240}
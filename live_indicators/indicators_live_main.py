@@ -7,19 +7,30 @@ import asyncpg
 import redis.asyncio as aioredis
 import os
 import json
+import time
 import pandas as pd
-from datetime import datetime
-from smi_live import calculate_smi
+from collections import deque
+from datetime import datetime, timedelta
+from live_registry import build_live_indicators, history_bars
 
 # 1. Переменные окружения
 DATABASE_URL = os.getenv("DATABASE_URL")
 REDIS_HOST = os.getenv("REDIS_HOST")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
+PRICES_STREAM = os.getenv("PRICES_STREAM", "prices_stream")               # поток изменившихся mark price (feed_v2)
+PRICES_BLOCK_MS = int(os.getenv("LIVE_PRICES_BLOCK_MS", 5000))
+LIVE_METRICS_KEY = os.getenv("LIVE_METRICS_KEY", "metrics:indicators_live")
+LIVE_TFS = ["M1", "M5", "M15"]
+TF_MINUTES = {"M1": 1, "M5": 5, "M15": 15}
+BAR_CHANNELS = {"ohlcv_m1_ready": "M1", "ohlcv_m5_ready": "M5", "ohlcv_m15_ready": "M15"}
 
 # 2. Глобальный кэш свечей (в памяти)
-ohlcv_cache = {}  # структура: {symbol: {tf: DataFrame}}
+ohlcv_cache = {}  # структура: {symbol: {tf: deque[(open_time, high, low, close, volume)]}} — окно фиксированного размера
 smi_params = {}   # структура: {(symbol, tf): (k, d, s)}
+live_states = {}  # структура: {(symbol, tf): [LiveIndicator]} — состояния по закрытым барам (live_registry)
+last_prices = {}  # структура: {symbol: float} — последняя mark price
+precisions = {}   # структура: {symbol: precision_price}
 
 # 3. Загрузка глобальных параметров SMI из indicator_settings
 async def load_smi_params(pg_pool) -> tuple[int, int, int]:
@@ -36,11 +47,11 @@ async def load_smi_params(pg_pool) -> tuple[int, int, int]:
         print(f"[ERROR] Не удалось загрузить глобальные параметры SMI: {e}", flush=True)
         return 13, 5, 3
 
-# 4. Загрузка последних N баров из базы
+# 4. Загрузка последних N баров из базы (ohlcv2_* — те же таблицы, о барах которых приходят события ohlcv_*_ready)
 async def load_last_n_bars(pg_pool, symbol: str, tf: str, limit: int = 100) -> pd.DataFrame:
-    table = f"ohlcv_{tf.lower()}"
+    table = f"ohlcv2_{tf.lower()}"
     query = f"""
-        SELECT open_time, high, low, close
+        SELECT open_time, high, low, close, volume
         FROM {table}
         WHERE symbol = $1
         ORDER BY open_time DESC
@@ -48,33 +59,41 @@ async def load_last_n_bars(pg_pool, symbol: str, tf: str, limit: int = 100) -> p
     """
     try:
         rows = await pg_pool.fetch(query, symbol)
-        df = pd.DataFrame(rows, columns=["open_time", "high", "low", "close"])
+        df = pd.DataFrame(rows, columns=["open_time", "high", "low", "close", "volume"])
         df = df[::-1].reset_index(drop=True)
         return df
     except Exception as e:
         print(f"[ERROR] Не удалось загрузить свечи {tf} для {symbol}: {e}", flush=True)
         return pd.DataFrame()
 
-# 5. Синхронизация тикеров и инициализация кэша
+# 5. Загрузка окна баров и состояний live-индикаторов для одной пары (symbol, tf)
+async def load_symbol_tf(pg_pool, symbol: str, tf: str, k: int, d: int, s: int):
+    bars_needed = history_bars((k, d, s))
+    df = await load_last_n_bars(pg_pool, symbol, tf, bars_needed)
+    if df.empty:
+        return
+    window = deque(
+        ((t, float(h), float(l), float(c), float(v)) for t, h, l, c, v in df.itertuples(index=False, name=None)),
+        maxlen=bars_needed
+    )
+    ohlcv_cache.setdefault(symbol, {})[tf] = window
+    smi_params[(symbol, tf)] = (k, d, s)
+    live_states[(symbol, tf)] = build_live_indicators(window, (k, d, s))
+    print(f"[INIT] Загружено {len(df)} баров для {symbol}/{tf}", flush=True)
+
+# 5.1 Синхронизация тикеров и инициализация кэша
 async def sync_active_symbols(pg_pool):
-    query = "SELECT symbol FROM tickers WHERE status = 'enabled'"
+    query = "SELECT symbol, precision_price FROM tickers WHERE status = 'enabled'"
     try:
         rows = await pg_pool.fetch(query)
         symbols = [r["symbol"] for r in rows]
-        tfs = ["M1", "M5", "M15"]
+        precisions.update({r["symbol"]: r["precision_price"] for r in rows})
         k, d, s = await load_smi_params(pg_pool)
         for symbol in symbols:
-            if symbol not in ohlcv_cache:
-                ohlcv_cache[symbol] = {}
-            for tf in tfs:
-                if tf in ohlcv_cache[symbol]:
+            for tf in LIVE_TFS:
+                if tf in ohlcv_cache.get(symbol, {}):
                     continue
-                bars_needed = k + d + s + 10
-                df = await load_last_n_bars(pg_pool, symbol, tf, bars_needed)
-                if not df.empty:
-                    ohlcv_cache[symbol][tf] = df
-                    smi_params[(symbol, tf)] = (k, d, s)
-                    print(f"[INIT] Загружено {len(df)} баров для {symbol}/{tf}", flush=True)
+                await load_symbol_tf(pg_pool, symbol, tf, k, d, s)
     except Exception as e:
         print(f"[ERROR] sync_active_symbols: {e}", flush=True)
 
@@ -101,6 +120,7 @@ async def main():
 
         await sync_active_symbols(pg_pool)
         asyncio.create_task(periodic_sync(pg_pool))
+        asyncio.create_task(listen_bar_close(redis, pg_pool))
         await run_live_loop(redis)
 
     except Exception as e:
@@ -119,39 +139,163 @@ async def periodic_sync(pg_pool):
         await asyncio.sleep(300)
         await sync_active_symbols(pg_pool)
 
-# 8. Главный цикл расчёта SMI по всем тикерам и TF
+# 8. Пересчёт live-значений по тикерам с новой ценой: все HSET и метрики одним pipeline
+#    Каждый индикатор — O(1) на пробный бар, пересчитываются только тикеры с новой ценой;
+#    цены, пришедшие во время расчёта, сливаются в следующем чтении (не более одного расчёта на тикер за цикл)
+async def publish_live(redis, symbols, lag_ms=None):
+    started = time.perf_counter()
+    pipe = redis.pipeline(transaction=False)
+    written = 0
+    computed = 0
+    for symbol in symbols:
+        mark_price = last_prices.get(symbol)
+        precision_price = precisions.get(symbol)
+        if mark_price is None or precision_price is None:
+            continue
+        for tf in LIVE_TFS:
+            indicators = live_states.get((symbol, tf))
+            if indicators is None:
+                continue
+
+            # Mark price — пробный бар поверх состояний закрытых баров (состояния не меняются)
+            mapping = {}
+            for indicator in indicators:
+                mapping.update(indicator.preview(mark_price, precision_price))
+            computed += len(indicators)
+            mapping = {name: value for name, value in mapping.items() if value is not None}
+
+            if mapping:
+                pipe.hset(f"indicators_live:{symbol}:{tf}", mapping=mapping)
+                written += 1
+
+    metrics = {
+        "cycle_ms": round((time.perf_counter() - started) * 1000, 2),
+        "symbols_updated": len(symbols),
+        "indicators_computed": computed,
+        "hashes_written": written,
+        "updated_at": time.time()
+    }
+    if lag_ms is not None:
+        metrics["price_lag_ms"] = round(lag_ms, 1)
+    pipe.hset(LIVE_METRICS_KEY, mapping=metrics)
+    await pipe.execute()
+
+# 9. Стартовые цены: один MGET по всем тикерам
+async def load_prices(redis):
+    symbols = sorted({symbol for symbol, _ in live_states})
+    if not symbols:
+        return set()
+    values = await redis.mget([f"price:{symbol}" for symbol in symbols])
+    loaded = set()
+    for symbol, raw in zip(symbols, values):
+        try:
+            last_prices[symbol] = float(raw)
+            loaded.add(symbol)
+        except (TypeError, ValueError):
+            continue
+    return loaded
+
+# 10. Главный цикл: обновления mark price из потока, пересчёт только изменившихся тикеров
 async def run_live_loop(redis):
-    print("[LOOP] Запуск цикла расчёта SMI", flush=True)
+    print("[LOOP] Запуск цикла расчёта live-индикаторов", flush=True)
+    last_id = "$"
+    try:
+        await publish_live(redis, await load_prices(redis))
+    except Exception as e:
+        print(f"[ERROR] Стартовый расчёт live-индикаторов: {e}", flush=True)
+
     while True:
         try:
-            await asyncio.sleep(2)
-            for symbol in ohlcv_cache:
-                for tf, df_base in ohlcv_cache[symbol].items():
-                    price_key = f"price:{symbol}"
-                    mark_price_raw = await redis.get(price_key)
-                    if not mark_price_raw:
-                        continue
-                    try:
-                        mark_price = float(mark_price_raw)
-                    except:
-                        continue
-                    virtual_row = {"high": mark_price, "low": mark_price, "close": mark_price}
-                    df_virtual = pd.concat([df_base, pd.DataFrame([virtual_row])], ignore_index=True)
-
-                    k, d, s = smi_params.get((symbol, tf), (13, 5, 3))
-                    result = await calculate_smi(df_virtual, k, d, s)
-                    smi = result.get("smi")
-                    smi_signal = result.get("smi_signal")
-
-                    if smi is not None and smi_signal is not None:
-                        redis_key = f"indicators_live:{symbol}:{tf}"
-                        await redis.hset(redis_key, mapping={
-                            "smi": smi,
-                            "smi_signal": smi_signal
-                        })
+            response = await redis.xread({PRICES_STREAM: last_id}, block=PRICES_BLOCK_MS)
+            if not response:
+                continue
+
+            # Несколько сообщений за чтение — берём последнюю цену по каждому тикеру
+            changed = set()
+            for _, entries in response:
+                for entry_id, fields in entries:
+                    last_id = entry_id
+                    for symbol, raw in fields.items():
+                        symbol = symbol.decode() if isinstance(symbol, bytes) else symbol
+                        try:
+                            price = float(raw)
+                        except (TypeError, ValueError):
+                            continue
+                        if last_prices.get(symbol) != price:
+                            last_prices[symbol] = price
+                            changed.add(symbol)
+
+            if not changed:
+                continue
+
+            # Отставание от mark price: время записи последнего сообщения потока (ms в его id)
+            entry_ms = int((last_id.decode() if isinstance(last_id, bytes) else last_id).split("-")[0])
+            await publish_live(redis, changed, time.time() * 1000 - entry_ms)
         except Exception as e:
             print(f"[ERROR] Ошибка в run_live_loop: {e}", flush=True)
+            await asyncio.sleep(1)
+
+# 11. Закрытый бар из события (OHLCV в payload) или одной строкой из БД
+async def fetch_closed_bar(pg_pool, symbol: str, tf: str, open_time: datetime, data: dict):
+    if all(col in data for col in ("high", "low", "close", "volume")):
+        return float(data["high"]), float(data["low"]), float(data["close"]), float(data["volume"])
+    row = await pg_pool.fetchrow(
+        f"""
+        SELECT high, low, close, volume
+        FROM ohlcv2_{tf.lower()}
+        WHERE symbol = $1 AND open_time = $2
+        """,
+        symbol, open_time
+    )
+    if row is None:
+        return None
+    return float(row["high"]), float(row["low"]), float(row["close"]), float(row["volume"])
+
+# 12. Сдвиг окна на закрытый бар: добавление бара и шаг состояний live-индикаторов
+async def roll_bar(redis, pg_pool, symbol: str, tf: str, open_time: datetime, data: dict):
+    window = ohlcv_cache.get(symbol, {}).get(tf)
+    indicators = live_states.get((symbol, tf))
+    if not window or indicators is None:
+        return
+
+    last_time = window[-1][0]
+    if open_time <= last_time:
+        return  # бар уже в окне (повтор события или repair задним числом)
+
+    # Разрыв в последовательности баров — окно неполное, перечитываем из БД
+    if open_time > last_time + timedelta(minutes=TF_MINUTES[tf]):
+        print(f"[WARN] Разрыв баров {symbol}/{tf}: {last_time} → {open_time}, окно перезагружено", flush=True)
+        await load_symbol_tf(pg_pool, symbol, tf, *smi_params[(symbol, tf)])
+    else:
+        bar = await fetch_closed_bar(pg_pool, symbol, tf, open_time, data)
+        if bar is None:
+            print(f"[WARN] Бар не найден: {symbol}/{tf}/{open_time.isoformat()}", flush=True)
+            return
+        window.append((open_time, *bar))
+        for indicator in indicators:
+            indicator.update(*bar)
+
+    await publish_live(redis, {symbol})
+
+# 13. Подписка на готовность баров: окна сдвигаются на каждом закрытии бара
+async def listen_bar_close(redis, pg_pool):
+    pubsub = redis.pubsub()
+    await pubsub.subscribe(*BAR_CHANNELS)
+    print(f"[PUBSUB] Подписка на {', '.join(BAR_CHANNELS)}", flush=True)
+
+    async for msg in pubsub.listen():
+        if msg["type"] != "message":
+            continue
+        try:
+            channel = msg["channel"].decode() if isinstance(msg["channel"], bytes) else msg["channel"]
+            data = json.loads(msg["data"])
+            tf = BAR_CHANNELS.get(channel)
+            if tf is None or data.get("action") not in ("m1_ready", "aggregate_ready"):
+                continue
+            await roll_bar(redis, pg_pool, data["symbol"], tf, datetime.fromisoformat(data["open_time"]), data)
+        except Exception as e:
+            print(f"[ERROR] Обработка закрытия бара: {e}", flush=True)
 
-# 9. Запуск
+# 14. Запуск
 if __name__ == "__main__":
     asyncio.run(main())
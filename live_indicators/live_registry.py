@@ -0,0 +1,132 @@
+# live_registry.py
+# Реестр live-индикаторов: состояние по закрытым барам + пробный бар по mark price.
+# Поля публикуются в indicators_live:{symbol}:{tf} под теми же именами, что param_name в indicator_values_v2
+# (ema50, rsi14, lr_angle, ...) — стратегия выбирает между live и закрытым значением по одному имени.
+# Исключение — MFI: без объёма текущего бара live-значение равно значению последнего закрытого бара.
+
+import os
+from smi_live import SmiState
+
+# Состояния EMA/RSI/ATR/MFI/LR — общий пакет trading_common (одни формулы для закрытых и live-значений)
+from trading_common.indicator_core import EmaState, RsiState, AtrState, MfiState, LrState
+
+# 1. Набор live-индикаторов: "EMA:50,RSI:14,MFI:14,ATR:14,LR:50" (SMI — всегда, параметры из indicator_settings)
+LIVE_INDICATORS = os.getenv("LIVE_INDICATORS", "EMA:50,RSI:14,MFI:14,ATR:14,LR:50")
+
+# 2. Базовый live-индикатор: update — закрытый бар, preview — пробный бар (состояние не меняется)
+class LiveIndicator:
+    state_class = None
+
+    def __init__(self, length: int):
+        self.length = length
+        self.state = self.state_class(length)
+        self.closed = None  # значение на последнем закрытом баре
+
+    def update(self, high: float, low: float, close: float, volume: float):
+        self.closed = self.state.update(high, low, close, volume)
+
+    # Пробный бар: high = low = close = mark price (индикаторам по ценам объём не нужен)
+    def preview(self, price: float, precision_price: int) -> dict:
+        value = self.state.preview(price, price, price, 0.0)
+        if value is None:
+            return {}
+        return self.fields(value, precision_price)
+
+class LiveEma(LiveIndicator):
+    state_class = EmaState
+
+    def fields(self, value, precision_price):
+        return {f"ema{self.length}": round(float(value), precision_price)}
+
+class LiveRsi(LiveIndicator):
+    state_class = RsiState
+
+    def fields(self, value, precision_price):
+        return {f"rsi{self.length}": round(float(value), 2)}
+
+# MFI взвешивает поток объёмом, а объёма текущего бара в потоке mark price нет:
+# пробный бар с нулевым объёмом занижал бы поток. Публикуется значение последнего закрытого бара.
+class LiveMfi(LiveIndicator):
+    state_class = MfiState
+
+    def preview(self, price: float, precision_price: int) -> dict:
+        if self.closed is None:
+            return {}
+        return self.fields(self.closed, precision_price)
+
+    def fields(self, value, precision_price):
+        return {f"mfi{self.length}": round(float(value), 2)}
+
+class LiveAtr(LiveIndicator):
+    state_class = AtrState
+
+    def fields(self, value, precision_price):
+        return {f"atr{self.length}": round(float(value), precision_price)}
+
+class LiveLr(LiveIndicator):
+    state_class = LrState
+
+    def fields(self, value, precision_price):
+        upper, lower, mid, angle = value
+        return {
+            "lr_upper": round(upper, precision_price),
+            "lr_lower": round(lower, precision_price),
+            "lr_mid": round(mid, precision_price),
+            "lr_angle": round(angle, 5)
+        }
+
+class LiveSmi:
+    def __init__(self, k: int, d: int, s: int):
+        self.state = SmiState(k, d, s)
+
+    def update(self, high: float, low: float, close: float, volume: float):
+        self.state.update(high, low, close)
+
+    def preview(self, price: float, precision_price: int) -> dict:
+        return self.state.preview(price, price, price)
+
+LIVE_REGISTRY = {
+    "EMA": LiveEma,
+    "RSI": LiveRsi,
+    "MFI": LiveMfi,
+    "ATR": LiveAtr,
+    "LR": LiveLr,
+}
+
+# 3. Разбор LIVE_INDICATORS → [(kind, length)]; LR — одна длина (поля без длины, как в indicator_values_v2)
+def parse_live_indicators(value: str) -> list:
+    specs = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            kind, length = item.split(":")
+            kind, length = kind.strip().upper(), int(length)
+        except ValueError:
+            print(f"[WARN] Некорректный live-индикатор: {item}", flush=True)
+            continue
+        if kind not in LIVE_REGISTRY:
+            print(f"[WARN] Live-индикатор {kind} не поддерживается", flush=True)
+            continue
+        if kind == "LR" and any(k == "LR" for k, _ in specs):
+            print(f"[WARN] LR: допускается одна длина, {item} пропущен", flush=True)
+            continue
+        specs.append((kind, length))
+    return specs
+
+LIVE_SPECS = parse_live_indicators(LIVE_INDICATORS)
+
+# 4. Набор live-индикаторов для (symbol, tf), прогретый по истории баров [(open_time, high, low, close, volume)]
+def build_live_indicators(bars, smi_params: tuple) -> list:
+    indicators = [LiveSmi(*smi_params)] + [LIVE_REGISTRY[kind](length) for kind, length in LIVE_SPECS]
+    for _, high, low, close, volume in bars:
+        for indicator in indicators:
+            indicator.update(high, low, close, volume)
+    return indicators
+
+# 5. Длина истории для прогрева (EMA сходится за несколько длин)
+def history_bars(smi_params: tuple) -> int:
+    k, d, s = smi_params
+    needed = [k + d + s + 10] + [length * 5 if kind in ("EMA", "RSI", "ATR") else length for kind, length in LIVE_SPECS]
+    return max(needed)
@@ -1,34 +1,79 @@
 # smi_live.py
-# Расчёт индикатора SMI по проверенной формуле (идентично историческим расчётам)
+# Инкрементальное состояние SMI по (symbol, tf): закрытые бары продвигают состояние (update),
+# текущая mark price — пробный бар (preview) без изменения состояния.
+# O(1) на тик; результат совпадает с эталонным расчётом по всей истории (smi_parity_check.py)
 
-import pandas as pd
 import numpy as np
+from collections import deque
 
-# 1. Вспомогательная функция: двойное EMA
-def double_ema(series, period):
-    ema1 = series.ewm(span=period, adjust=False).mean()
-    ema2 = ema1.ewm(span=period, adjust=False).mean()
-    return ema2
+# 1. Коэффициент как в pandas.ewm(span=...) (через center of mass)
+def ewm_alpha(span):
+    com = (span - 1) / 2
+    return 1 / (1 + com)
 
-# 2. Расчёт SMI (тот же, что и в indicators_main.py)
-async def calculate_smi(df: pd.DataFrame, k: int, d: int, s: int) -> dict:
-    try:
-        df[["high", "low", "close"]] = df[["high", "low", "close"]].astype(float)
+# 2. Один шаг ewm(adjust=False) по алгоритму pandas: (значение, вес) → (значение, вес)
+#    NaN до первого наблюдения пропускаются, NaN после — уменьшают вес старого значения
+def ewm_next(state, value, alpha):
+    weighted, old_wt = state
+    if weighted != weighted:
+        return value, old_wt
+    old_wt *= 1 - alpha
+    if value == value:
+        if weighted != value:
+            weighted = (old_wt * weighted + alpha * value) / (old_wt + alpha)
+        old_wt = 1.0
+    return weighted, old_wt
 
-        hh = df['high'].rolling(window=k).max()
-        ll = df['low'].rolling(window=k).min()
+# 3. Состояние SMI: окно hh/ll за k баров и цепочка EMA
+class SmiState:
+    EMPTY = (float("nan"), 1.0)
+
+    def __init__(self, k: int, d: int, s: int):
+        self.k = k
+        self.alpha_d = ewm_alpha(d)
+        self.alpha_s = ewm_alpha(s)
+        self.highs = deque(maxlen=k)
+        self.lows = deque(maxlen=k)
+        self.emas = (self.EMPTY,) * 5  # rel → rel², range → range², smi → signal
+        self.carry_high = float("-inf")  # max/min последних k-1 баров — остаются в окне пробного бара
+        self.carry_low = float("inf")
+
+    # 3.1 Шаг по бару: hh/ll окна (NaN, пока окно не заполнено) → новые состояния EMA и значения
+    def advance(self, hh, ll, close):
         center = (hh + ll) / 2
         range_ = hh - ll
-        rel = df['close'] - center
+        rel = close - center
+
+        rel1, rel2, rng1, rng2, signal = self.emas
+        rel1 = ewm_next(rel1, rel, self.alpha_d)
+        rel2 = ewm_next(rel2, rel1[0], self.alpha_d)
+        rng1 = ewm_next(rng1, range_, self.alpha_d)
+        rng2 = ewm_next(rng2, rng1[0], self.alpha_d)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            smi_raw = 200 * (np.float64(rel2[0]) / np.float64(rng2[0]))
+        signal = ewm_next(signal, smi_raw, self.alpha_s)
+        return (rel1, rel2, rng1, rng2, signal), smi_raw, signal[0]
 
-        smi_raw = 200 * (double_ema(rel, d) / double_ema(range_, d))
-        smi_signal = smi_raw.ewm(span=s, adjust=False).mean()
+    def window(self, high, low, filled):
+        if not filled:
+            return float("nan"), float("nan")
+        return max(self.carry_high, high), min(self.carry_low, low)
 
+    # 3.2 Закрытый бар — продвигает состояние
+    def update(self, high: float, low: float, close: float):
+        hh, ll = self.window(high, low, len(self.highs) >= self.k - 1)
+        self.emas, _, _ = self.advance(hh, ll, close)
+        self.highs.append(high)
+        self.lows.append(low)
+        if self.k > 1:
+            self.carry_high = max(list(self.highs)[-(self.k - 1):])
+            self.carry_low = min(list(self.lows)[-(self.k - 1):])
+
+    # 3.3 Пробный бар (mark price) — значения без изменения состояния
+    def preview(self, high: float, low: float, close: float) -> dict:
+        hh, ll = self.window(high, low, len(self.highs) >= self.k - 1)
+        _, smi_raw, smi_signal = self.advance(hh, ll, close)
         return {
-            "smi": round(smi_raw.iloc[-1], 2),
-            "smi_signal": round(smi_signal.iloc[-1], 2)
+            "smi": round(np.float64(smi_raw), 2),
+            "smi_signal": round(np.float64(smi_signal), 2)
         }
-
-    except Exception as e:
-        print(f"[ERROR] SMI расчёт не удался: {e}", flush=True)
-        return {"smi": None, "smi_signal": None}
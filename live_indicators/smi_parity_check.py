@@ -0,0 +1,87 @@
+import argparse
+import sys
+import numpy as np
+import pandas as pd
+
+from smi_live import SmiState
+
+# 🔸 Сверка инкрементального SmiState (preview по mark price) с эталонным расчётом SMI на pandas
+#
+# Запуск: python smi_parity_check.py [--k 13 --d 5 --s 3 --bars 600]
+# Для каждого бара эталон считается по всей истории + пробному бару, SmiState — update по закрытым барам + preview.
+# Значения округлены до 2 знаков, поэтому сравниваются точно. Код возврата 1 — есть расхождения.
+
+# 1. Эталон: двойное EMA
+def double_ema(series, period):
+    ema1 = series.ewm(span=period, adjust=False).mean()
+    ema2 = ema1.ewm(span=period, adjust=False).mean()
+    return ema2
+
+# 2. Эталон: расчёт SMI по всей истории (как в indicators_main.py)
+def calculate_smi(df: pd.DataFrame, k: int, d: int, s: int) -> dict:
+    df = df[["high", "low", "close"]].astype(float)
+
+    hh = df['high'].rolling(window=k).max()
+    ll = df['low'].rolling(window=k).min()
+    center = (hh + ll) / 2
+    range_ = hh - ll
+    rel = df['close'] - center
+
+    smi_raw = 200 * (double_ema(rel, d) / double_ema(range_, d))
+    smi_signal = smi_raw.ewm(span=s, adjust=False).mean()
+
+    return {
+        "smi": round(smi_raw.iloc[-1], 2),
+        "smi_signal": round(smi_signal.iloc[-1], 2)
+    }
+
+# 3. Наборы баров: случайное блуждание, плоский рынок (нулевой диапазон), короткая история
+def make_cases(bars: int, k: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    close = 100 + rng.normal(0, 1, bars).cumsum()
+    spread = rng.uniform(0.1, 2.0, bars)
+    flat = np.full(bars, 100.0)
+    short = k + 2
+    return {
+        "random": pd.DataFrame({"high": close + spread, "low": close - spread, "close": close}),
+        "flat": pd.DataFrame({"high": flat, "low": flat, "close": flat}),
+        "short": pd.DataFrame({"high": close[:short] + spread[:short], "low": close[:short] - spread[:short], "close": close[:short]}),
+    }
+
+def same(a, b) -> bool:
+    return (a != a and b != b) or a == b
+
+# 4. Сверка одного набора: число баров и число расхождений
+def check_case(df: pd.DataFrame, k: int, d: int, s: int):
+    state = SmiState(k, d, s)
+    mismatches = 0
+    for i, (high, low, close) in enumerate(df[["high", "low", "close"]].itertuples(index=False)):
+        live = state.preview(high, low, close)
+        ref = calculate_smi(df.iloc[:i + 1], k, d, s)
+        if not all(same(float(live[key]), float(ref[key])) for key in ref):
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"  бар {i}: live={live} эталон={ref}")
+        state.update(high, low, close)
+    return len(df), mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="Сверка SmiState с эталонным SMI на pandas")
+    parser.add_argument("--k", type=int, default=13)
+    parser.add_argument("--d", type=int, default=5)
+    parser.add_argument("--s", type=int, default=3)
+    parser.add_argument("--bars", type=int, default=600)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    failed = False
+    for name, df in make_cases(args.bars, args.k, args.seed).items():
+        bars, mismatches = check_case(df, args.k, args.d, args.s)
+        status = "OK" if mismatches == 0 else "FAIL"
+        failed |= mismatches > 0
+        print(f"{status:4} {name:<7} баров={bars:<5} расхождений={mismatches}")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
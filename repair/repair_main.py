@@ -2,160 +2,194 @@ import os
 import asyncpg
 import asyncio
 import aiohttp
-import json
 from datetime import datetime, timedelta
 import time
 import sys
+from trading_common.binance_weight import WeightBucket
 
-# Проверка на пропуски M1-свечей по тикеру
-def detect_gaps(rows):
+# Параллельность обработки тикеров и размер страницы курсора
+SYMBOL_CONCURRENCY = int(os.getenv("REPAIR_CONCURRENCY", 4))
+CURSOR_PREFETCH = 1000
+KLINES_URL = "https://fapi.binance.com/fapi/v1/klines"
+KLINES_LIMIT = 1500
+KLINES_WEIGHT = 10  # вес запроса klines при limit > 1000
+WEIGHT_LIMIT = int(os.getenv("BINANCE_WEIGHT_LIMIT", 2400))     # лимит веса в минуту на IP
+WEIGHT_RESERVE = int(os.getenv("BINANCE_WEIGHT_RESERVE", 600))  # запас для остальных клиентов
+
+weight_bucket = WeightBucket(WEIGHT_LIMIT - WEIGHT_RESERVE)
+
+# Поиск разрывов на стороне БД: LAG() по истории тикера, читаем курсором только разрывы
+async def detect_gaps(conn, symbol):
     gaps = []
-    for i in range(1, len(rows)):
-        prev = rows[i - 1]['open_time']
-        curr = rows[i]['open_time']
-        delta = (curr - prev).total_seconds()
-        if delta > 60:
-            gaps.append((prev, curr, int(delta)))
+    async with conn.transaction():
+        cursor = conn.cursor("""
+            SELECT prev_time, open_time
+            FROM (
+                SELECT open_time, LAG(open_time) OVER (ORDER BY open_time) AS prev_time
+                FROM ohlcv_m1
+                WHERE symbol = $1
+            ) t
+            WHERE open_time - prev_time > interval '1 minute'
+        """, symbol, prefetch=CURSOR_PREFETCH)
+        async for row in cursor:
+            prev, curr = row['prev_time'], row['open_time']
+            gaps.append((prev, curr, int((curr - prev).total_seconds())))
     return gaps
 
-# Определение всех затронутых интервалов
-def collect_affected_intervals(inserted_times):
-    m5_set = set()
-    m15_set = set()
-    for ts in inserted_times:
-        ts = ts.replace(second=0, microsecond=0)
-        m5 = ts.replace(minute=(ts.minute // 5) * 5)
-        m15 = ts.replace(minute=(ts.minute // 15) * 15)
-        m5_set.add(m5)
-        m15_set.add(m15)
-    return sorted(m5_set), sorted(m15_set)
-
-# Запрос недостающих свечей у Binance
-async def fetch_klines(symbol, start_time, end_time):
-    url = "https://fapi.binance.com/fapi/v1/klines"
-    params = {
-        "symbol": symbol,
-        "interval": "1m",
-        "startTime": int(start_time.timestamp() * 1000),
-        "endTime": int(end_time.timestamp() * 1000),
-        "limit": 1000
-    }
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, params=params) as resp:
+# Диапазоны M15 (и вложенных M5), затронутые разрывами; пересекающиеся диапазоны объединяются
+def collect_affected_ranges(gaps):
+    ranges = []
+    for prev, curr, _ in sorted(gaps):
+        start = prev + timedelta(minutes=1)
+        start = start.replace(minute=(start.minute // 15) * 15, second=0, microsecond=0)
+        end = curr.replace(minute=(curr.minute // 15) * 15, second=0, microsecond=0) + timedelta(minutes=15)
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+        else:
+            ranges.append((start, end))
+    return ranges
+
+# Запрос недостающих свечей у Binance постранично (общая HTTP-сессия и общий лимит веса):
+# страница отдаётся сразу, в памяти — не больше одной страницы
+async def fetch_klines(session, symbol, start_time, end_time):
+    start_ms = int(start_time.timestamp() * 1000)
+    end_ms = int(end_time.timestamp() * 1000)
+    while start_ms <= end_ms:
+        params = {
+            "symbol": symbol,
+            "interval": "1m",
+            "startTime": start_ms,
+            "endTime": end_ms,
+            "limit": KLINES_LIMIT
+        }
+        await weight_bucket.acquire(KLINES_WEIGHT)
+        async with session.get(KLINES_URL, params=params) as resp:
+            used = resp.headers.get("X-MBX-USED-WEIGHT-1M")
+            if used is not None:
+                weight_bucket.sync(int(used))
+
+            if resp.status in (418, 429):
+                retry_after = int(resp.headers.get("Retry-After", 60))
+                print(f"[API] Binance ограничил запросы ({resp.status}), пауза {retry_after} сек", flush=True)
+                await asyncio.sleep(retry_after)
+                continue
+
             if resp.status != 200:
                 print(f"[ERROR] Binance API для {symbol}: {resp.status}", flush=True)
-                return []
+                return
             data = await resp.json()
-            return data
+        if not data:
+            return
+        yield data
+        if len(data) < KLINES_LIMIT:
+            return
+        start_ms = data[-1][0] + 60_000
 
-# Вставка свечей в базу + возврат всех open_time
+# Вставка страницы свечей одним запросом; возвращает число действительно вставленных
+# (уже существующие свечи пропускаются ON CONFLICT DO NOTHING)
 async def insert_klines(conn, symbol, klines):
-    inserted = 0
-    inserted_times = []
-    for k in klines:
-        open_time = datetime.fromtimestamp(k[0] / 1000)
-        try:
-            await conn.execute("""
-                INSERT INTO ohlcv_m1 (symbol, open_time, open, high, low, close, volume)
-                VALUES ($1, $2, $3, $4, $5, $6, $7)
-                ON CONFLICT (symbol, open_time) DO NOTHING
-            """, symbol, open_time, k[1], k[2], k[3], k[4], k[5])
-            inserted += 1
-            inserted_times.append(open_time)
-        except Exception as e:
-            print(f"[ERROR] Вставка свечи {symbol} @ {open_time}: {e}", flush=True)
-    print(f"[DB] {symbol}: вставлено {inserted} свечей", flush=True)
-    return inserted_times
-
-# Пересчёт M5
-async def reaggregate_m5(conn, symbol, m5_open):
-    rows = await conn.fetch("""
-        SELECT * FROM ohlcv_m1
-        WHERE symbol = $1 AND open_time >= $2 AND open_time < $3
-        ORDER BY open_time ASC
-    """, symbol, m5_open, m5_open + timedelta(minutes=5))
-    if len(rows) != 5:
-        return
-    await conn.execute("DELETE FROM ohlcv_m5 WHERE symbol = $1 AND open_time = $2", symbol, m5_open)
-    await conn.execute("""
-        INSERT INTO ohlcv_m5 (symbol, open_time, open, high, low, close, volume, complete)
-        VALUES ($1, $2, $3, $4, $5, $6, $7, TRUE)
-    """, symbol, m5_open,
-        rows[0]['open'],
-        max(r['high'] for r in rows),
-        min(r['low'] for r in rows),
-        rows[-1]['close'],
-        sum(r['volume'] for r in rows))
-    print(f"[M5] Пересчитано {symbol} @ {m5_open}", flush=True)
-
-# Пересчёт M15
-async def reaggregate_m15(conn, symbol, m15_open):
-    rows = await conn.fetch("""
-        SELECT * FROM ohlcv_m1
-        WHERE symbol = $1 AND open_time >= $2 AND open_time < $3
-        ORDER BY open_time ASC
-    """, symbol, m15_open, m15_open + timedelta(minutes=15))
-    if len(rows) != 15:
-        return
-    await conn.execute("DELETE FROM ohlcv_m15 WHERE symbol = $1 AND open_time = $2", symbol, m15_open)
-    await conn.execute("""
-        INSERT INTO ohlcv_m15 (symbol, open_time, open, high, low, close, volume, complete)
-        VALUES ($1, $2, $3, $4, $5, $6, $7, TRUE)
-    """, symbol, m15_open,
-        rows[0]['open'],
-        max(r['high'] for r in rows),
-        min(r['low'] for r in rows),
-        rows[-1]['close'],
-        sum(r['volume'] for r in rows))
-    print(f"[M15] Пересчитано {symbol} @ {m15_open}", flush=True)
-
-async def check_symbol(conn, symbol):
-    print(f"[CHECK] {symbol}: проверка на пропуски...", flush=True)
-    rows = await conn.fetch("""
-        SELECT open_time
-        FROM ohlcv_m1
-        WHERE symbol = $1
-        ORDER BY open_time ASC
-    """, symbol)
-
-    if not rows:
-        print(f"[WARN] Нет данных по {symbol}", flush=True)
-        return
-
-    # Предварительно: вывести сообщение о возможности повреждённых M5/M15
-    print(f"[INFO] {symbol}: ранее могли быть записаны неверные M5/M15. Требуется пересчёт.", flush=True)
-
-    gaps = detect_gaps(rows)
-    if not gaps:
-        print(f"[OK] {symbol}: без пропусков", flush=True)
-        return
-
-    print(f"[GAPS] {symbol}: найдено {len(gaps)} разрывов", flush=True)
-    all_inserted = []
-    for prev, curr, delta in gaps:
-        print(f"  ⛔ {symbol} | {prev} → {curr} = {delta} сек", flush=True)
-        print(f"[API] Запрос свечей {symbol} @ {prev + timedelta(minutes=1)} → {curr}", flush=True)
-        klines = await fetch_klines(symbol, prev + timedelta(minutes=1), curr)
-        inserted = await insert_klines(conn, symbol, klines)
-        all_inserted.extend(inserted)
-
-    # Вычисляем все затронутые интервалы и пересчитываем агрегаты
-    m5_list, m15_list = collect_affected_intervals(all_inserted)
-    for ts in m5_list:
-        await reaggregate_m5(conn, symbol, ts)
-    for ts in m15_list:
-        await reaggregate_m15(conn, symbol, ts)
+    if not klines:
+        return 0
+    try:
+        rows = await conn.fetch("""
+            INSERT INTO ohlcv_m1 (symbol, open_time, open, high, low, close, volume)
+            SELECT $1, t.*
+            FROM unnest($2::timestamp[], $3::numeric[], $4::numeric[], $5::numeric[], $6::numeric[], $7::numeric[]) AS t
+            ON CONFLICT (symbol, open_time) DO NOTHING
+            RETURNING open_time
+        """,
+            symbol,
+            [datetime.fromtimestamp(k[0] / 1000) for k in klines],
+            [k[1] for k in klines],
+            [k[2] for k in klines],
+            [k[3] for k in klines],
+            [k[4] for k in klines],
+            [k[5] for k in klines]
+        )
+    except Exception as e:
+        print(f"[ERROR] Вставка свечей {symbol}: {e}", flush=True)
+        return 0
+    print(f"[DB] {symbol}: вставлено {len(rows)} из {len(klines)} свечей", flush=True)
+    return len(rows)
+
+# Пересчёт агрегатов (M5/M15) по диапазону: один DELETE и один INSERT ... SELECT ... GROUP BY date_bin
+async def reaggregate_range(conn, symbol, table, minutes, start, end):
+    bucket = f"date_bin('{minutes} minutes', open_time, TIMESTAMP '2000-01-01')"
+    async with conn.transaction():
+        await conn.execute(f"""
+            DELETE FROM {table}
+            WHERE symbol = $1
+              AND open_time IN (
+                  SELECT {bucket}
+                  FROM ohlcv_m1
+                  WHERE symbol = $1 AND open_time >= $2 AND open_time < $3
+                  GROUP BY 1
+                  HAVING count(*) = {minutes}
+              )
+        """, symbol, start, end)
+        result = await conn.execute(f"""
+            INSERT INTO {table} (symbol, open_time, open, high, low, close, volume, complete)
+            SELECT $1,
+                   {bucket},
+                   (array_agg(open ORDER BY open_time ASC))[1],
+                   max(high),
+                   min(low),
+                   (array_agg(close ORDER BY open_time DESC))[1],
+                   sum(volume),
+                   TRUE
+            FROM ohlcv_m1
+            WHERE symbol = $1 AND open_time >= $2 AND open_time < $3
+            GROUP BY 2
+            HAVING count(*) = {minutes}
+        """, symbol, start, end)
+    print(f"[{table.upper()}] Пересчитано {symbol} @ {start} → {end}: {result}", flush=True)
+
+async def check_symbol(pg_pool, session, semaphore, symbol):
+    async with semaphore, pg_pool.acquire() as conn:
+        print(f"[CHECK] {symbol}: проверка на пропуски...", flush=True)
+
+        # Предварительно: вывести сообщение о возможности повреждённых M5/M15
+        print(f"[INFO] {symbol}: ранее могли быть записаны неверные M5/M15. Требуется пересчёт.", flush=True)
+
+        gaps = await detect_gaps(conn, symbol)
+        if not gaps:
+            print(f"[OK] {symbol}: без пропусков", flush=True)
+            return
+
+        print(f"[GAPS] {symbol}: найдено {len(gaps)} разрывов", flush=True)
+        repaired = []
+        for prev, curr, delta in gaps:
+            print(f"  ⛔ {symbol} | {prev} → {curr} = {delta} сек", flush=True)
+            print(f"[API] Запрос свечей {symbol} @ {prev + timedelta(minutes=1)} → {curr}", flush=True)
+            inserted = 0
+            async for page in fetch_klines(session, symbol, prev + timedelta(minutes=1), curr):
+                inserted += await insert_klines(conn, symbol, page)
+            if inserted:
+                repaired.append((prev, curr, delta))
+
+        # Пересчитываем агрегаты по затронутым диапазонам
+        for start, end in collect_affected_ranges(repaired):
+            await reaggregate_range(conn, symbol, "ohlcv_m5", 5, start, end)
+            await reaggregate_range(conn, symbol, "ohlcv_m15", 15, start, end)
 
 async def main():
     db_url = os.getenv("DATABASE_URL")
-    conn = await asyncpg.connect(dsn=db_url)
-    symbols = await conn.fetch("SELECT DISTINCT symbol FROM ohlcv_m1")
-    for record in symbols:
-        symbol = record['symbol']
-        await check_symbol(conn, symbol)
-    await conn.close()
+    pg_pool = await asyncpg.create_pool(dsn=db_url, min_size=1, max_size=SYMBOL_CONCURRENCY)
+    symbols = await pg_pool.fetch("SELECT DISTINCT symbol FROM ohlcv_m1")
+    semaphore = asyncio.Semaphore(SYMBOL_CONCURRENCY)
+
+    async with aiohttp.ClientSession() as session:
+        results = await asyncio.gather(
+            *(check_symbol(pg_pool, session, semaphore, record['symbol']) for record in symbols),
+            return_exceptions=True
+        )
+    for record, result in zip(symbols, results):
+        if isinstance(result, Exception):
+            print(f"[ERROR] {record['symbol']}: {result}", flush=True)
+
+    await pg_pool.close()
 
 if __name__ == '__main__':
     asyncio.run(main())
     time.sleep(5)
-    sys.exit(0)
\ No newline at end of file
+    sys.exit(0)